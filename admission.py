@@ -0,0 +1,266 @@
+"""
+Admission control and load shedding in front of the verification pipeline.
+
+Under a spike, requests used to queue without bound behind the pipeline
+pool and then time out together. Now at most `max_concurrent` run at once
+(the pipeline pool size unless configured; runtime_config.py's sweep
+measures what a node sustains), up to `max_queue` wait for a slot in
+arrival order, and anything beyond is rejected at once with Overloaded,
+which carries a retry-after estimate:
+
+    with get_admission().admit() as ticket:      # may raise Overloaded
+        ctx = VerificationContext(..., deadline=ticket.deadline)
+        run_pipeline(ctx)
+
+A request is also shed up front when the measured service time says its
+wait would exceed the queue budget, instead of waiting for that to happen.
+Each admitted request gets a deadline; pipeline stages whose measured cost
+no longer fits the remaining budget are skipped (optional ones) or fail fast
+(see pipeline.stage), and are counted here via deadline_event().
+
+stats() and metrics_text() (Prometheus text format) export admissions, shed
+counts by reason, deadline skips and the queue-wait histogram; with
+ADMISSION_METRICS_FILE set they are written there after every request, for
+node_exporter's textfile collector.
+"""
+
+import os
+import math
+import time
+import bisect
+import logging
+import threading
+from collections import deque, Counter
+from contextlib import contextmanager
+from utils import read_yaml
+
+config_path = "config.yaml"
+config = read_yaml(config_path)
+runtime = config.get('runtime', {})
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", runtime.get('ADMISSION_MAX_CONCURRENT', 0)))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", runtime.get('ADMISSION_MAX_QUEUE', 16)))
+ADMISSION_QUEUE_TIMEOUT_S = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_S", runtime.get('ADMISSION_QUEUE_TIMEOUT_S', 10)))
+REQUEST_DEADLINE_S = float(os.getenv("REQUEST_DEADLINE_S", runtime.get('REQUEST_DEADLINE_S', 60)))
+ADMISSION_METRICS_FILE = os.getenv("ADMISSION_METRICS_FILE", config.get('artifacts', {}).get('ADMISSION_METRICS_FILE', ""))
+
+QUEUE_WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SERVICE_TIME_ALPHA = 0.2  # EWMA weight of the latest request's run time
+SHED_REASONS = ("queue_full", "expected_wait", "queue_timeout")
+
+
+class Overloaded(Exception):
+    """Request rejected by admission control; retry after `retry_after` seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Overloaded ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """An admitted request: its deadline (time.monotonic() based) and how long it queued."""
+
+    __slots__ = ("deadline", "queue_wait", "admitted_at")
+
+    def __init__(self, deadline, queue_wait, admitted_at):
+        self.deadline = deadline
+        self.queue_wait = queue_wait
+        self.admitted_at = admitted_at
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+
+class Histogram:
+    """Fixed-bucket histogram (Prometheus semantics: cumulative `le` buckets, sum, count)."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def cumulative(self):
+        """[(le, count)] including ("+Inf", total)."""
+        totals, running = [], 0
+        for le, count in zip(self.buckets + ("+Inf",), self.counts):
+            running += count
+            totals.append((le, running))
+        return totals
+
+
+# ---------------------------------------
+# Deadline events (recorded by pipeline stages)
+# ---------------------------------------
+_deadline_events = Counter()
+_deadline_lock = threading.Lock()
+
+
+def deadline_event(action, stage):
+    """Count a stage `action` ("skipped" or "failed") caused by the request deadline."""
+    with _deadline_lock:
+        _deadline_events[(action, stage)] += 1
+
+
+def deadline_events():
+    with _deadline_lock:
+        return dict(_deadline_events)
+
+
+# ---------------------------------------
+# Admission controller
+# ---------------------------------------
+class AdmissionController:
+    """
+    Concurrency limit with a bounded FIFO wait queue. Requests beyond the
+    queue, or whose expected wait exceeds `queue_timeout`, are shed with
+    Overloaded instead of hanging.
+    """
+
+    def __init__(self, max_concurrent, max_queue=ADMISSION_MAX_QUEUE, queue_timeout=ADMISSION_QUEUE_TIMEOUT_S,
+                 deadline=REQUEST_DEADLINE_S, metrics_file=ADMISSION_METRICS_FILE):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.deadline = deadline
+        self.metrics_file = metrics_file
+        self._cond = threading.Condition()
+        self._running = 0
+        self._queue = deque()
+        self._service_s = None
+        self._counts = Counter()
+        self._queue_wait = Histogram(QUEUE_WAIT_BUCKETS)
+
+    def busy(self):
+        """True when a new request would have to queue."""
+        with self._cond:
+            return self._running >= self.max_concurrent or bool(self._queue)
+
+    def _expected_wait(self, position):
+        """Seconds until the request at queue `position` (1 = next) gets a slot, from the measured service time."""
+        if self._service_s is None:
+            return 0.0
+        return position * self._service_s / self.max_concurrent
+
+    def _shed(self, reason):
+        self._counts[f"shed_{reason}"] += 1
+        retry_after = max(1, math.ceil(self._expected_wait(len(self._queue) + 1) or (self._service_s or 1.0)))
+        logging.warning("Request shed (%s): %s running, %s queued; retry after %ss",
+                        reason, self._running, len(self._queue), retry_after)
+        raise Overloaded(reason, retry_after)
+
+    def _acquire(self, start, deadline):
+        with self._cond:
+            if self._running < self.max_concurrent and not self._queue:
+                self._running += 1
+                return
+            if len(self._queue) >= self.max_queue:
+                self._shed("queue_full")
+            if self._expected_wait(len(self._queue) + 1) > self.queue_timeout:
+                self._shed("expected_wait")
+            turn = object()
+            self._queue.append(turn)
+            wait_until = start + min(self.queue_timeout, deadline - start)
+            try:
+                while self._queue[0] is not turn or self._running >= self.max_concurrent:
+                    remaining = wait_until - time.monotonic()
+                    if remaining <= 0:
+                        self._queue.remove(turn)
+                        self._shed("queue_timeout")
+                    self._cond.wait(remaining)
+                self._queue.popleft()
+                self._running += 1
+            finally:
+                self._cond.notify_all()
+
+    def acquire(self, deadline=None):
+        """
+        Take a pipeline slot, waiting in line if needed; returns a Ticket whose
+        deadline is `deadline` seconds (default REQUEST_DEADLINE_S) after
+        arrival, queueing included. Raises Overloaded when the request is shed.
+        Pair with release(ticket).
+        """
+        start = time.monotonic()
+        ticket_deadline = start + (self.deadline if deadline is None else deadline)
+        try:
+            self._acquire(start, ticket_deadline)
+        except Overloaded:
+            self.write_metrics()
+            raise
+        waited = time.monotonic() - start
+        with self._cond:
+            self._counts["admitted"] += 1
+            self._queue_wait.observe(waited)
+        return Ticket(ticket_deadline, waited, time.monotonic())
+
+    def release(self, ticket):
+        service_s = time.monotonic() - ticket.admitted_at
+        with self._cond:
+            self._running -= 1
+            if self._service_s is None:
+                self._service_s = service_s
+            else:
+                self._service_s += SERVICE_TIME_ALPHA * (service_s - self._service_s)
+            self._cond.notify_all()
+        self.write_metrics()
+
+    @contextmanager
+    def admit(self, deadline=None):
+        """Hold a pipeline slot for the block (acquire/release); yields the Ticket."""
+        ticket = self.acquire(deadline)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    # ---------------------------------------
+    # Export
+    # ---------------------------------------
+    def stats(self):
+        with self._cond:
+            stats = {"admitted": self._counts["admitted"],
+                     **{f"shed_{r}": self._counts[f"shed_{r}"] for r in SHED_REASONS},
+                     "running": self._running, "queued": len(self._queue),
+                     "max_concurrent": self.max_concurrent, "service_s": self._service_s,
+                     "queue_wait_buckets": self._queue_wait.cumulative(), "queue_wait_sum": self._queue_wait.sum}
+        stats["deadline_events"] = deadline_events()
+        return stats
+
+    def metrics_text(self):
+        """Prometheus text exposition of stats()."""
+        stats = self.stats()
+        lines = ["# HELP ekyc_admission_requests_total Verification requests by admission outcome.",
+                 "# TYPE ekyc_admission_requests_total counter",
+                 f'ekyc_admission_requests_total{{outcome="admitted"}} {stats["admitted"]}']
+        lines += [f'ekyc_admission_requests_total{{outcome="shed",reason="{r}"}} {stats[f"shed_{r}"]}'
+                  for r in SHED_REASONS]
+        lines += ["# HELP ekyc_admission_queue_wait_seconds Time admitted requests waited for a pipeline slot.",
+                  "# TYPE ekyc_admission_queue_wait_seconds histogram"]
+        lines += [f'ekyc_admission_queue_wait_seconds_bucket{{le="{le}"}} {n}' for le, n in stats["queue_wait_buckets"]]
+        lines += [f"ekyc_admission_queue_wait_seconds_sum {stats['queue_wait_sum']:.6f}",
+                  f"ekyc_admission_queue_wait_seconds_count {stats['queue_wait_buckets'][-1][1]}",
+                  "# HELP ekyc_pipeline_deadline_stages_total Pipeline stages skipped or failed for lack of deadline budget.",
+                  "# TYPE ekyc_pipeline_deadline_stages_total counter"]
+        lines += [f'ekyc_pipeline_deadline_stages_total{{action="{action}",stage="{stage}"}} {n}'
+                  for (action, stage), n in sorted(stats["deadline_events"].items())]
+        lines += ["# TYPE ekyc_admission_running gauge", f"ekyc_admission_running {stats['running']}",
+                  "# TYPE ekyc_admission_queued gauge", f"ekyc_admission_queued {stats['queued']}",
+                  "# TYPE ekyc_admission_service_seconds gauge",
+                  f"ekyc_admission_service_seconds {stats['service_s'] or 0.0:.6f}"]
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        """Atomically rewrite the metrics file, if one is configured."""
+        if not self.metrics_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.metrics_file) or ".", exist_ok=True)
+            tmp_path = f"{self.metrics_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(self.metrics_text())
+            os.replace(tmp_path, self.metrics_file)
+        except OSError as e:
+            logging.error("Could not write admission metrics: %s", e)
@@ -1,10 +1,22 @@
 import os
+import time
+import hashlib
+import contextvars
 import logging
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from runtime_config import configure_runtime
+
+# Cap OCR/face-model thread pools before torch/TensorFlow/OpenCV are imported
+configure_runtime()
+
+import cv2
+import numpy as np
 import streamlit as st
-from preprocess import read_image, extract_id_card, save_image
-from ocr_engine import extract_text
-from postprocess import extract_information, extract_information1
-from face_verification import detect_and_extract_face, deepface_face_comparison, get_face_embeddings
+from pipeline import VerificationContext, run_pipeline, PIPELINE, BUSY_MESSAGE
+from ocr_engine import get_reader
+from face_verification import get_inference_model
+from storage import get_backend
 from sql_connection import (
     insert_records,
     fetch_records,
@@ -13,22 +25,17 @@ from sql_connection import (
     fetch_records_aadhar,
     check_duplicacy_aadhar,
 )
-import hashlib
-from datetime import datetime
+from identity_index import link_record, start_identity_index
+from single_flight import SingleFlight
+from admission import AdmissionController, Overloaded, ADMISSION_MAX_CONCURRENT
+from profiling import ALLOW_PROFILING, profiled
 from dotenv import load_dotenv
+from logging_config import setup_logging, new_request_id
 
 # -------------------------
-# Logging & folders
+# Logging (queue-based JSON, see logging_config.py)
 # -------------------------
-logging_str = "[%(asctime)s: %(levelname)s: %(module)s]: %(message)s"
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-logging.basicConfig(
-    filename=os.path.join(log_dir, "ekyc_logs.log"),
-    level=logging.INFO,
-    format=logging_str,
-    filemode="a",
-)
+setup_logging()
 
 # -------------------------
 # Load environment variables (.env)
@@ -43,18 +50,154 @@ db_name = os.getenv("DB_NAME", "ekyc")
 if not db_user or not db_password:
     logging.error("Database credentials not found in .env file.")
 else:
-    logging.info(f"Loaded DB config: host={db_host}, user={db_user}, database={db_name}")
+    logging.info("Loaded DB config: host=%s, user=%s, database=%s", db_host, db_user, db_name)
+
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
+COALESCE_TIMEOUT_S = float(os.getenv("COALESCE_TIMEOUT_S", "120"))  # follower wait for an identical request
+SESSION_RESULTS = 8  # results kept per browser session
+STAGE_LABELS = {
+    "extract_roi": "Detecting ID card",
+    "read_qr": "Reading Aadhaar QR code",
+    "run_ocr": "Reading ID text",
+    "parse_fields": "Parsing ID details",
+    "lookup_stored_embedding": "Looking up enrollment",
+    "verify_face": "Verifying face",
+    "upgrade_stored_embedding": "Updating enrollment",
+}
 
 
 # -------------------------
-# Helpers
+# Process-level caches (shared by all sessions)
 # -------------------------
-def hash_id(id_value: str) -> str:
-    """Return SHA256 hex digest of given id string."""
-    hash_object = hashlib.sha256(id_value.encode())
-    return hash_object.hexdigest()
+@st.cache_resource(show_spinner="Loading OCR and face models...")
+def load_models():
+    """
+    Load the OCR reader, face model and storage backend once per process, not
+    per rerun, and start building the identity index in the background.
+    """
+    get_reader(["en"])
+    get_inference_model()
+    get_backend()
+    start_identity_index()
+    logging.info("Models and storage backend loaded.")
+    return True
+
+
+@st.cache_resource
+def get_executor():
+    """Bounded pool running pipelines off the script thread, shared by all sessions."""
+    return ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+
+
+@st.cache_resource
+def get_admission():
+    """
+    Admission control in front of the pool: one slot per pipeline worker
+    (unless ADMISSION_MAX_CONCURRENT says otherwise), a bounded wait queue,
+    and load shedding beyond it.
+    """
+    return AdmissionController(ADMISSION_MAX_CONCURRENT or PIPELINE_WORKERS)
+
+
+@st.cache_resource
+def get_flights():
+    """In-flight identical requests (same uploads + ID type, or same record insert) across sessions."""
+    return SingleFlight(timeout=COALESCE_TIMEOUT_S)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def decode_image(data):
+    """Decode uploaded bytes once; reruns with the same upload hit the cache."""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def upload_key(option, image_file, face_files):
+    """Identify one set of inputs so per-session results survive reruns."""
+    digest = hashlib.sha1(option.encode())
+    for f in [image_file] + list(face_files):
+        digest.update(hashlib.sha1(f.getvalue()).digest())
+    return digest.hexdigest()
 
 
+def has_session_result(option, image_file, face_image_file):
+    """True when this session already processed exactly these uploads."""
+    face_files = face_image_file if isinstance(face_image_file, list) else [face_image_file]
+    if image_file is None or not face_files or face_files[0] is None:
+        return False
+    return upload_key(option, image_file, face_files) in st.session_state.get("results", {})
+
+
+def run_verification(ctx, profile=None):
+    """
+    Pool side of a verification: run the pipeline (profiled, with the
+    artifact paths stored in a `profile` dict) and return the result dict
+    kept in session state. No st.* calls: the run is shared by every
+    session waiting on the same uploads.
+    """
+    func = run_pipeline if profile is None else profiled(run_pipeline, ctx.request_id, profile)
+    ctx = func(ctx)
+    # Only small, display-relevant results are kept per session, not the images
+    return {
+        "table": ctx.table,
+        "fields": ctx.fields,
+        "error": ctx.error,
+        "error_level": ctx.error_level,
+        "distance": ctx.distance,
+        "verified": ctx.verified,
+        "inserted": False,
+        "profile": profile,
+        "regional_text": [text for _, _, text, _ in ctx.regional_text or []],
+    }
+
+
+def wait_with_progress(future, ctx):
+    """Report stage progress of the run on `ctx` until `future` is done, then return its result."""
+    bar = st.progress(0.0, text="Starting verification...")
+    while not future.done():
+        done = len(ctx.timings)
+        if done < len(PIPELINE):
+            label = STAGE_LABELS.get(PIPELINE[done].__name__, PIPELINE[done].__name__)
+            bar.progress(done / len(PIPELINE), text=f"{label}...")
+        time.sleep(0.1)
+    result = future.result()
+    bar.empty()
+    return result
+
+
+def profile_requested():
+    """?profile=1, an X-Profile: 1 header or the debug checkbox; always False unless ALLOW_PROFILING is set."""
+    if not ALLOW_PROFILING:
+        return False
+    if hasattr(st, "query_params"):
+        flag = st.query_params.get("profile", "")
+    else:
+        flag = st.experimental_get_query_params().get("profile", [""])[0]
+    headers = getattr(getattr(st, "context", None), "headers", None) or {}
+    requested = flag in ("1", "true") or headers.get("X-Profile", "") in ("1", "true")
+    return st.sidebar.checkbox("Profile this request (debug)", value=requested)
+
+
+def show_profile(result):
+    """Download buttons for a profiled request's artifacts."""
+    profile = result.get("profile")
+    if not profile:
+        return
+    st.subheader("Request profile")
+    for key, label in (("summary", "Top functions (text)"), ("prof", "cProfile stats (.prof)"),
+                       ("alloc", "Allocations (tracemalloc)")):
+        try:
+            with open(profile[key], "rb") as f:
+                data = f.read()
+        except OSError as e:
+            logging.error("Profile artifact unavailable: %s", e)
+            continue
+        st.download_button(label, data, file_name=os.path.basename(profile[key]), key=f"profile_{key}")
+
+
+# -------------------------
+# Helpers
+# -------------------------
 def wider_page():
     max_width_str = "max-width: 1200px;"
     st.markdown(
@@ -89,7 +232,7 @@ def set_custom_theme():
 def sidebar_section():
     st.sidebar.title("Select ID Card Type")
     option = st.sidebar.selectbox("", ("PAN", "AADHAR"))
-    logging.info(f"ID card type selected: {option}")
+    logging.info("ID card type selected: %s", option)
     return option
 
 
@@ -105,130 +248,55 @@ def header_section(option):
 # -------------------------
 # Main content
 # -------------------------
-def main_content(image_file, face_image_file, option):
+def main_content(image_file, face_image_file, option, profile=False):
     """
     Main flow:
-    - Read uploaded files
-    - Extract ID ROI
-    - Extract face from ID and from uploaded selfie
-    - Verify faces
-    - Run OCR and parse text into text_info
-    - Normalize DOB, hash ID, check duplicates, insert to DB
+    - Decode uploaded files (cached) into a VerificationContext
+    - run_pipeline on the shared pool with progress: extract ID ROI, OCR +
+      parse (DOB normalized, ID hashed), verify selfie (or burst) against the
+      stored embedding for a returning user, otherwise against the ID face
+    - Check duplicates, insert to DB
+    Results are kept in st.session_state per set of uploads, so a rerun with
+    the same files shows them again without recomputing or re-inserting.
+    Identical requests in flight at the same time (any session) share one
+    pipeline run and one insert.
     """
+    request_id = new_request_id()
+
     if image_file is None:
         st.warning("Please upload an ID card image.")
         logging.warning("No ID card image uploaded.")
         return
 
-    if face_image_file is None:
+    if face_image_file is None or (isinstance(face_image_file, list) and len(face_image_file) == 0):
         st.error("Please upload a face image (selfie).")
         logging.error("No face image uploaded.")
         return
 
-    # Read images (preprocess.read_image returns image array or None)
-    face_image = read_image(face_image_file, is_uploaded=True)
-    logging.info("Face image loaded.")
-    if face_image is None:
-        st.error("Could not read uploaded face image.")
-        logging.error("read_image returned None for face_image.")
-        return
-
-    image = read_image(image_file, is_uploaded=True)
-    logging.info("ID card image loaded.")
-    if image is None:
-        st.error("Could not read uploaded ID card image.")
-        logging.error("read_image returned None for id image.")
-        return
-
-    # Extract ID ROI (image of the ID card area)
-    image_roi, _ = extract_id_card(image)
-    if image_roi is None:
-        st.error("Could not detect ID card region. Please upload a clearer image.")
-        logging.error("extract_id_card returned None.")
-        return
-    logging.info("ID card ROI extracted.")
-
-    # Extract face from ID (we pass the image array)
-    # detect_and_extract_face supports img= argument
-    face_image_path2 = detect_and_extract_face(img=image_roi)
-    # Save uploaded selfie to intermediate folder and get path
-    face_image_path1 = save_image(face_image, "face_image.jpg", path=os.path.join("data", "02_intermediate_data"))
-    logging.info(f"Faces extracted and saved: selfie={face_image_path1}, id_face={face_image_path2}")
-
-    # Verify faces (DeepFace)
-    try:
-        is_face_verified = deepface_face_comparison(image1_path=face_image_path1, image2_path=face_image_path2)
-    except Exception as e:
-        logging.error(f"Face verification raised exception: {e}")
-        is_face_verified = False
-
-    logging.info(f"Face verification status: {'successful' if is_face_verified else 'failed'}.")
-
-    if not is_face_verified:
-        st.error("Face verification failed. Please try again with clearer images.")
-        return
-
-    # If verified, run OCR on the ID ROI
-    extracted_text = None
-    try:
-        extracted_text = extract_text(image_roi)
-        logging.info("OCR extraction completed.")
-    except Exception as e:
-        logging.error(f"OCR extraction failed: {e}")
-        extracted_text = None
-
-    if not extracted_text:
-        st.warning("OCR did not extract text from the ID card. Please try a clearer picture.")
-        logging.warning("OCR returned no text.")
-        return
+    face_files = face_image_file if isinstance(face_image_file, list) else [face_image_file]
+    results = st.session_state.setdefault("results", {})
+    key = upload_key(option, image_file, face_files)
+    result = results.get(key)
+    if result is None:
+        result = verify_uploads(image_file, face_image_file, option, request_id, key, profile)
+        if result is None:
+            return
+        # A shed or deadline-failed request is not a result: the same uploads must run again on retry
+        if result.get("retry_after") is None and result["error"] != BUSY_MESSAGE:
+            results[key] = result
+            while len(results) > SESSION_RESULTS:
+                results.pop(next(iter(results)))
+    else:
+        logging.info("Showing cached session result for these uploads.")
+    show_profile(result)
 
-    # Parse OCR output into structured fields
-    try:
-        if option == "PAN":
-            text_info = extract_information(extracted_text)
+    if result["error"] is not None:
+        if result["error_level"] == "warning":
+            st.warning(result["error"])
         else:
-            text_info = extract_information1(extracted_text)
-        logging.info(f"Parsed text_info: {text_info}")
-    except Exception as e:
-        logging.error(f"Failed to parse OCR text into fields: {e}")
-        st.error("Failed to parse ID details. Please check the uploaded ID image.")
+            st.error(result["error"])
         return
-
-    # Validate minimal keys
-    if not text_info or "ID" not in text_info:
-        st.error("Required fields not detected in OCR output (ID missing).")
-        logging.error(f"text_info invalid or missing ID: {text_info}")
-        return
-
-    # Safe DOB parsing: many OCRs produce day/month/year or other formats
-    dob_raw = text_info.get("DOB", None)
-    dob_parsed = None
-    if isinstance(dob_raw, datetime):
-        dob_parsed = dob_raw
-    elif isinstance(dob_raw, str):
-        # try multiple common formats
-        formats_to_try = ["%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d.%m.%Y", "%d %b %Y", "%d %B %Y"]
-        for fmt in formats_to_try:
-            try:
-                dob_parsed = datetime.strptime(dob_raw.strip(), fmt)
-                break
-            except Exception:
-                dob_parsed = None
-    # final normalized string or None
-    text_info["DOB"] = dob_parsed.strftime("%Y-%m-%d") if dob_parsed else None
-
-    # Hash ID before storing / displaying
-    original_id_value = text_info.get("ID", "")
-    hashed = hash_id(original_id_value)
-    text_info["ID"] = hashed
-
-    # Add embedding to record
-    try:
-        embedding = get_face_embeddings(face_image_path1)
-        text_info["Embedding"] = embedding
-    except Exception as e:
-        logging.error(f"Failed to create embedding: {e}")
-        text_info["Embedding"] = None
+    text_info = result["fields"]
 
     # Show parsed info to user
     st.subheader("📄 Extracted Information")
@@ -236,6 +304,8 @@ def main_content(image_file, face_image_file, option):
     st.write("**DOB:**", text_info.get("DOB", "Not found"))
     st.write("**ID (hashed):**", text_info.get("ID", "Not found"))
     st.write("**Gender:**", text_info.get("Gender", "Not found"))
+    if result.get("regional_text"):
+        st.write("**Regional-script text:**", " | ".join(result["regional_text"]))
 
     # Check duplicate and insert into DB
     try:
@@ -246,11 +316,13 @@ def main_content(image_file, face_image_file, option):
             records = fetch_records_aadhar(text_info)
             is_duplicate = check_duplicacy_aadhar(text_info)
     except Exception as e:
-        logging.error(f"DB lookup failed: {e}")
+        logging.error("DB lookup failed: %s", e)
         st.error("Database error while checking duplicates.")
         return
 
-    if records is not None and getattr(records, "shape", (0,))[0] > 0:
+    if result.get("inserted"):
+        st.success("User verified and record inserted successfully.")
+    elif records is not None and getattr(records, "shape", (0,))[0] > 0:
         st.info("Records found for this ID:")
         st.write(records)
     elif is_duplicate:
@@ -258,34 +330,128 @@ def main_content(image_file, face_image_file, option):
     else:
         # Insert new record
         try:
-            if option == "PAN":
-                insert_records(text_info)
+            insert = insert_records if option == "PAN" else insert_records_aadhar
+            # Concurrent copies of the same record share one insert instead of racing on it
+            inserted = get_flights().do(("insert", result["table"], text_info["ID"]), insert, text_info)
+            if inserted:
+                result["inserted"] = True
+                st.success("User verified and record inserted successfully.")
+                logging.info("New user record inserted: %s", text_info.get('ID'))
+                show_identity_links(result["table"], text_info)
             else:
-                insert_records_aadhar(text_info)
-            st.success("User verified and record inserted successfully.")
-            logging.info(f"New user record inserted: {text_info.get('ID')}")
+                st.error("Failed to insert record into database. Check logs.")
         except Exception as e:
-            logging.error(f"Failed to insert record: {e}")
+            logging.error("Failed to insert record: %s", e)
             st.error("Failed to insert record into database. Check logs.")
 
     # End of main_content
 
 
+def verify_uploads(image_file, face_image_file, option, request_id, key, profile=False):
+    """
+    Decode the uploads and run the pipeline, or join the run already in
+    flight for the same uploads (`key`); returns the result dict kept in
+    session state, or None after showing why there is none.
+    """
+    # A list of uploads is a selfie burst (several frames of the same person)
+    selfie_frames = None
+    if isinstance(face_image_file, list):
+        selfie_frames = [decode_image(f.getvalue()) for f in face_image_file]
+        selfie_frames = [f for f in selfie_frames if f is not None]
+        face_image = selfie_frames[0] if selfie_frames else None
+        logging.info("Selfie burst loaded: %s frames.", len(selfie_frames))
+    else:
+        face_image = decode_image(face_image_file.getvalue())
+        logging.info("Face image loaded.")
+    if face_image is None:
+        st.error("Could not read uploaded face image.")
+        logging.error("Could not decode the uploaded face image.")
+        return None
+
+    image = decode_image(image_file.getvalue())
+    logging.info("ID card image loaded.")
+    if image is None:
+        st.error("Could not read uploaded ID card image.")
+        logging.error("Could not decode the uploaded ID card image.")
+        return None
+
+    # A double-click, rerun or retry with the same uploads (any session) joins the run in progress.
+    # The flight lives as long as the pool future, so a rerun stopping this script doesn't end it.
+    flights = get_flights()
+    flight = ("verify", key)
+    future = flights.get(flight)
+    if future is None:
+        admission = get_admission()
+        try:
+            with st.spinner("Waiting for a free verification slot...") if admission.busy() else nullcontext():
+                ticket = admission.acquire()
+        except Overloaded as e:
+            return {
+                "table": "users" if option == "PAN" else "aadhar",
+                "fields": None,
+                "error": f"The service is busy right now. Please try again in {e.retry_after} seconds.",
+                "error_level": "warning",
+                "retry_after": e.retry_after,
+                "profile": None,
+            }
+        ctx = VerificationContext(option, id_image=image, selfie_image=face_image, selfie_frames=selfie_frames,
+                                  request_id=request_id, deadline=ticket.deadline)
+        try:
+            # Pool threads don't inherit contextvars: run in a copy so pipeline logs carry the request ID
+            future, leader = flights.submit(flight, get_executor(), contextvars.copy_context().run,
+                                            run_verification, ctx, {} if profile else None)
+        except BaseException:
+            admission.release(ticket)
+            raise
+        if leader:
+            # The slot is freed when the run finishes, not when a rerun abandons this script
+            future.add_done_callback(lambda _: admission.release(ticket))
+            return dict(wait_with_progress(future, ctx))
+        admission.release(ticket)
+    try:
+        with st.spinner("An identical request is already being processed..."):
+            return dict(flights.wait(flight, future))
+    except TimeoutError:
+        st.warning("An identical request is still being processed. Please try again in a moment.")
+        return None
+
+
+def show_identity_links(table, text_info):
+    """Link the new record to the same person's other ID (PAN <-> Aadhar) by name/DOB and face."""
+    try:
+        links = link_record(table, text_info)
+    except Exception as e:
+        logging.error("Identity linking failed: %s", e)
+        return
+    for link in links:
+        other = "Aadhar" if link["table"] == "aadhar" else "PAN"
+        st.info(f"Linked to an existing {other} record (ID hashed: {link['id']}, "
+                f"name similarity {link['name_similarity']}, face distance {link['distance']}).")
+
+
 # -------------------------
 # Main function
 # -------------------------
 def main():
     wider_page()
     set_custom_theme()
+    load_models()
     option = sidebar_section()
+    profile = profile_requested()
     header_section(option)
 
     st.write("Upload your ID card image first, then upload your selfie (face image).")
     image_file = st.file_uploader("Upload ID Card", type=["jpg", "jpeg", "png"])
     if image_file is not None:
-        face_image_file = st.file_uploader("Upload Face Image", type=["jpg", "jpeg", "png"])
-        if st.button("Process"):
-            main_content(image_file, face_image_file, option)
+        burst = st.checkbox("Upload several selfie frames (burst capture)")
+        face_image_file = st.file_uploader(
+            "Upload Face Image" if not burst else "Upload Face Images (burst frames)",
+            type=["jpg", "jpeg", "png"],
+            accept_multiple_files=burst,
+        )
+        # Widget changes rerun the script: keep showing this session's result for the same uploads
+        if st.button("Process") or has_session_result(option, image_file, face_image_file):
+            main_content(image_file, face_image_file, option, profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+"""
+Schema benchmark on a local SQLite stand-in.
+
+Seeds two databases with the same synthetic enrollment rows:
+  - old: TEXT hex id primary key, inline TEXT embedding, no secondary indexes
+  - new: BLOB(32) id, indexes on created_at and (dob, name), embeddings in a side table
+then times ID lookups, dob+name fraud queries and created_at range counts.
+
+SQLite has no table partitioning, so that part of the MySQL schema is not
+covered here; run the same queries against MySQL for partition pruning.
+
+Usage:
+    python bench_schema.py --rows 2000000
+    python bench_schema.py --rows 200000 --embedding-dim 512 --dir /tmp/ekyc_bench
+"""
+
+import os
+import time
+import random
+import hashlib
+import sqlite3
+import argparse
+import numpy as np
+from datetime import date, datetime, timedelta
+
+FIRST_NAMES = ["Aarav", "Vivaan", "Aditya", "Diya", "Ananya", "Ishaan", "Kavya", "Rohan", "Saanvi", "Arjun"]
+LAST_NAMES = ["Shah", "Patel", "Sharma", "Iyer", "Reddy", "Gupta", "Khan", "Das", "Nair", "Mehta"]
+
+OLD_SCHEMA = """
+    CREATE TABLE users (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        father_name TEXT,
+        dob TEXT NOT NULL,
+        id_type TEXT NOT NULL,
+        embedding TEXT,
+        created_at TEXT NOT NULL
+    )
+"""
+
+NEW_SCHEMA = [
+    """
+    CREATE TABLE users (
+        id BLOB PRIMARY KEY,
+        name TEXT NOT NULL,
+        father_name TEXT,
+        dob TEXT NOT NULL,
+        id_type TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX idx_created_at ON users (created_at)",
+    "CREATE INDEX idx_dob_name ON users (dob, name)",
+    "CREATE TABLE users_embeddings (id BLOB PRIMARY KEY, embedding BLOB) WITHOUT ROWID",
+]
+
+
+def synthetic_rows(n, dim, seed=0):
+    """Yield (id bytes, name, father_name, dob, created_at, embedding) tuples."""
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    start = datetime(2023, 1, 1)
+    for i in range(n):
+        digest = hashlib.sha256(f"ID{i:010d}".encode()).digest()
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        father = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        dob = (date(1950, 1, 1) + timedelta(days=rng.randrange(20000))).isoformat()
+        created = (start + timedelta(seconds=rng.randrange(3 * 365 * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+        yield digest, name, father, dob, created, np_rng.standard_normal(dim).astype(np.float32)
+
+
+def seed(path, layout, rows, dim, batch=10000):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    if layout == "old":
+        conn.execute(OLD_SCHEMA)
+    else:
+        for ddl in NEW_SCHEMA:
+            conn.execute(ddl)
+
+    main, side = [], []
+    for digest, name, father, dob, created, emb in synthetic_rows(rows, dim):
+        if layout == "old":
+            main.append((digest.hex(), name, father, dob, "PAN", str(emb.tolist()), created))
+        else:
+            main.append((digest, name, father, dob, "PAN", created))
+            side.append((digest, emb.tobytes()))
+        if len(main) >= batch:
+            _flush(conn, layout, main, side)
+    _flush(conn, layout, main, side)
+    conn.commit()
+    conn.execute("ANALYZE")
+    return conn
+
+
+def _flush(conn, layout, main, side):
+    if not main:
+        return
+    if layout == "old":
+        conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?)", main)
+    else:
+        conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)", main)
+        conn.executemany("INSERT INTO users_embeddings VALUES (?, ?)", side)
+    main.clear()
+    side.clear()
+
+
+def _time(conn, sql, params_list):
+    """Median latency in ms of `sql` over params_list."""
+    timings = []
+    for params in params_list:
+        t0 = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings.append(time.perf_counter() - t0)
+    return 1000 * float(np.median(timings))
+
+
+def run(rows, dim, directory, queries=200):
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(1)
+    sample = [hashlib.sha256(f"ID{rng.randrange(rows):010d}".encode()).digest() for _ in range(queries)]
+    probe = [(r[3], r[1]) for r in synthetic_rows(min(rows, queries), 1)]
+    ranges = [(f"2024-{m:02d}-01", f"2024-{m:02d}-08") for m in range(1, 13)]
+
+    results = {}
+    for layout in ("old", "new"):
+        path = os.path.join(directory, f"users_{layout}.db")
+        t0 = time.perf_counter()
+        conn = seed(path, layout, rows, dim)
+        seed_s = time.perf_counter() - t0
+        key = (lambda d: d.hex()) if layout == "old" else (lambda d: d)
+        results[layout] = {
+            "seed_s": seed_s,
+            "size_mb": os.path.getsize(path) / (1024 * 1024),
+            "id_lookup_ms": _time(conn, "SELECT name, dob FROM users WHERE id = ?", [(key(d),) for d in sample]),
+            "dob_name_ms": _time(conn, "SELECT id FROM users WHERE dob = ? AND name = ?", probe[:20]),
+            "created_range_ms": _time(conn, "SELECT COUNT(*) FROM users WHERE created_at >= ? AND created_at < ?",
+                                      ranges),
+        }
+        conn.close()
+
+    print(f"\n{rows} rows, {dim}-d embeddings (SQLite stand-in)")
+    print(f"{'metric':<20}{'old':>12}{'new':>12}")
+    for metric in ("seed_s", "size_mb", "id_lookup_ms", "dob_name_ms", "created_range_ms"):
+        print(f"{metric:<20}{results['old'][metric]:>12.3f}{results['new'][metric]:>12.3f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark old vs new enrollment schema on SQLite.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--embedding-dim", type=int, default=512)
+    parser.add_argument("--dir", default=os.path.join("data", "bench"))
+    args = parser.parse_args()
+    run(args.rows, args.embedding_dim, args.dir)
@@ -0,0 +1,241 @@
+"""
+Face-distance calibration on a labelled local set.
+
+For every labelled image pair the largest face of each image is embedded
+with the fast model (Facenet512 on the configured backend) and the
+escalation model. Thresholds only hold for the face normalisation they were
+fitted on, so each model is fitted twice and the result is keyed by
+embedding version: on aligned crops (the pairs whose eyes are found in both
+images) and on padded crops (legacy embeddings and alignment fallbacks).
+Per version we pick:
+
+    threshold     - best balanced accuracy on the set
+    accept_below  - distances below this are clear matches (below every impostor pair)
+    reject_above  - distances above this are clear mismatches (above every genuine pair)
+
+The result is written to artifacts.CALIBRATION_FILE and used by
+face_verification.get_thresholds() / tiered_decision(): only distances in
+the band between accept_below and reject_above run the heavier model.
+
+The built-in pairs (srk1/srk2 and the sample ID cards) are only a smoke
+set for `evaluate` and `align-bench`; `run` will not write a calibration
+from fewer than MIN_GENUINE_PAIRS genuine and MIN_IMPOSTOR_PAIRS impostor
+pairs. Add your own pairs as CSV lines `image1,image2,same` (same = 1 or 0):
+
+    python calibration.py run --pairs data/calibration_pairs.csv
+    python calibration.py evaluate --pairs data/calibration_pairs.csv
+    python calibration.py align-bench --pairs data/calibration_pairs.csv
+"""
+
+import os
+import csv
+import json
+import time
+import argparse
+import numpy as np
+from datetime import datetime
+from face_verification import (
+    MODEL_NAME,
+    MODEL_INPUT_SIZE,
+    ESCALATION_MODEL,
+    CALIBRATION_FILE,
+    crop_largest_face,
+    crop_face_versioned,
+    embed_faces_with_model,
+    cosine_distances,
+    escalation_version,
+    get_thresholds,
+    tiered_decision,
+)
+from embedding_versions import embedding_version
+
+RAW = os.path.join("data", "01_raw_data")
+BUILTIN_PAIRS = [
+    (os.path.join(RAW, "srk1.jpeg"), os.path.join(RAW, "srk2.webp"), 1),
+    (os.path.join(RAW, "srk1.jpeg"), os.path.join(RAW, "pan.jpeg"), 0),
+    (os.path.join(RAW, "srk1.jpeg"), os.path.join(RAW, "aadhar.png"), 0),
+    (os.path.join(RAW, "srk2.webp"), os.path.join(RAW, "adhar_2.jpg"), 0),
+    (os.path.join(RAW, "srk2.webp"), os.path.join(RAW, "id_1.png"), 0),
+    (os.path.join(RAW, "pan.jpeg"), os.path.join(RAW, "aadhar.png"), 0),
+    (os.path.join(RAW, "pan_1.jpg"), os.path.join(RAW, "adhar_2.jpg"), 0),
+]
+BAND_MARGIN = 0.05
+MIN_GENUINE_PAIRS = 20   # `run` refuses to write a calibration fitted on fewer pairs of either kind
+MIN_IMPOSTOR_PAIRS = 20
+
+
+def load_pairs(path=None):
+    """Built-in pairs plus `image1,image2,same` rows from `path` (lines starting with # are skipped)."""
+    pairs = [p for p in BUILTIN_PAIRS if os.path.exists(p[0]) and os.path.exists(p[1])]
+    if path:
+        with open(path, newline="") as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith("#"):
+                    continue
+                pairs.append((row[0].strip(), row[1].strip(), int(row[2])))
+    return pairs
+
+
+def pair_distances(pairs, model_name, face_of=None):
+    """
+    Cosine distance per pair under `model_name`, plus the mean seconds per
+    pair. `face_of(img)` picks the face to embed (default: crop_largest_face).
+    """
+    import cv2
+
+    face_of = face_of or (lambda img: crop_largest_face(img)[0])
+    distances = []
+    start = time.perf_counter()
+    for image1, image2, _ in pairs:
+        faces = [face_of(cv2.imread(image1)), face_of(cv2.imread(image2))]
+        embeddings = embed_faces_with_model(faces, model_name)
+        distances.append(float(cosine_distances(embeddings[0], embeddings[1:])[0]))
+    return np.asarray(distances), (time.perf_counter() - start) / max(1, len(pairs))
+
+
+def normalised_pairs(pairs, align):
+    """The pairs whose two faces both come out aligned (align=True) or padded (align=False)."""
+    import cv2
+
+    want = embedding_version(align=align)
+    return [pair for pair in pairs
+            if all(crop_face_versioned(cv2.imread(path), align=align)[2] == want for path in pair[:2])]
+
+
+def check_pair_counts(pairs):
+    genuine = sum(1 for _, _, same in pairs if same)
+    if genuine < MIN_GENUINE_PAIRS or len(pairs) - genuine < MIN_IMPOSTOR_PAIRS:
+        raise ValueError(f"Calibration needs at least {MIN_GENUINE_PAIRS} genuine and {MIN_IMPOSTOR_PAIRS} impostor "
+                         f"pairs, got {genuine} and {len(pairs) - genuine}; add pairs with --pairs")
+
+
+def fit_thresholds(distances, labels, margin=BAND_MARGIN):
+    """Threshold with the best balanced accuracy, and the clear-cut band around it."""
+    labels = np.asarray(labels, dtype=bool)
+    positives, negatives = distances[labels], distances[~labels]
+    if len(positives) == 0 or len(negatives) == 0:
+        raise ValueError("Calibration needs at least one genuine and one impostor pair")
+
+    # Every threshold in [d[i], d[i+1]) classifies the set the same way as d[i]
+    d = np.unique(distances)
+    scores = np.array([((positives <= t).mean() + (negatives > t).mean()) / 2 for t in d])
+    first = int(np.argmax(scores))
+    last = first
+    while last + 1 < len(d) and scores[last + 1] == scores[first]:
+        last += 1
+    # Middle of the tied best range, not its edge (e.g. halfway between the classes on a separable set)
+    best = float(d[first] + d[last + 1]) / 2 if last + 1 < len(d) else float(d[last])
+    best_score = float(scores[first])
+    return {
+        "threshold": round(best, 4),
+        "accept_below": round(min(best, float(negatives.min()) - margin), 4),
+        "reject_above": round(max(best, float(positives.max()) + margin), 4),
+        "balanced_accuracy": round(best_score, 4),
+    }
+
+
+def calibrate(pairs, models=(MODEL_NAME, ESCALATION_MODEL), output=CALIBRATION_FILE):
+    """Fit every model on aligned and on padded crops; writes {embedding version: thresholds} to `output`."""
+    check_pair_counts(pairs)
+    result = {}
+    for align in (True, False):
+        subset = normalised_pairs(pairs, align) if align else pairs
+        try:
+            check_pair_counts(subset)
+        except ValueError as e:
+            print(f"{embedding_version(align=align)}: not calibrated, eyes found in too few pairs ({e})")
+            continue
+        labels = [same for _, _, same in subset]
+        for model_name in models:
+            distances, seconds = pair_distances(subset, model_name,
+                                                face_of=lambda img: crop_largest_face(img, align=align)[0])
+            entry = fit_thresholds(distances, labels)
+            entry.update({"pairs": len(subset), "positives": int(sum(labels)), "seconds_per_pair": round(seconds, 3),
+                          "calibrated_at": datetime.now().isoformat(timespec="seconds")})
+            version = embedding_version(model_name, align=align)
+            result[version] = entry
+            print(f"{version}: {entry}")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Calibration written to {output}")
+    return result
+
+
+def evaluate(pairs):
+    """Compare the single-threshold fast model with the tiered decision on `pairs`."""
+    labels = np.asarray([same for _, _, same in pairs], dtype=bool)
+    fast, fast_s = pair_distances(pairs, MODEL_NAME)
+    heavy, heavy_s = pair_distances(pairs, ESCALATION_MODEL)
+
+    single = fast <= get_thresholds()["threshold"]
+    tiered, escalated = [], 0
+    for d_fast, d_heavy in zip(fast, heavy):
+        verified, tier, _ = tiered_decision(float(d_fast), escalate=lambda d=d_heavy: d)
+        tiered.append(verified)
+        escalated += tier == "escalated"
+    tiered = np.asarray(tiered)
+
+    heavy_only = heavy <= get_thresholds(escalation_version())["threshold"]
+    rate = escalated / len(pairs)
+    print(f"pairs={len(pairs)} genuine={labels.sum()} impostor={(~labels).sum()}")
+    print(f"fast only:  accuracy={(single == labels).mean():.3f}  cost={fast_s:.3f}s/pair")
+    print(f"tiered:     accuracy={(tiered == labels).mean():.3f}  escalated={rate:.1%}  "
+          f"expected cost={fast_s + rate * heavy_s:.3f}s/pair")
+    print(f"heavy only: accuracy={(heavy_only == labels).mean():.3f}  cost={heavy_s:.3f}s/pair")
+
+
+def alignment_bench(pairs, model_name=MODEL_NAME):
+    """
+    Genuine/impostor distance distributions with the old face preparation
+    (box crop stretched to 224x224, as normalize_face did; box crop padded)
+    and with eye alignment. A wider gap between the genuine and impostor
+    distances is what alignment should buy.
+    """
+    import cv2
+
+    labels = np.asarray([same for _, _, same in pairs], dtype=bool)
+    modes = {
+        "stretched": lambda img: cv2.resize(crop_largest_face(img, align=False)[0], (224, 224)),
+        "padded": lambda img: crop_largest_face(img, align=False)[0],
+        "aligned": lambda img: crop_largest_face(img, align=True)[0],
+    }
+    images = {path for image1, image2, _ in pairs for path in (image1, image2)}
+    aligned = sum(crop_largest_face(cv2.imread(path), align=True)[0].shape[:2] == MODEL_INPUT_SIZE
+                  for path in images)
+    print(f"pairs={len(pairs)} genuine={labels.sum()} impostor={(~labels).sum()}  "
+          f"eyes found in {aligned}/{len(images)} images")
+    for mode, face_of in modes.items():
+        distances, seconds = pair_distances(pairs, model_name, face_of=face_of)
+        genuine, impostor = distances[labels], distances[~labels]
+        line = f"{mode:>9}: "
+        if len(genuine):
+            line += f"genuine mean={genuine.mean():.3f} max={genuine.max():.3f}  "
+        if len(impostor):
+            line += f"impostor mean={impostor.mean():.3f} min={impostor.min():.3f}  "
+        if len(genuine) and len(impostor):
+            line += (f"margin={impostor.min() - genuine.max():+.3f}  "
+                     f"balanced accuracy={fit_thresholds(distances, labels)['balanced_accuracy']:.3f}  ")
+        print(line + f"{seconds:.3f}s/pair")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate face-distance thresholds.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("run", "Fit thresholds and write the calibration file"),
+                            ("evaluate", "Compare fast-only, tiered and heavy-only decisions"),
+                            ("align-bench", "Distance distributions before and after face alignment")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--pairs", help="CSV of image1,image2,same")
+    args = parser.parse_args()
+
+    labelled = load_pairs(args.pairs)
+    if args.command == "run":
+        try:
+            calibrate(labelled)
+        except ValueError as e:
+            raise SystemExit(f"Calibration not written: {e}")
+    elif args.command == "align-bench":
+        alignment_bench(labelled)
+    else:
+        evaluate(labelled)
@@ -0,0 +1,379 @@
+"""
+On-disk embedding store for enrolled faces.
+
+Embeddings are kept as append-only float32 shards plus a small ID/offset
+index. Shards are opened with np.memmap, so every worker process reading the
+store shares one page-cached copy instead of unpickling its own.
+
+Layout of a store directory:
+
+    meta.json                 -> {"dim": 512, "shard_rows": 65536, "generation": "gen_00000"}
+    gen_00000/index.jsonl     -> one {"id", "shard", "row"} (or {"id", "deleted"}) line per append
+    gen_00000/shard_00000.f32 -> raw float32 rows, dim values per row
+    .lock                     -> flock()ed by writers (appends, deletes, compaction)
+
+Writers are serialised by a per-store thread lock plus an exclusive flock on
+the store directory's lock file, so threads and processes appending at once
+never hand out the same row. Readers hold the thread lock and pick up other
+processes' appends and compactions when meta.json or the index has changed
+(one stat each), on an ID miss and before building the full matrix.
+"""
+
+import os
+import json
+import pickle
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+import numpy as np
+from utils import read_yaml
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+config_path = "config.yaml"
+config = read_yaml(config_path)
+artifacts = config['artifacts']
+EMBEDDING_STORE_DIR = artifacts.get('EMBEDDING_STORE_DIR', os.path.join("data", "03_embedding_store"))
+EMBEDDING_DIM = int(artifacts.get('EMBEDDING_DIM', 512))
+
+DEFAULT_SHARD_ROWS = 65536
+
+
+class EmbeddingStore:
+    """Append-only, memory-mapped store of float32 embeddings keyed by ID."""
+
+    def __init__(self, root, dim=EMBEDDING_DIM, shard_rows=DEFAULT_SHARD_ROWS):
+        self.root = root
+        self._lock = threading.RLock()
+        os.makedirs(root, exist_ok=True)
+        meta_path = os.path.join(root, "meta.json")
+        with self._write_lock():
+            if os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            else:
+                meta = {"dim": int(dim), "shard_rows": int(shard_rows), "generation": "gen_00000"}
+                self._write_meta(meta)
+        self.dim = meta["dim"]
+        self.shard_rows = meta["shard_rows"]
+        self.generation = meta["generation"]
+        os.makedirs(self._gen_dir(), exist_ok=True)
+
+        self._index = {}        # id -> (shard, row)
+        self._shard_fill = {}   # shard -> rows written
+        self._maps = {}         # shard -> np.memmap
+        self._index_size = 0
+        self._meta_mtime = None
+        self.refresh()
+
+    # ---------------------------------------
+    # Paths / metadata
+    # ---------------------------------------
+    def _gen_dir(self, generation=None):
+        return os.path.join(self.root, generation or self.generation)
+
+    def _shard_path(self, shard, generation=None):
+        return os.path.join(self._gen_dir(generation), f"shard_{shard:05d}.f32")
+
+    def _index_path(self, generation=None):
+        return os.path.join(self._gen_dir(generation), "index.jsonl")
+
+    @contextmanager
+    def _write_lock(self):
+        """Exclusive across this process's threads and, via flock, across processes."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.root, ".lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_meta(self, meta):
+        tmp_path = os.path.join(self.root, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.root, "meta.json"))
+
+    # ---------------------------------------
+    # Index handling
+    # ---------------------------------------
+    def refresh(self):
+        """Pick up appends (or a compaction) done by other processes."""
+        with self._lock:
+            self._refresh()
+
+    def _changed(self):
+        """True if meta.json or the index file differ from what was last read."""
+        try:
+            if os.stat(os.path.join(self.root, "meta.json")).st_mtime_ns != self._meta_mtime:
+                return True
+            return os.path.getsize(self._index_path()) != self._index_size
+        except OSError:
+            return False
+
+    def _refresh_if_changed(self):
+        if self._changed():
+            self._refresh()
+
+    def _refresh(self):
+        meta_path = os.path.join(self.root, "meta.json")
+        self._meta_mtime = os.stat(meta_path).st_mtime_ns
+        with open(meta_path) as f:
+            generation = json.load(f)["generation"]
+        if generation != self.generation:
+            self.generation = generation
+            self._index, self._shard_fill, self._maps = {}, {}, {}
+            self._index_size = 0
+
+        index_path = self._index_path()
+        if not os.path.exists(index_path):
+            return
+        with open(index_path) as f:
+            f.seek(self._index_size)
+            # Only consume complete lines; a writer may be mid-append.
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                self._index_size += len(line.encode())
+                entry = json.loads(line)
+                if entry.get("deleted"):
+                    self._index.pop(entry["id"], None)
+                    continue
+                shard, row = entry["shard"], entry["row"]
+                self._index[entry["id"]] = (shard, row)
+                self._shard_fill[shard] = max(self._shard_fill.get(shard, 0), row + 1)
+                self._maps.pop(shard, None)
+
+    def _append_index(self, entries):
+        with open(self._index_path(), "a") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def __len__(self):
+        with self._lock:
+            self._refresh_if_changed()
+            return len(self._index)
+
+    def __contains__(self, record_id):
+        return self.get(record_id) is not None
+
+    def ids(self):
+        with self._lock:
+            self._refresh_if_changed()
+            return list(self._index.keys())
+
+    # ---------------------------------------
+    # Writes
+    # ---------------------------------------
+    def append(self, record_id, embedding):
+        """Append a single embedding. A later append for the same ID supersedes it."""
+        self.append_many([record_id], [embedding])
+
+    def append_many(self, record_ids, embeddings):
+        """
+        Append many embeddings with one write per touched shard. The whole
+        append (find the fill, write the rows, index them) holds the write lock.
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(record_ids), self.dim)
+        with self._write_lock():
+            self._refresh()
+            shard = max(self._shard_fill, default=0)
+            fill = self._shard_fill.get(shard, 0)
+
+            entries = []
+            start = 0
+            while start < len(record_ids):
+                if fill >= self.shard_rows:
+                    shard, fill = shard + 1, 0
+                take = min(self.shard_rows - fill, len(record_ids) - start)
+                path = self._shard_path(shard)
+                with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                    # Rows past the indexed fill are a crashed writer's leftovers: overwrite them in place
+                    f.seek(fill * self.dim * 4)
+                    f.write(vectors[start:start + take].tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                for i in range(take):
+                    entries.append({"id": record_ids[start + i], "shard": shard, "row": fill + i})
+                fill += take
+                start += take
+
+            self._append_index(entries)
+            self._refresh()
+        logging.info("Appended %s embeddings to store %s", len(entries), self.root)
+
+    def delete(self, record_id):
+        """Tombstone an ID; its row is reclaimed on the next compact()."""
+        with self._write_lock():
+            self._append_index([{"id": record_id, "deleted": True}])
+            self._refresh()
+
+    # ---------------------------------------
+    # Reads
+    # ---------------------------------------
+    def _shard(self, shard):
+        """Memmap of a shard sized to its indexed rows; callers hold self._lock."""
+        mm = self._maps.get(shard)
+        if mm is None:
+            rows = self._shard_fill.get(shard, 0)
+            mm = np.memmap(self._shard_path(shard), dtype=np.float32, mode="r", shape=(rows, self.dim))
+            self._maps[shard] = mm
+        return mm
+
+    def get(self, record_id):
+        """Return the stored embedding (read-only view) or None."""
+        with self._lock:
+            loc = self._index.get(record_id)
+            if loc is None:
+                # Possibly appended by another process since the last refresh
+                self._refresh_if_changed()
+                loc = self._index.get(record_id)
+                if loc is None:
+                    return None
+            shard, row = loc
+            return self._shard(shard)[row]
+
+    def matrix(self):
+        """Return (ids, embeddings) for every live record, embeddings as an (n, dim) array."""
+        with self._lock:
+            self._refresh_if_changed()
+            ids = list(self._index.keys())
+            if not ids:
+                return ids, np.empty((0, self.dim), dtype=np.float32)
+            locs = np.array([self._index[i] for i in ids])
+            out = np.empty((len(ids), self.dim), dtype=np.float32)
+            for shard in np.unique(locs[:, 0]):
+                mask = locs[:, 0] == shard
+                out[mask] = self._shard(int(shard))[locs[mask, 1]]
+            return ids, out
+
+    def search(self, query, top_k=5):
+        """Cosine-distance search; returns [(id, distance), ...] nearest first."""
+        ids, mat = self.matrix()
+        if not ids:
+            return []
+        q = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        norms = np.linalg.norm(mat, axis=1) * np.linalg.norm(q)
+        distances = 1.0 - (mat @ q) / np.maximum(norms, 1e-12)
+        top_k = min(top_k, len(ids))
+        best = np.argpartition(distances, top_k - 1)[:top_k]
+        best = best[np.argsort(distances[best])]
+        return [(ids[i], float(distances[i])) for i in best]
+
+    # ---------------------------------------
+    # Maintenance
+    # ---------------------------------------
+    def compact(self):
+        """Rewrite live rows into a fresh generation, dropping superseded and deleted rows."""
+        with self._write_lock():
+            return self._compact()
+
+    def _compact(self):
+        self._refresh()
+        ids, mat = self.matrix()
+        old_generation = self.generation
+        new_generation = f"gen_{int(old_generation.split('_')[1]) + 1:05d}"
+        os.makedirs(self._gen_dir(new_generation), exist_ok=True)
+
+        entries = []
+        for shard, start in enumerate(range(0, len(ids), self.shard_rows)):
+            chunk = mat[start:start + self.shard_rows]
+            with open(self._shard_path(shard, new_generation), "wb") as f:
+                f.write(chunk.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            for row, record_id in enumerate(ids[start:start + self.shard_rows]):
+                entries.append({"id": record_id, "shard": shard, "row": row})
+        with open(self._index_path(new_generation), "w") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._write_meta({"dim": self.dim, "shard_rows": self.shard_rows, "generation": new_generation})
+        self._refresh()
+        # Old shards are left for readers still mapping them; remove them once they have refreshed.
+        logging.info("Compacted store %s: %s -> %s, %s rows", self.root, old_generation, new_generation, len(ids))
+        return new_generation
+
+
+# ---------------------------------------
+# DeepFace pickle importer
+# ---------------------------------------
+def import_deepface_pickle(pkl_path, store):
+    """
+    Import a DeepFace representations pickle (ds_<model>_<detector>_v2.pkl).
+    Handles both the list-of-[identity, embedding] and list-of-dict layouts.
+    """
+    with open(pkl_path, "rb") as f:
+        representations = pickle.load(f)
+
+    record_ids, embeddings = [], []
+    for rep in representations:
+        if isinstance(rep, dict):
+            identity, embedding = rep.get("identity"), rep.get("embedding")
+        else:
+            identity, embedding = rep[0], rep[1]
+        if embedding is None or len(embedding) != store.dim:
+            logging.warning("Skipping %s: embedding missing or not %s-D", identity, store.dim)
+            continue
+        record_ids.append(str(identity))
+        embeddings.append(embedding)
+
+    if record_ids:
+        store.append_many(record_ids, embeddings)
+    logging.info("Imported %s embeddings from %s", len(record_ids), pkl_path)
+    return len(record_ids)
+
+
+# ---------------------------------------
+# Shared per-table stores
+# ---------------------------------------
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(name, dim=EMBEDDING_DIM):
+    """Return the process-wide store for a table name (e.g. 'users', 'aadhar')."""
+    with _stores_lock:
+        store = _stores.get(name)
+        if store is None:
+            store = EmbeddingStore(os.path.join(EMBEDDING_STORE_DIR, name), dim=dim)
+            _stores[name] = store
+        return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the memory-mapped embedding store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="Import a DeepFace .pkl file")
+    p_import.add_argument("pkl_path")
+    p_import.add_argument("--store", default="imported")
+    p_import.add_argument("--dim", type=int, default=EMBEDDING_DIM, help="Embedding size for a new store (128 for Facenet, 4096 for VGG-Face)")
+
+    p_compact = sub.add_parser("compact", help="Compact a store")
+    p_compact.add_argument("--store", default="users")
+
+    p_stats = sub.add_parser("stats", help="Show store size")
+    p_stats.add_argument("--store", default="users")
+
+    args = parser.parse_args()
+    store = get_store(args.store, dim=getattr(args, "dim", EMBEDDING_DIM))
+    if args.command == "import":
+        count = import_deepface_pickle(args.pkl_path, store)
+        print(f"Imported {count} embeddings into '{args.store}'")
+    elif args.command == "compact":
+        print(f"Compacted '{args.store}' into {store.compact()}")
+    else:
+        print(f"Store '{args.store}': {len(store)} records, dim={store.dim}, generation={store.generation}")
@@ -0,0 +1,250 @@
+"""
+Embedding model versions and background re-embedding.
+
+A face embedding is only comparable with one made by the same model, face
+detector and face normalisation. Every stored embedding row carries that
+triple as its model_version (e.g. "Facenet512/haar/aligned"), and
+<table>_embeddings is keyed by (id, model_version), so one record can hold
+an old and a new embedding side by side while a migration runs:
+
+    writes  - new enrollments are stored under CURRENT_EMBEDDING_VERSION,
+              together with the enrollment face crop (<table>_faces)
+    reads   - dual-read: the current version if the record has it, else an
+              older version this code can still reproduce; the pipeline then
+              embeds the selfie the old way too, so the comparison stays
+              like-for-like, and stores the current-version embedding once
+              the selfie verifies
+    migrate - ReembedWorker re-embeds records from their stored face crop in
+              throttled batches while the app keeps serving, and reports
+              progress and ETA; old-version rows are only removed by prune
+
+Rows written before versioning are labelled LEGACY_EMBEDDING_VERSION. They
+were made by DeepFace.represent running its own detector on the whole
+selfie, which this code does not reproduce, so they are never compared with
+a new selfie: their owner is verified against the ID face instead, and that
+verification stores the current-version embedding (they have no stored face
+for ReembedWorker to use).
+
+    python embedding_versions.py status
+    python embedding_versions.py migrate --batch-size 32 --max-rate 10
+    python embedding_versions.py prune --version Facenet512/deepface/legacy
+"""
+
+import time
+import logging
+import argparse
+import threading
+from utils import read_yaml
+
+config_path = "config.yaml"
+runtime = read_yaml(config_path).get('runtime', {})
+ALIGN_FACES = bool(runtime.get('ALIGN_FACES', True))
+REEMBED_BATCH_SIZE = int(runtime.get('REEMBED_BATCH_SIZE', 32))
+REEMBED_MAX_RATE = float(runtime.get('REEMBED_MAX_RATE', 10))  # records/s, 0 = unthrottled
+
+MODEL_NAME = "Facenet512"
+FACE_DETECTOR = "haar"
+FACE_NORMALISATIONS = {"aligned": True, "padded": False}
+
+
+def embedding_version(model_name=MODEL_NAME, align=ALIGN_FACES):
+    """Version label for embeddings made by `model_name` from Haar-detected, aligned or padded faces."""
+    return f"{model_name}/{FACE_DETECTOR}/{'aligned' if align else 'padded'}"
+
+
+CURRENT_EMBEDDING_VERSION = embedding_version()
+LEGACY_EMBEDDING_VERSION = f"{MODEL_NAME}/deepface/legacy"  # version_settings() is None: not reproducible
+
+
+def version_settings(version):
+    """(model_name, align) that reproduce `version`, or None if this code cannot produce it."""
+    parts = str(version).split("/")
+    if len(parts) != 3 or parts[1] != FACE_DETECTOR or parts[2] not in FACE_NORMALISATIONS:
+        return None
+    return parts[0], FACE_NORMALISATIONS[parts[2]]
+
+
+def prefer(embeddings):
+    """
+    Dual-read: pick (version, embedding) from a record's {version: embedding}.
+    The current version wins; otherwise any version the selfie can still be
+    embedded under. A record with only versions that cannot be reproduced
+    (e.g. the legacy one) gives (that version, None), so the caller verifies
+    against the ID face and still knows the record needs upgrading;
+    (None, None) if there is no embedding at all.
+    """
+    if CURRENT_EMBEDDING_VERSION in embeddings:
+        return CURRENT_EMBEDDING_VERSION, embeddings[CURRENT_EMBEDDING_VERSION]
+    for version in sorted(embeddings, reverse=True):
+        if version_settings(version) is not None:
+            return version, embeddings[version]
+    if embeddings:
+        return max(embeddings), None
+    return None, None
+
+
+# ---------------------------------------
+# Background re-embedding
+# ---------------------------------------
+class ReembedWorker:
+    """
+    Re-embed every record that has a stored enrollment face but no embedding
+    for `version`, `batch_size` records per forward pass and at most
+    `max_rate` records per second, so a live server keeps its CPU. Run it
+    inline with run(), or on a daemon thread with start()/stop().
+    progress() is safe to call from any thread.
+    """
+
+    def __init__(self, tables=("users", "aadhar"), version=CURRENT_EMBEDDING_VERSION,
+                 batch_size=REEMBED_BATCH_SIZE, max_rate=REEMBED_MAX_RATE, backend=None):
+        if version_settings(version) is None:
+            raise ValueError(f"Cannot produce embeddings for version {version!r}")
+        self.tables = tuple(tables)
+        self.version = version
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.backend = backend
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._progress = {"table": None, "done": 0, "failed": 0, "total": 0, "started_at": None, "finished": False}
+
+    def _embed(self, faces):
+        """
+        Decode stored face crops and embed them the way `version` does; rows
+        that fail, or whose face cannot be normalised that way (eyes not
+        found for an aligned version), are None.
+        """
+        import cv2
+        import numpy as np
+        from face_verification import crop_face_versioned, embed_faces_with_model
+
+        model_name, align = version_settings(self.version)
+        crops, keep = [], []
+        for i, data in enumerate(faces):
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None
+            if img is None:
+                continue
+            face, _, version = crop_face_versioned(img, align=align, model_name=model_name)
+            if version == self.version:
+                crops.append(face)
+                keep.append(i)
+        embeddings = [None] * len(faces)
+        if crops:
+            for i, embedding in zip(keep, embed_faces_with_model(crops, model_name)):
+                embeddings[i] = embedding
+        return embeddings
+
+    def run(self):
+        """Migrate each table in turn; returns progress() when done or stopped."""
+        from storage import get_backend
+
+        backend = self.backend or get_backend()
+        with self._lock:
+            self._progress.update(started_at=time.monotonic(), finished=False,
+                                  total=sum(backend.count_missing_embeddings(t, self.version) for t in self.tables))
+        logging.info("Re-embedding %s records to %s", self._progress["total"], self.version)
+        for table in self.tables:
+            if self._stop.is_set():
+                break
+            with self._lock:
+                self._progress["table"] = table
+            for batch in backend.iter_missing_embeddings(table, self.version, batch_size=self.batch_size):
+                if self._stop.is_set():
+                    break
+                ids = [record_id for record_id, _ in batch]
+                embeddings = self._embed([face for _, face in batch])
+                done = [(i, e) for i, e in zip(ids, embeddings) if e is not None]
+                if done:
+                    backend.put_embeddings(table, self.version, [i for i, _ in done], [e for _, e in done])
+                with self._lock:
+                    self._progress["done"] += len(done)
+                    self._progress["failed"] += len(ids) - len(done)
+                progress = self.progress()
+                logging.info("Re-embedding %s: %s/%s done, %s failed, %.1f/s, ETA %ss", table,
+                             progress["done"], progress["total"], progress["failed"],
+                             progress["rate"], progress["eta_s"])
+                self._throttle()
+        with self._lock:
+            self._progress["finished"] = not self._stop.is_set()
+        return self.progress()
+
+    def _throttle(self):
+        if self.max_rate <= 0:
+            return
+        with self._lock:
+            processed = self._progress["done"] + self._progress["failed"]
+            started_at = self._progress["started_at"]
+        wait = processed / self.max_rate - (time.monotonic() - started_at)
+        if wait > 0:
+            self._stop.wait(wait)
+
+    def progress(self):
+        """{"table", "done", "failed", "total", "rate" (records/s), "eta_s", "finished"}."""
+        with self._lock:
+            progress = dict(self._progress)
+        started_at = progress.pop("started_at")
+        elapsed = time.monotonic() - started_at if started_at is not None else 0.0
+        processed = progress["done"] + progress["failed"]
+        progress["rate"] = processed / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, progress["total"] - processed)
+        progress["eta_s"] = round(remaining / progress["rate"]) if progress["rate"] > 0 else None
+        return progress
+
+    def start(self):
+        """Run on a daemon thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="reembed", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Finish the current batch and stop; records not reached keep their old embedding."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+# ---------------------------------------
+# CLI
+# ---------------------------------------
+def print_status(tables=("users", "aadhar"), version=CURRENT_EMBEDDING_VERSION):
+    from storage import get_backend
+
+    backend = get_backend()
+    print(f"current version: {version}")
+    for table in tables:
+        counts = backend.embedding_version_counts(table)
+        missing = backend.count_missing_embeddings(table, version)
+        print(f"{table}: " + ", ".join(f"{v}={n}" for v, n in sorted(counts.items()))
+              + f"; {missing} with a stored face still to re-embed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding model versions and re-embedding migration.")
+    parser.add_argument("--table", choices=["users", "aadhar"], action="append",
+                        help="Table to work on (repeatable; default: both)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="Embeddings per version, and records left to migrate")
+    p_migrate = sub.add_parser("migrate", help="Re-embed stored faces under the current version")
+    p_migrate.add_argument("--batch-size", type=int, default=REEMBED_BATCH_SIZE)
+    p_migrate.add_argument("--max-rate", type=float, default=REEMBED_MAX_RATE, help="Records per second, 0 = unthrottled")
+    p_prune = sub.add_parser("prune", help="Delete old-version embeddings of records already re-embedded")
+    p_prune.add_argument("--version", required=True)
+    args = parser.parse_args()
+
+    from logging_config import setup_logging
+    setup_logging()
+    tables = tuple(args.table or ("users", "aadhar"))
+    if args.command == "status":
+        print_status(tables)
+    elif args.command == "migrate":
+        result = ReembedWorker(tables, batch_size=args.batch_size, max_rate=args.max_rate).run()
+        print(f"Re-embedded {result['done']} records ({result['failed']} failed) to {CURRENT_EMBEDDING_VERSION}")
+    else:
+        if args.version == CURRENT_EMBEDDING_VERSION:
+            raise SystemExit("Refusing to prune the current embedding version")
+        from storage import get_backend
+        for table in tables:
+            deleted = get_backend().prune_embeddings(table, args.version)
+            print(f"{table}: deleted {deleted} '{args.version}' embeddings already re-embedded")
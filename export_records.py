@@ -0,0 +1,194 @@
+"""
+Streaming export of enrolled records (users / aadhar) to Parquet or CSV.
+
+Rows are read through the configured storage backend (an unbuffered,
+server-side cursor on MySQL) in fixed-size chunks and written incrementally, so memory stays constant regardless of table
+size. Embeddings of the current model version are joined in from the
+<table>_embeddings side table and decoded into a float32 array per chunk:
+a fixed-size list column in Parquet, or emb_0..emb_N columns in CSV
+(9 significant digits, which round-trip float32 exactly).
+
+Usage:
+    python export_records.py --table users --format parquet --out exports/users.parquet
+    python export_records.py --table aadhar --format csv --since 2025-01-01 --until 2025-02-01
+    python export_records.py --table users --incremental   # continue from the last export
+"""
+
+import os
+import csv
+import json
+import logging
+import argparse
+import numpy as np
+from datetime import datetime
+from storage import get_backend, parse_embedding
+from embedding_store import EMBEDDING_DIM
+from embedding_versions import CURRENT_EMBEDDING_VERSION
+
+EXPORT_DIR = "exports"
+EXPORT_STATE_FILE = os.path.join(EXPORT_DIR, ".export_state.json")
+TABLES = ("users", "aadhar")
+
+
+# ---------------------------------------
+# Reading
+# ---------------------------------------
+def iter_chunks(table, since=None, until=None, chunk_size=5000, version=CURRENT_EMBEDDING_VERSION):
+    """
+    Yield (columns, rows) chunks from `table` with their `version` embedding,
+    ordered by created_at, from the configured storage backend (streamed by a
+    server-side cursor on MySQL).
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table: {table}")
+    yield from get_backend().iter_export(table, since=since, until=until, version=version, chunk_size=chunk_size)
+
+
+def decode_embeddings(values, dim=EMBEDDING_DIM):
+    """Decode a chunk of `embedding` column values into an (n, dim) float32 array (NaN rows if missing)."""
+    out = np.full((len(values), dim), np.nan, dtype=np.float32)
+    for i, value in enumerate(values):
+        try:
+            embedding = parse_embedding(value)
+        except ValueError:
+            embedding = None
+        if embedding is not None and len(embedding) == dim:
+            out[i] = embedding
+    return out
+
+
+def split_chunk(columns, rows):
+    """Turn a row chunk into {column: list} plus the decoded embedding matrix."""
+    data = {col: [row[i] for row in rows] for i, col in enumerate(columns)}
+    embeddings = decode_embeddings(data.pop("embedding", [None] * len(rows)))
+    return data, embeddings
+
+
+# ---------------------------------------
+# Writers
+# ---------------------------------------
+class ParquetChunkWriter:
+    """Appends chunks as row groups; embeddings become a fixed_size_list<float32> column."""
+
+    def __init__(self, path):
+        import pyarrow  # optional dependency, only needed for Parquet output
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.writer = None
+
+    def write(self, data, embeddings):
+        pa = self.pa
+        # Explicit string type: a column that is all-NULL in one chunk must not change the schema
+        arrays = {
+            col: pa.array([None if v is None else str(_plain(v)) for v in values], type=pa.string())
+            for col, values in data.items()
+        }
+        flat = pa.array(embeddings.reshape(-1), type=pa.float32())
+        arrays["embedding"] = pa.FixedSizeListArray.from_arrays(flat, embeddings.shape[1])
+        table = pa.table(arrays)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class CsvChunkWriter:
+    """Appends chunks to a CSV file; embeddings are expanded into emb_0..emb_N columns."""
+
+    def __init__(self, path):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.header_written = False
+
+    def write(self, data, embeddings):
+        columns = list(data.keys())
+        if not self.header_written:
+            self.writer.writerow(columns + [f"emb_{i}" for i in range(embeddings.shape[1])])
+            self.header_written = True
+        for i in range(len(embeddings)):
+            row = [_plain(data[col][i]) for col in columns]
+            self.writer.writerow(row + ["" if np.isnan(v) else f"{v:.9g}" for v in embeddings[i]])
+
+    def close(self):
+        self.file.close()
+
+
+def _plain(value):
+    """Dates and datetimes as ISO strings, BINARY ids as hex, so both writers get stable column types."""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return value
+
+
+# ---------------------------------------
+# Export
+# ---------------------------------------
+def _load_state():
+    if os.path.exists(EXPORT_STATE_FILE):
+        with open(EXPORT_STATE_FILE) as f:
+            return json.load(f)
+    return {}
+
+
+def _save_state(state):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    with open(EXPORT_STATE_FILE, "w") as f:
+        json.dump(state, f, indent=2)
+
+
+def export_table(table, out_path, fmt="parquet", since=None, until=None, chunk_size=5000):
+    """
+    Stream `table` into `out_path`. Returns (rows written, latest created_at seen)
+    so callers can continue with since=<latest> next time.
+    """
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    writer = ParquetChunkWriter(out_path) if fmt == "parquet" else CsvChunkWriter(out_path)
+    total, latest = 0, None
+    try:
+        for columns, rows in iter_chunks(table, since=since, until=until, chunk_size=chunk_size):
+            data, embeddings = split_chunk(columns, rows)
+            writer.write(data, embeddings)
+            total += len(rows)
+            if data.get("created_at"):
+                latest = max(v for v in data["created_at"] if v is not None)
+            logging.info("Exported %s rows from '%s' so far", total, table)
+    finally:
+        writer.close()
+    logging.info("Export of '%s' finished: %s rows -> %s", table, total, out_path)
+    return total, latest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream users/aadhar tables to Parquet or CSV.")
+    parser.add_argument("--table", choices=TABLES, required=True)
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    parser.add_argument("--out", help="Output file (default: exports/<table>_<timestamp>.<format>)")
+    parser.add_argument("--since", help="Only rows with created_at >= this (YYYY-MM-DD[ HH:MM:SS])")
+    parser.add_argument("--until", help="Only rows with created_at < this")
+    parser.add_argument("--incremental", action="store_true", help="Start from the last exported created_at")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    state = _load_state()
+    since = args.since
+    if args.incremental and since is None:
+        since = state.get(args.table)
+    out = args.out or os.path.join(
+        EXPORT_DIR, f"{args.table}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{args.format}"
+    )
+
+    count, latest = export_table(args.table, out, fmt=args.format, since=since, until=args.until,
+                                 chunk_size=args.chunk_size)
+    if latest is not None:
+        # The next run uses created_at >= latest: rows sharing that second are
+        # exported again rather than missed, so dedupe on `id` downstream
+        state[args.table] = _plain(latest)
+        _save_state(state)
+    print(f"Exported {count} rows from '{args.table}' to {out}")
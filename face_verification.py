@@ -1,14 +1,38 @@
 import os
 import cv2
+import json
+import logging
 import numpy as np
 import warnings
 from deepface import DeepFace
+from preprocess import get_face_cascade, get_eye_cascade
+from utils import read_yaml
+from onnx_backend import EMBEDDING_BACKEND, get_onnx_embedder
+from embedding_versions import MODEL_NAME, ALIGN_FACES, CURRENT_EMBEDDING_VERSION, embedding_version, version_settings
 
 # === Suppress DeepFace & TensorFlow logs ===
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
 warnings.filterwarnings("ignore", category=UserWarning)
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
+MODEL_INPUT_SIZE = (160, 160)  # Facenet512 input (height, width)
+FACENET512_COSINE_THRESHOLD = 0.7  # Custom threshold for Facenet512 + cosine (used until calibrated)
+
+config = read_yaml("config.yaml")
+CALIBRATION_FILE = config['artifacts'].get('CALIBRATION_FILE', os.path.join("data", "models", "calibration.json"))
+runtime = config.get('runtime', {})
+TIERED_VERIFICATION = bool(runtime.get('TIERED_VERIFICATION', True))
+ESCALATION_MODEL = runtime.get('ESCALATION_MODEL', "ArcFace")
+# Where the eye centres land in an aligned MODEL_INPUT_SIZE crop, as fractions of (width, height)
+ALIGNED_LEFT_EYE = (0.34, 0.38)
+ALIGNED_RIGHT_EYE = (0.66, 0.38)
+EYE_SEARCH_WIDTH = 160  # smaller face boxes are upscaled to this width before eye detection
+ENROLLMENT_FACE_MARGIN = 0.4  # stored enrollment crops keep this much context around the face box
+ENROLLMENT_FACE_SIZE = 256
+# DeepFace's own cosine thresholds, used for models that have not been calibrated
+DEFAULT_COSINE_THRESHOLDS = {MODEL_NAME: FACENET512_COSINE_THRESHOLD, "ArcFace": 0.68, "VGG-Face": 0.40,
+                             "Facenet": 0.40, "SFace": 0.593}
+
 
 def detect_and_extract_face(image_path=None, img=None):
     """
@@ -56,26 +80,21 @@ def detect_and_extract_face(image_path=None, img=None):
 
 
 def normalize_face(image_path):
-    """Resize faces to standard 224x224 for consistent embeddings."""
-    try:
-        img = cv2.imread(image_path)
-        if img is None:
-            return image_path
-        resized = cv2.resize(img, (224, 224))
-        cv2.imwrite(image_path, resized)
-        return image_path
-    except Exception as e:
-        print(f"⚠️ Error normalizing {image_path}: {e}")
-        return image_path
+    """
+    Largest face of an image (path or array) at the model input size, in
+    memory: eye-aligned when possible, otherwise resized with padding.
+    Nothing is written back to disk.
+    """
+    img = cv2.imread(image_path) if isinstance(image_path, str) else image_path
+    if img is None:
+        raise ValueError(f"Unreadable image: {image_path}")
+    face, _ = crop_largest_face(img)
+    return letterbox(face)
 
 
-def show_faces_side_by_side(img1_path, img2_path, verified, distance, threshold):
+def show_faces_side_by_side(img1, img2, verified, distance, threshold):
     """Display both faces side-by-side with match info."""
     try:
-        img1 = cv2.imread(img1_path)
-        img2 = cv2.imread(img2_path)
-        if img1 is None or img2 is None:
-            return
 
         img1 = cv2.resize(img1, (250, 250))
         img2 = cv2.resize(img2, (250, 250))
@@ -92,39 +111,119 @@ def show_faces_side_by_side(img1_path, img2_path, verified, distance, threshold)
         print(f"⚠️ Unable to display faces: {e}")
 
 
+# === Calibrated thresholds / tiered decision ===
+_calibration = None
+_uncalibrated_warned = set()
+
+
+def load_calibration(path=CALIBRATION_FILE):
+    """
+    Per-embedding-version thresholds written by `python calibration.py run`;
+    empty if not calibrated yet. Files from before versioning are keyed by
+    model name and were fitted on padded crops, so they count as the padded
+    version of that model.
+    """
+    global _calibration
+    if _calibration is None:
+        try:
+            with open(path) as f:
+                calibration = json.load(f)
+        except (OSError, ValueError):
+            calibration = {}
+        _calibration = {key if "/" in key else embedding_version(key, align=False): entry
+                        for key, entry in calibration.items()}
+    return _calibration
+
+
+def get_thresholds(version=CURRENT_EMBEDDING_VERSION):
+    """
+    Return {"threshold", "accept_below", "reject_above"} for an embedding
+    version (thresholds fitted on one face normalisation do not carry over to
+    another). Distances below accept_below / above reject_above are
+    clear-cut; the band between them is borderline. Uncalibrated versions
+    have no band and use DeepFace's threshold for the model.
+    """
+    entry = load_calibration().get(version)
+    if entry is None:
+        entry = {}
+        if version not in _uncalibrated_warned:
+            _uncalibrated_warned.add(version)
+            logging.warning("No calibration for %s; using the default threshold (run calibration.py)", version)
+    model_name = str(version).split("/")[0]
+    threshold = entry.get("threshold", DEFAULT_COSINE_THRESHOLDS.get(model_name, FACENET512_COSINE_THRESHOLD))
+    return {
+        "threshold": threshold,
+        "accept_below": entry.get("accept_below", threshold),
+        "reject_above": entry.get("reject_above", threshold),
+    }
+
+
+def escalation_version(version=CURRENT_EMBEDDING_VERSION):
+    """Version of ESCALATION_MODEL distances between faces normalised the way `version`'s were."""
+    settings = version_settings(version)
+    return embedding_version(ESCALATION_MODEL, align=settings[1] if settings else ALIGN_FACES)
+
+
+def tiered_decision(distance, escalate=None, version=CURRENT_EMBEDDING_VERSION):
+    """
+    Decide on the fast model's distance (embeddings of `version`) when it is
+    clear-cut; for a borderline distance call `escalate()` (a heavier model's
+    distance between the same faces, or None if it cannot score them) and
+    decide on that. Returns (verified, tier, distance used).
+    """
+    t = get_thresholds(version)
+    if distance <= t["accept_below"]:
+        return True, "fast", distance
+    if distance > t["reject_above"] or escalate is None or not TIERED_VERIFICATION:
+        return distance <= t["threshold"], "fast", distance
+    escalated = escalate()
+    if escalated is None:
+        return distance <= t["threshold"], "fast", distance
+    escalated = float(escalated)
+    verified = escalated <= get_thresholds(escalation_version(version))["threshold"]
+    logging.info("Borderline distance %.3f escalated to %s: %.3f", distance, ESCALATION_MODEL, escalated)
+    return verified, "escalated", escalated
+
+
 def deepface_face_comparison(image1_path, image2_path):
     """
     Compare two faces using DeepFace (Facenet512).
     Returns True/False based on manual similarity threshold.
     """
     try:
-        # Step 1: Detect & normalize
-        img1_processed = normalize_face(detect_and_extract_face(image_path=image1_path))
-        img2_processed = normalize_face(detect_and_extract_face(image_path=image2_path))
-
-        print("🔍 Running DeepFace verification using Facenet512 model...")
-
-        # Step 2: Run DeepFace verification
-        result = DeepFace.verify(
-            img1_path=img1_processed,
-            img2_path=img2_processed,
-            model_name="Facenet512",
-            detector_backend="opencv",
-            distance_metric="cosine",
-            enforce_detection=False
-        )
+        # Step 1: Detect & align (in memory, at the model input size)
+        img1_processed = normalize_face(image1_path)
+        img2_processed = normalize_face(image2_path)
+
+        print(f"🔍 Running verification using Facenet512 model ({EMBEDDING_BACKEND} backend)...")
 
-        # Step 3: Extract results
-        distance = result.get("distance", 1.0)
-        threshold = 0.7  # Custom threshold for Facenet512 + cosine
-        verified = distance <= threshold
+        # Step 2: Run verification
+        if EMBEDDING_BACKEND == "onnx":
+            # Faces are already cropped above; embed both in one ONNX Runtime call
+            embeddings = embed_faces_batch([img1_processed, img2_processed])
+            distance = float(cosine_distances(embeddings[0], embeddings[1:])[0])
+        else:
+            result = DeepFace.verify(
+                img1_path=img1_processed,
+                img2_path=img2_processed,
+                model_name=MODEL_NAME,
+                detector_backend="skip",
+                distance_metric="cosine",
+                enforce_detection=False
+            )
+            distance = result.get("distance", 1.0)
+
+        # Step 3: Extract results (borderline distances are re-checked with the heavier model)
+        threshold = get_thresholds()["threshold"]
+        verified, tier, _ = tiered_decision(distance, escalate=lambda: model_distance(
+            img1_processed, img2_processed, ESCALATION_MODEL))
 
         # Step 4: Show results visually
         show_faces_side_by_side(img1_processed, img2_processed, verified, distance, threshold)
 
         print(f"\nModel: Facenet512")
         print(f"Distance: {distance:.3f}")
-        print(f"Threshold: {threshold:.2f}")
+        print(f"Threshold: {threshold:.2f} ({tier} decision)")
         print(f"✅ Result: {'MATCH ✅' if verified else 'MISMATCH ❌'}")
 
         return verified
@@ -137,9 +236,14 @@ def deepface_face_comparison(image1_path, image2_path):
 def get_face_embeddings(image_path):
     """Extracts 512D facial embeddings for database use."""
     try:
+        if EMBEDDING_BACKEND == "onnx":
+            face, _ = crop_largest_face(cv2.imread(image_path))
+            print(f"✅ Embedding extracted for {image_path} (onnx)")
+            return embed_faces_batch([face])[0].tolist()
         embedding = DeepFace.represent(
-            img_path=image_path,
-            model_name="Facenet512",
+            img_path=normalize_face(image_path),
+            model_name=MODEL_NAME,
+            detector_backend="skip",
             enforce_detection=False
         )
         print(f"✅ Embedding extracted for {image_path}")
@@ -149,6 +253,279 @@ def get_face_embeddings(image_path):
         return None
 
 
+# === Face alignment ===
+def detect_eyes(img, box):
+    """
+    Eye centres ((x, y) image-left, (x, y) image-right) inside a face box, in
+    image coordinates, or None unless exactly one plausible eye is found on
+    each side of the upper face.
+    """
+    x, y, w, h = box
+    upper = cv2.cvtColor(img[y:y + int(h * 0.6), x:x + w], cv2.COLOR_BGR2GRAY)
+    # The eye cascade's 20px window misses eyes in small (ID-photo) faces: search them upscaled
+    zoom = max(1.0, EYE_SEARCH_WIDTH / w)
+    if zoom > 1.0:
+        upper = cv2.resize(upper, None, fx=zoom, fy=zoom, interpolation=cv2.INTER_CUBIC)
+    side_px = int(w * zoom)
+    eyes = get_eye_cascade().detectMultiScale(upper, scaleFactor=1.1, minNeighbors=5,
+                                              minSize=(side_px // 10,) * 2, maxSize=(side_px // 2,) * 2)
+    sides = ([], [])
+    for (ex, ey, ew, eh) in eyes:
+        centre = ((ex + ew / 2.0) / zoom, (ey + eh / 2.0) / zoom)
+        sides[centre[0] >= w / 2].append((ew * eh, centre))
+    if not sides[0] or not sides[1]:
+        return None
+    (lx, ly), (rx, ry) = (max(side)[1] for side in sides)
+    # Nostrils and eyebrows also fire the cascade; keep only eye-like geometry
+    if rx - lx < 0.25 * w or abs(ry - ly) > 0.5 * (rx - lx):
+        return None
+    return (x + lx, y + ly), (x + rx, y + ry)
+
+
+def align_face(img, box, size=MODEL_INPUT_SIZE):
+    """
+    Warp the face in `box` so the eyes sit level at ALIGNED_*_EYE in a
+    `size` (height, width) crop: one similarity transform (rotation, scale,
+    shift) taken from the full image, so no pixels are lost at the box edge.
+    Returns None when the eyes cannot be located.
+    """
+    eyes = detect_eyes(img, box)
+    if eyes is None:
+        return None
+    (lx, ly), (rx, ry) = eyes
+    height, width = size
+    angle = np.degrees(np.arctan2(ry - ly, rx - lx))
+    scale = (ALIGNED_RIGHT_EYE[0] - ALIGNED_LEFT_EYE[0]) * width / np.hypot(rx - lx, ry - ly)
+    centre = ((lx + rx) / 2.0, (ly + ry) / 2.0)
+    matrix = cv2.getRotationMatrix2D(centre, angle, scale)
+    matrix[0, 2] += (ALIGNED_LEFT_EYE[0] + ALIGNED_RIGHT_EYE[0]) / 2 * width - centre[0]
+    matrix[1, 2] += (ALIGNED_LEFT_EYE[1] + ALIGNED_RIGHT_EYE[1]) / 2 * height - centre[1]
+    return cv2.warpAffine(img, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT)
+
+
+def letterbox(face, target_size=MODEL_INPUT_SIZE):
+    """Resize-with-padding (same as DeepFace's extract_faces); model-sized faces are returned as is."""
+    if face.shape[:2] == tuple(target_size):
+        return face
+    factor = min(target_size[0] / face.shape[0], target_size[1] / face.shape[1])
+    dsize = (max(1, int(face.shape[1] * factor)), max(1, int(face.shape[0] * factor)))
+    resized = cv2.resize(face, dsize)
+    padded = np.zeros((target_size[0], target_size[1], 3), dtype=face.dtype)
+    top = (target_size[0] - resized.shape[0]) // 2
+    left = (target_size[1] - resized.shape[1]) // 2
+    padded[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return padded
+
+
+# === Multi-frame (burst) verification ===
+def crop_largest_face(img, align=None):
+    """
+    Return (face, box) for the largest face in an OpenCV image. With
+    alignment on (ALIGN_FACES, or `align`) the face is the eye-aligned
+    MODEL_INPUT_SIZE crop when both eyes are found, else the plain box crop.
+    When no face is found the whole image is returned with box=None,
+    matching detect_and_extract_face().
+    """
+    face, box, _ = crop_face_versioned(img, align=align)
+    return face, box
+
+
+def crop_face_versioned(img, align=None, model_name=MODEL_NAME):
+    """
+    crop_largest_face() plus the embedding version `model_name` gives the
+    crop: the padded version when alignment was off or fell back to the box
+    crop, so fallback embeddings are never stored or compared as aligned ones.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    faces = get_face_cascade().detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5)
+    if len(faces) == 0:
+        return img, None, embedding_version(model_name, align=False)
+    (x, y, w, h) = max(faces, key=lambda f: f[2] * f[3])
+    box = (int(x), int(y), int(w), int(h))
+    if ALIGN_FACES if align is None else align:
+        aligned = align_face(img, box)
+        if aligned is not None:
+            return aligned, box, embedding_version(model_name, align=True)
+    return img[y:y + h, x:x + w], box, embedding_version(model_name, align=False)
+
+
+def box_crop(img, box):
+    """The plain (padded-version) crop of `box`; the whole image when there is no box."""
+    if box is None:
+        return img
+    x, y, w, h = box
+    return img[y:y + h, x:x + w]
+
+
+def enrollment_face(img, box):
+    """
+    JPEG bytes of the face in `box` with some margin, kept with the record so
+    it can be re-embedded by a later model (embedding_versions.ReembedWorker).
+    """
+    x, y, w, h = box
+    pad = int(max(w, h) * ENROLLMENT_FACE_MARGIN)
+    crop = img[max(0, y - pad):y + h + pad, max(0, x - pad):x + w + pad]
+    factor = ENROLLMENT_FACE_SIZE / max(crop.shape[:2])
+    if factor < 1:
+        crop = cv2.resize(crop, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    ok, data = cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return data.tobytes() if ok else None
+
+
+def prepare_face_batch(faces, target_size=MODEL_INPUT_SIZE):
+    """
+    Bring each BGR face to the model input size (aligned crops already are,
+    others are letterboxed) and stack them into one float32 batch in [0, 1].
+    """
+    if not len(faces):
+        return np.zeros((0, target_size[0], target_size[1], 3), dtype=np.float32)
+    batch = np.stack([letterbox(face, target_size) for face in faces]).astype(np.float32)
+    batch /= 255.0
+    return batch
+
+
+def get_embedding_model():
+    """Return the underlying Keras Facenet512 model (DeepFace keeps it as a singleton)."""
+    model = DeepFace.build_model(MODEL_NAME)
+    return getattr(model, "model", model)
+
+
+def get_inference_model():
+    """Return the model for the configured backend: ONNX Runtime or the TensorFlow reference."""
+    if EMBEDDING_BACKEND == "onnx":
+        return get_onnx_embedder()
+    return get_embedding_model()
+
+
+def embed_faces_batch(faces):
+    """Embed a list of face crops with a single forward pass. Returns an (n, 512) array."""
+    batch = prepare_face_batch(faces)
+    return np.asarray(get_inference_model().predict(batch, verbose=0), dtype=np.float32)
+
+
+def embed_faces_with_model(faces, model_name):
+    """Embed face crops with any DeepFace model; MODEL_NAME uses the batched fast path."""
+    if model_name == MODEL_NAME:
+        return embed_faces_batch(faces)
+    embeddings = [
+        DeepFace.represent(img_path=face, model_name=model_name, detector_backend="skip",
+                           enforce_detection=False)[0]["embedding"]
+        for face in faces
+    ]
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def model_distance(face1, face2, model_name):
+    """Cosine distance between two face crops under `model_name`."""
+    embeddings = embed_faces_with_model([face1, face2], model_name)
+    return float(cosine_distances(embeddings[0], embeddings[1:])[0])
+
+
+def cosine_distances(reference, embeddings):
+    """Cosine distance between one reference vector and each row of `embeddings`."""
+    reference = np.asarray(reference, dtype=np.float32)
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference)
+    return 1.0 - (embeddings @ reference) / np.maximum(norms, 1e-12)
+
+
+def aggregate_distances(distances, aggregate="median", top_k=3):
+    """Collapse per-frame distances into one score ('median', 'best_k' or 'min')."""
+    distances = np.asarray(distances, dtype=np.float32)
+    if aggregate == "min":
+        return float(distances.min())
+    if aggregate == "best_k":
+        k = max(1, min(top_k, len(distances)))
+        return float(np.sort(distances)[:k].mean())
+    return float(np.median(distances))
+
+
+def motion_liveness(face_crops, boxes, min_motion=2.0, size=(64, 64)):
+    """
+    Basic motion-based liveness over a burst of frames.
+
+    A live subject shows small frame-to-frame changes (blinks, expression,
+    head movement); a still photo held to the camera or a repeated upload
+    does not. Motion is the mean absolute grey-level difference between
+    consecutive face crops plus the face-box centre shift in pixels.
+    """
+    tracked = [cv2.resize(cv2.cvtColor(c, cv2.COLOR_BGR2GRAY), size).astype(np.float32)
+               for c, b in zip(face_crops, boxes) if b is not None]
+    centres = np.array([(b[0] + b[2] / 2.0, b[1] + b[3] / 2.0) for b in boxes if b is not None])
+    if len(tracked) < 2:
+        return {"live": False, "motion": 0.0, "frames_with_face": len(tracked)}
+
+    stack = np.stack(tracked)
+    texture_motion = np.abs(np.diff(stack, axis=0)).mean(axis=(1, 2))
+    centre_motion = np.linalg.norm(np.diff(centres, axis=0), axis=1)
+    motion = float(np.median(texture_motion + centre_motion))
+    return {"live": motion >= min_motion, "motion": motion, "frames_with_face": len(tracked)}
+
+
+def verify_selfie_frames(id_image, frames, aggregate="median", top_k=3,
+                         threshold=None, min_motion=2.0,
+                         reference_embedding=None, reference_version=CURRENT_EMBEDDING_VERSION):
+    """
+    Verify a burst of selfie frames against the ID card face.
+
+    The ID face and every frame's face are embedded together in one forward
+    pass and scored with one vectorised cosine-distance computation. When a
+    stored `reference_embedding` is given the ID face is not processed at all,
+    and the frames are embedded the way its `reference_version` was. Faces
+    are only compared with faces normalised the same way: if a frame cannot
+    be (e.g. its eyes are not found), the burst is compared with the ID face
+    instead, as padded crops when the faces could not all be aligned.
+    Returns a dict with the aggregated decision, per-frame distances, the
+    index, box and embedding of the best frame, the liveness result and the
+    embedding version of the comparison.
+    """
+    version = None
+    if reference_embedding is not None:
+        model_name, align = version_settings(reference_version)
+        crops, boxes, versions = zip(*(crop_face_versioned(f, align=align, model_name=model_name) for f in frames))
+        if set(versions) == {reference_version}:
+            version = reference_version
+            reference = np.asarray(reference_embedding, dtype=np.float32)
+            frame_embeddings = embed_faces_with_model(list(crops), model_name)
+        else:
+            logging.info("Selfie frames do not all normalise like the stored %s embedding; "
+                         "comparing with the ID face", reference_version)
+    if version is None:
+        if isinstance(id_image, str):
+            id_image = cv2.imread(id_image)
+        id_face, id_box, version = crop_face_versioned(id_image)
+        crops, boxes, versions = zip(*(crop_face_versioned(f) for f in frames))
+        if set(versions) != {version}:
+            version = embedding_version(MODEL_NAME, align=False)
+            id_face = box_crop(id_image, id_box)
+            crops = [box_crop(f, b) for f, b in zip(frames, boxes)]
+        embeddings = embed_faces_batch([id_face] + list(crops))
+        reference, frame_embeddings = embeddings[0], embeddings[1:]
+    crops, boxes = list(crops), list(boxes)
+    threshold = get_thresholds(version)["threshold"] if threshold is None else threshold
+    distances = cosine_distances(reference, frame_embeddings)
+    distance = aggregate_distances(distances, aggregate=aggregate, top_k=top_k)
+    liveness = motion_liveness(crops, boxes, min_motion=min_motion)
+
+    best_frame = int(np.argmin(distances))
+    result = {
+        "verified": distance <= threshold,
+        "distance": distance,
+        "distances": distances.tolist(),
+        "best_frame": best_frame,
+        "best_embedding": frame_embeddings[best_frame].tolist(),
+        "best_face": crops[best_frame],
+        "best_box": boxes[best_frame],
+        "threshold": threshold,
+        "liveness": liveness,
+        "version": version,
+    }
+    logging.info("Burst verification: %s frames, %s distance=%.3f, live=%s (motion=%.2f)",
+                 len(frames), aggregate, distance, liveness['live'], liveness['motion'])
+    return result
+
+
 # === Optional quick test ===
 if __name__ == "__main__":
     img1 = "contour_id.jpg"        # Replace with your ID image
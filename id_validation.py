@@ -0,0 +1,174 @@
+"""
+ID number validation and OCR candidate re-ranking.
+
+A misread ID number hashes to a new identity, so numbers are validated
+before they are used:
+
+  - PAN: AAAAA9999A, the 4th letter is the holder type (P = person, C =
+    company, ...), and for a person the 5th letter is the surname initial.
+  - Aadhaar: 12 digits, not starting with 0 or 1, last digit a Verhoeff
+    check digit.
+
+When the token the parser picked fails, every OCR token is turned into
+candidates by fixing the usual letter/digit confusions (O/0, I/1, S/5, B/8,
+Z/2, G/6) by position and, for Aadhaar, single look-alike digit
+substitutions. Valid candidates are ranked by number of edits, then (PAN)
+by whether the 5th letter matches a name initial, then by distance from where
+the parser expected the number. The initial only ranks: the name is OCR'd
+too, so a mismatch never rejects an otherwise well-formed PAN. Ambiguous
+Aadhaar corrections are refused rather than guessed.
+"""
+
+import re
+import logging
+
+PAN_PATTERN = re.compile(r"^[A-Z]{5}[0-9]{4}[A-Z]$")
+PAN_HOLDER_TYPES = set("ABCFGHJLPT")
+AADHAAR_PATTERN = re.compile(r"^[2-9][0-9]{11}$")
+
+LETTER_TO_DIGIT = {"O": "0", "D": "0", "Q": "0", "I": "1", "L": "1", "T": "7", "Z": "2",
+                   "S": "5", "B": "8", "G": "6", "A": "4"}
+DIGIT_TO_LETTER = {"0": "O", "1": "I", "2": "Z", "5": "S", "8": "B", "6": "G", "4": "A", "7": "T"}
+# Digits EasyOCR confuses with each other on printed cards
+DIGIT_CONFUSIONS = {"0": "86", "1": "7", "3": "8", "5": "6", "6": "58", "7": "1", "8": "306", "9": "0"}
+
+# Verhoeff dihedral-group tables
+_VERHOEFF_D = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 2, 3, 4, 0, 6, 7, 8, 9, 5],
+    [2, 3, 4, 0, 1, 7, 8, 9, 5, 6], [3, 4, 0, 1, 2, 8, 9, 5, 6, 7],
+    [4, 0, 1, 2, 3, 9, 5, 6, 7, 8], [5, 9, 8, 7, 6, 0, 4, 3, 2, 1],
+    [6, 5, 9, 8, 7, 1, 0, 4, 3, 2], [7, 6, 5, 9, 8, 2, 1, 0, 4, 3],
+    [8, 7, 6, 5, 9, 3, 2, 1, 0, 4], [9, 8, 7, 6, 5, 4, 3, 2, 1, 0],
+]
+_VERHOEFF_P = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 5, 7, 6, 2, 8, 3, 0, 9, 4],
+    [5, 8, 0, 3, 7, 9, 6, 1, 4, 2], [8, 9, 1, 6, 0, 4, 3, 5, 2, 7],
+    [9, 4, 5, 3, 1, 2, 6, 8, 7, 0], [4, 2, 8, 6, 5, 7, 3, 9, 0, 1],
+    [2, 7, 9, 3, 8, 0, 6, 4, 1, 5], [7, 0, 4, 6, 9, 1, 3, 2, 5, 8],
+]
+
+
+# ---------------------------------------
+# Validation
+# ---------------------------------------
+def verhoeff_valid(digits):
+    """True if the digit string ends in a correct Verhoeff check digit."""
+    c = 0
+    for i, ch in enumerate(reversed(digits)):
+        c = _VERHOEFF_D[c][_VERHOEFF_P[i % 8][int(ch)]]
+    return c == 0
+
+
+def is_valid_aadhaar(number):
+    digits = re.sub(r"\s", "", str(number or ""))
+    return bool(AADHAAR_PATTERN.match(digits)) and verhoeff_valid(digits)
+
+
+def is_valid_pan(pan):
+    """Format and holder type."""
+    pan = str(pan or "")
+    return bool(PAN_PATTERN.match(pan)) and pan[3] in PAN_HOLDER_TYPES
+
+
+def _initial_mismatch(pan, name):
+    """1 if `pan` is personal and its 5th letter is none of the name's initials (an OCR'd name may be misread)."""
+    initials = {token[0] for token in re.sub(r"[^A-Z ]", " ", str(name or "").upper()).split()}
+    return int(bool(initials) and pan[3] == "P" and pan[4] not in initials)
+
+
+def format_aadhaar(digits):
+    return f"{digits[:4]} {digits[4:8]} {digits[8:]}"
+
+
+# ---------------------------------------
+# Candidates
+# ---------------------------------------
+def pan_candidate(token):
+    """Coerce a token to PAN shape by position; returns (candidate, edits) or None."""
+    raw = re.sub(r"[^A-Z0-9]", "", str(token).upper())
+    if len(raw) != 10:
+        return None
+    out, edits = [], 0
+    for i, ch in enumerate(raw):
+        want_digit = 5 <= i <= 8
+        fixed = LETTER_TO_DIGIT.get(ch, ch) if want_digit and ch.isalpha() else \
+            DIGIT_TO_LETTER.get(ch, ch) if not want_digit and ch.isdigit() else ch
+        edits += fixed != ch
+        out.append(fixed)
+    return "".join(out), edits
+
+
+def aadhaar_candidates(token):
+    """Yield (12-digit candidate, edits) for a token: letter fixes first, then one look-alike digit swap."""
+    raw = re.sub(r"\s", "", str(token).upper())
+    if len(raw) != 12:
+        return
+    if any(not (ch.isdigit() or ch in LETTER_TO_DIGIT) for ch in raw):
+        return
+    base = "".join(LETTER_TO_DIGIT.get(ch, ch) for ch in raw)
+    edits = sum(a != b for a, b in zip(raw, base))
+    yield base, edits
+    for i, ch in enumerate(base):
+        for alt in DIGIT_CONFUSIONS.get(ch, ""):
+            yield base[:i] + alt + base[i + 1:], edits + 1
+
+
+def _aadhaar_tokens(words):
+    """(index, text) of single tokens and of three consecutive 4-character tokens."""
+    for i, word in enumerate(words):
+        yield i, word
+        group = words[i:i + 3]
+        if len(group) == 3 and all(len(w) == 4 for w in group):
+            yield i, "".join(group)
+
+
+# ---------------------------------------
+# Re-ranking
+# ---------------------------------------
+def best_pan(words, picked="", anchor=None, name=None):
+    """
+    The picked token if it is a valid PAN, else the best valid candidate from
+    all OCR words (fewest edits, then matching a `name` initial, then closest
+    to `anchor`); "" if none.
+    """
+    if is_valid_pan(picked):
+        return picked
+    ranked = []
+    for i, word in enumerate(words):
+        candidate = pan_candidate(word)
+        if candidate and is_valid_pan(candidate[0]):
+            ranked.append((candidate[1], _initial_mismatch(candidate[0], name),
+                           abs(i - anchor) if anchor is not None else 0, candidate[0]))
+    if not ranked:
+        logging.warning("No valid PAN among the OCR candidates.")
+        return ""
+    ranked.sort()
+    logging.info("PAN recovered from OCR candidates with %s edit(s).", ranked[0][0])
+    return ranked[0][3]
+
+
+def best_aadhaar(words, picked="", anchor=None):
+    """
+    The picked number (formatted "XXXX XXXX XXXX") if it passes Verhoeff,
+    else the best valid candidate; "" if none or if the best edit count is
+    shared by different numbers.
+    """
+    digits = re.sub(r"\s", "", str(picked or ""))
+    if is_valid_aadhaar(digits):
+        return format_aadhaar(digits)
+    ranked = {}
+    for i, text in _aadhaar_tokens(words):
+        for candidate, edits in aadhaar_candidates(text):
+            if is_valid_aadhaar(candidate):
+                score = (edits, abs(i - anchor) if anchor is not None else 0)
+                ranked[candidate] = min(score, ranked.get(candidate, score))
+    if not ranked:
+        logging.warning("No Aadhaar number with a valid checksum among the OCR candidates.")
+        return ""
+    ordered = sorted(ranked.items(), key=lambda item: item[1])
+    if len(ordered) > 1 and ordered[0][1][0] == ordered[1][1][0] and ordered[0][1][0] > 0:
+        logging.warning("Ambiguous Aadhaar correction: %s candidates with %s edit(s).",
+                        sum(score[0] == ordered[0][1][0] for _, score in ordered), ordered[0][1][0])
+        return ""
+    logging.info("Aadhaar number recovered from OCR candidates with %s edit(s).", ordered[0][1][0])
+    return format_aadhaar(ordered[0][0])
@@ -0,0 +1,289 @@
+"""
+In-memory blocking index for linking a person's PAN (`users`) and Aadhaar
+(`aadhar`) records.
+
+Each record is filed under blocking keys made of its DOB and the Soundex
+code of each normalised name token, so a lookup only touches the handful of
+records sharing a birth date and a similar-sounding name part instead of
+scanning the tables. Candidates are ranked by character-trigram similarity
+of the whole name and then confirmed by comparing face embeddings.
+
+    start_identity_index()                # at startup: built in the background
+    links = link_record("users", text_info)
+
+The index is per process: every server process (or Streamlit instance)
+builds its own copy from the storage backend and adds only the records it
+enrolls itself, so records enrolled by another process after startup are not
+linked until this one restarts. Until the initial build finishes, lookups
+see only the records loaded so far.
+
+Benchmark the lookup on synthetic records:
+    python identity_index.py bench --records 1000000
+"""
+
+import re
+import time
+import random
+import logging
+import argparse
+import threading
+from datetime import date, datetime, timedelta
+from storage import EXTRA_COLUMNS, get_backend, embedding_version_of
+
+NAME_TITLES = {"MR", "MRS", "MS", "MISS", "DR", "SHRI", "SMT", "KUM", "KUMARI", "SRI"}
+MIN_NAME_SIMILARITY = 0.5
+SOUNDEX_CODES = {c: str(d) for d, letters in enumerate(
+    ["AEIOUYHW", "BFPV", "CGJKQSXZ", "DT", "L", "MN", "R"]) for c in letters}
+
+
+# ---------------------------------------
+# Keys
+# ---------------------------------------
+def normalize_name(name):
+    """Upper-case letters only, titles dropped, tokens sorted (order differs between PAN and Aadhaar)."""
+    tokens = re.sub(r"[^A-Z ]", " ", str(name or "").upper()).split()
+    return " ".join(sorted(t for t in tokens if t not in NAME_TITLES))
+
+
+def soundex(token):
+    """Classic 4-character Soundex code."""
+    if not token:
+        return ""
+    code, last = token[0], SOUNDEX_CODES.get(token[0], "")
+    for c in token[1:]:
+        digit = SOUNDEX_CODES.get(c, "")
+        if digit and digit != "0" and digit != last:
+            code += digit
+        if c not in "HW":
+            last = digit
+    return (code + "000")[:4]
+
+
+def trigrams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def name_similarity(a, b):
+    """Dice coefficient of the two names' trigram sets (0..1)."""
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def dob_keys(dob):
+    """
+    Bucket keys for a DOB: the ISO date, plus the day/month-swapped date
+    when both are <= 12, since OCR and manual entry mix up the two.
+    """
+    if dob is None or dob == "":
+        return ["*"]
+    if isinstance(dob, datetime):
+        d = dob.date()
+    elif isinstance(dob, date):
+        d = dob
+    else:
+        try:
+            d = datetime.strptime(str(dob)[:10], "%Y-%m-%d").date()
+        except ValueError:
+            return ["*"]
+    keys = [d.isoformat()]
+    if d.day <= 12 and d.day != d.month:
+        keys.append(date(d.year, d.day, d.month).isoformat())
+    return keys
+
+
+# ---------------------------------------
+# Index
+# ---------------------------------------
+class IdentityIndex:
+    """(DOB, Soundex) -> record keys, plus each record's name trigrams for ranking."""
+
+    def __init__(self):
+        self._blocks = {}
+        self._entries = {}  # (table, id) -> (normalized name, trigram set, dob keys)
+        self._lock = threading.Lock()
+        self.ready = threading.Event()  # set once build() has loaded every stored record
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _block_keys(normalized, dobs):
+        codes = {soundex(token) for token in normalized.split()}
+        return [(d, code) for d in dobs for code in codes]
+
+    def add(self, table, record_id, name, dob):
+        normalized = normalize_name(name)
+        if not normalized:
+            return
+        dobs = dob_keys(dob)
+        key = (table, record_id)
+        with self._lock:
+            self._entries[key] = (normalized, trigrams(normalized), dobs)
+            for block in self._block_keys(normalized, dobs[:1]):
+                self._blocks.setdefault(block, set()).add(key)
+
+    def remove(self, table, record_id):
+        key = (table, record_id)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            for block in self._block_keys(entry[0], entry[2][:1]):
+                self._blocks.get(block, set()).discard(key)
+
+    def candidates(self, name, dob, tables=None, min_similarity=MIN_NAME_SIMILARITY, limit=10):
+        """Return [(table, id, name similarity)] best first, from records sharing a block key."""
+        normalized = normalize_name(name)
+        if not normalized:
+            return []
+        query = trigrams(normalized)
+        with self._lock:
+            keys = set()
+            # Records are filed under their own DOB only; the query side tries the swapped date too
+            for block in self._block_keys(normalized, dob_keys(dob)):
+                keys |= self._blocks.get(block, set())
+            scored = []
+            for key in keys:
+                if tables is not None and key[0] not in tables:
+                    continue
+                score = name_similarity(query, self._entries[key][1])
+                if score >= min_similarity:
+                    scored.append((key[0], key[1], score))
+        scored.sort(key=lambda c: c[2], reverse=True)
+        return scored[:limit]
+
+    def build(self, backend=None, tables=tuple(EXTRA_COLUMNS)):
+        """Load every record's name and DOB from the storage backend."""
+        backend = backend or get_backend()
+        start = time.perf_counter()
+        try:
+            for table in tables:
+                for record_id, name, dob in backend.iter_records(table):
+                    self.add(table, record_id, name, dob)
+            logging.info("Identity index built: %s records in %.2fs", len(self), time.perf_counter() - start)
+        except Exception as e:
+            logging.error("Identity index build failed after %s records: %s", len(self), e)
+        finally:
+            self.ready.set()
+        return self
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def start_identity_index():
+    """Create the process-wide index and build it on a daemon thread; returns it at once."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = IdentityIndex()
+            threading.Thread(target=_index.build, name="identity-index", daemon=True).start()
+        return _index
+
+
+def get_identity_index(wait=False):
+    """The process-wide index (started if needed); with `wait`, once the initial build is done."""
+    index = start_identity_index()
+    if wait:
+        index.ready.wait()
+    return index
+
+
+# ---------------------------------------
+# Linking
+# ---------------------------------------
+def link_record(table, text_info, threshold=None):
+    """
+    Add a newly enrolled record to the index and return its confirmed links in
+    the other table(s): [{"table", "id", "name_similarity", "distance"}].
+    Name/DOB candidates are confirmed by face-embedding cosine distance.
+    """
+    import numpy as np
+    from face_verification import cosine_distances, get_thresholds
+    from sql_connection import fetch_embedding
+
+    index = get_identity_index()
+    if not index.ready.is_set():
+        logging.warning("Identity index still building (%s records loaded); links may be incomplete.", len(index))
+    other_tables = [t for t in EXTRA_COLUMNS if t != table]
+    candidates = index.candidates(text_info.get("Name"), text_info.get("DOB"), tables=other_tables)
+    index.add(table, text_info.get("ID"), text_info.get("Name"), text_info.get("DOB"))
+
+    links = []
+    embedding = text_info.get("Embedding")
+    if embedding is None:
+        return links
+    version = embedding_version_of(text_info)
+    threshold = get_thresholds(version)["threshold"] if threshold is None else threshold
+    for other_table, other_id, score in candidates:
+        other_embedding, other_version = fetch_embedding(other_table, other_id)
+        if other_embedding is None or other_version != version:
+            # Embeddings of different versions are not comparable; the link waits for re-embedding
+            continue
+        distance = float(cosine_distances(np.asarray(embedding, dtype=np.float32),
+                                          np.asarray(other_embedding, dtype=np.float32))[0])
+        if distance <= threshold:
+            links.append({"table": other_table, "id": other_id, "name_similarity": round(score, 3),
+                          "distance": round(distance, 4)})
+    logging.info("Identity linking: %s candidates, %s confirmed links", len(candidates), len(links))
+    return links
+
+
+# ---------------------------------------
+# Benchmark
+# ---------------------------------------
+FIRST_NAMES = ["AARAV", "VIVAAN", "ADITYA", "DIYA", "ANANYA", "ISHAAN", "KAVYA", "ROHAN", "SAANVI", "ARJUN",
+               "PRIYA", "RAHUL", "SNEHA", "VIKRAM", "NEHA", "AMIT", "POOJA", "SURESH", "DEEPA", "MANOJ"]
+LAST_NAMES = ["SHAH", "PATEL", "SHARMA", "IYER", "REDDY", "GUPTA", "KHAN", "DAS", "NAIR", "MEHTA",
+              "SINGH", "KUMAR", "JOSHI", "RAO", "VERMA", "MISHRA", "PANDEY", "CHOPRA", "BOSE", "PILLAI"]
+
+
+def benchmark(records=1_000_000, queries=10_000, seed=0):
+    rng = random.Random(seed)
+    index = IdentityIndex()
+    people = []
+    start = time.perf_counter()
+    for i in range(records):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        dob = date(1950, 1, 1) + timedelta(days=rng.randrange(25000))
+        index.add("users", f"{i:064x}", name, dob)
+        people.append((name, dob))
+    build_s = time.perf_counter() - start
+
+    timings, found = [], 0
+    for _ in range(queries):
+        name, dob = rng.choice(people)
+        # Aadhaar-style variant: surname first, one typo
+        parts = name.split()
+        variant = f"{parts[-1]} {' '.join(parts[:-1])}"
+        pos = rng.randrange(len(variant))
+        variant = variant[:pos] + variant[pos + 1:]
+        t0 = time.perf_counter()
+        hits = index.candidates(variant, dob, tables=["users"])
+        timings.append(time.perf_counter() - t0)
+        found += any(index._entries[(t, i)][0] == normalize_name(name) for t, i, _ in hits)
+
+    timings.sort()
+    print(f"{records} records indexed in {build_s:.1f}s")
+    print(f"lookup p50={1000 * timings[len(timings) // 2]:.3f} ms "
+          f"p99={1000 * timings[int(len(timings) * 0.99)]:.3f} ms, "
+          f"recall of the true record: {found / queries:.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Name/DOB identity index tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_bench = sub.add_parser("bench", help="Index synthetic records and time lookups")
+    p_bench.add_argument("--records", type=int, default=1_000_000)
+    p_bench.add_argument("--queries", type=int, default=10_000)
+    sub.add_parser("stats", help="Build the index from the storage backend and report its size")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        benchmark(args.records, args.queries)
+    else:
+        index = get_identity_index(wait=True)
+        print(f"{len(index)} records, {len(index._blocks)} blocks")
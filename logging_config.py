@@ -0,0 +1,148 @@
+"""
+Single logging setup for every module.
+
+Records are handed to a QueueHandler on the calling thread and written by a
+QueueListener thread, so file I/O never blocks a request. The listener side
+formats each record as one JSON line (with the current request ID), redacts
+ID numbers / dates / parsed identity fields, and writes to a size- or
+time-rotated file. INFO/DEBUG records can be sampled per request; warnings
+and errors are always kept.
+"""
+
+import os
+import re
+import json
+import queue
+import atexit
+import uuid
+import zlib
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_FILE = os.getenv("LOG_FILE", "ekyc_logs.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")  # e.g. "midnight" or "H"; empty = rotate by size
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))  # fraction of requests whose INFO logs are kept
+
+_request_id = contextvars.ContextVar("request_id", default="-")
+_listener = None
+_queue_handler = None
+
+
+# ---------------------------------------
+# Request ID
+# ---------------------------------------
+def new_request_id():
+    """Start a new request: generate an ID and bind it to the current thread/task."""
+    request_id = uuid.uuid4().hex[:12]
+    _request_id.set(request_id)
+    return request_id
+
+
+def set_request_id(request_id):
+    _request_id.set(request_id)
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+# ---------------------------------------
+# Filters / formatter
+# ---------------------------------------
+class RequestContextFilter(logging.Filter):
+    """Attach the request ID and drop sampled-out INFO/DEBUG records (runs on the caller thread)."""
+
+    def __init__(self, sample_rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        if self.sample_rate >= 1.0 or record.levelno >= logging.WARNING:
+            return True
+        # Sample whole requests, so a kept request keeps all of its lines
+        bucket = zlib.crc32(record.request_id.encode()) % 10000
+        return bucket < self.sample_rate * 10000
+
+
+PII_PATTERNS = [
+    (re.compile(r"\b[A-Z]{5}\d{4}[A-Z]\b"), "<PAN>"),
+    (re.compile(r"\b\d{4}\s?\d{4}\s?\d{4}\b"), "<AADHAAR>"),
+    (re.compile(r"\b\d{1,2}[/\-.]\d{1,2}[/\-.]\d{2,4}\b"), "<DATE>"),
+    (re.compile(r"\b\d{4}-\d{2}-\d{2}(?![\d:])"), "<DATE>"),
+    (re.compile(r"""(['"](?:Name|Father's Name|DOB|Gender)['"]\s*:\s*)(['"]).*?\2"""), r"\1\2<REDACTED>\2"),
+]
+
+
+def redact(text):
+    for pattern, replacement in PII_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; runs on the listener thread."""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "module": record.module,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": redact(record.getMessage()),
+        }
+        if record.exc_info:
+            entry["exc"] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# ---------------------------------------
+# Setup
+# ---------------------------------------
+def setup_logging(log_file=LOG_FILE, level=LOG_LEVEL):
+    """Install the queue-based JSON logging once per process; later calls are no-ops."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    path = os.path.join(LOG_DIR, log_file)
+    if LOG_ROTATE_WHEN:
+        file_handler = TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT,
+                                                encoding="utf-8")
+    else:
+        file_handler = RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                           encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = QueueHandler(log_queue)
+    _queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    # A module logging at import time (before this ran) left an implicit
+    # basicConfig stderr handler that would write every record unredacted
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(_queue_handler)
+
+    _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        _listener = None
+        _queue_handler = None
@@ -0,0 +1,246 @@
+"""
+Migrate `users` / `aadhar` from the original schema (VARCHAR hex id, inline
+TEXT embedding, no secondary indexes) to the current one created by
+setup_database.py (BINARY(32) id, indexes, `<table>_embeddings` side table).
+
+Rows are copied into `<table>_new` in keyset-paginated batches (INSERT
+IGNORE, resuming after the highest copied id, so an interrupted run can be
+rerun). Then writes are blocked, rows inserted behind the cursor meanwhile
+are copied, and the tables are swapped with one RENAME TABLE. The old table
+is kept as `<table>_old` unless --drop-old is given. Partitioned tables get
+the `<table>_ids` registry that keeps their ids unique. Tables already
+swapped (no inline `embedding` column, or a `<table>_old` left) are skipped,
+so the default all-tables run can follow a `--table` run.
+
+--embedding-versions upgrades a current-schema database to versioned
+embeddings instead: `<table>_embeddings` gains `model_version` (existing rows
+are labelled as the legacy version) in its primary key, online, and the
+`<table>_faces` side table is created. See embedding_versions.py.
+
+--id-registry creates and backfills `<table>_ids` for tables partitioned
+before the registry existed, and lists any ids already duplicated.
+
+Usage:
+    python migrate_database.py                      # both tables
+    python migrate_database.py --table users --partition --batch-size 5000
+    python migrate_database.py --embedding-versions
+    python migrate_database.py --id-registry
+    python migrate_database.py --dry-run            # print the DDL only
+"""
+
+import os
+import logging
+import argparse
+import mysql.connector
+import toml
+from logging_config import setup_logging
+from setup_database import table_ddl, embedding_table_ddl, face_table_ddl, id_table_ddl, TABLE_COLUMNS
+from embedding_versions import LEGACY_EMBEDDING_VERSION
+from sql_connection import embedding_to_bytes, parse_embedding
+
+setup_logging(log_file="database_setup.log")
+
+
+def load_db_config(path="config.toml"):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; see config.toml.example")
+    return toml.load(path).get("database", {})
+
+
+def _copy_rows(cursor, table, extra, rows, partitioned):
+    """Insert old-schema rows into `<table>_new` (and its side tables); rows already there are skipped."""
+    main_rows, embedding_rows = [], []
+    for record_id, name, extra_value, dob, id_type, created_at, embedding in rows:
+        id_bytes = bytes.fromhex(record_id)
+        main_rows.append((id_bytes, name, extra_value, dob, id_type, created_at))
+        try:
+            vector = parse_embedding(embedding)
+        except ValueError:
+            logging.warning("Unreadable embedding in '%s'; migrated without it", table)
+            vector = None
+        if vector is not None:
+            embedding_rows.append((id_bytes, embedding_to_bytes(vector)))
+    cursor.executemany(
+        f"INSERT IGNORE INTO {table}_new (id, name, {extra}, dob, id_type, created_at) "
+        "VALUES (%s, %s, %s, %s, %s, %s)",
+        main_rows,
+    )
+    if partitioned:
+        cursor.executemany(f"INSERT IGNORE INTO {table}_ids (id) VALUES (%s)", [(row[0],) for row in main_rows])
+    if embedding_rows:
+        cursor.executemany(
+            f"INSERT IGNORE INTO {table}_embeddings (id, embedding) VALUES (%s, %s)",
+            embedding_rows,
+        )
+
+
+def already_migrated(cursor, table):
+    """True once `table` has been swapped for the new layout (by this script or setup_database.py)."""
+    cursor.execute(f"SHOW COLUMNS FROM {table} LIKE 'embedding'")
+    if cursor.fetchone() is None:
+        return True
+    cursor.execute("SHOW TABLES LIKE %s", (f"{table}_old",))
+    return cursor.fetchone() is not None
+
+
+def migrate_table(conn, table, partitioned=False, batch_size=2000, drop_old=False):
+    """
+    Copy `table` into the new layout and swap it in. Returns the number of rows
+    copied, or None if the table is already migrated (nothing is changed then).
+
+    The bulk copy runs online and is idempotent: a rerun resumes after the
+    highest id already in `<table>_new`. Rows the app inserted behind the
+    keyset cursor meanwhile are copied with writes blocked (LOCK TABLES),
+    immediately before the RENAME.
+    """
+    extra = TABLE_COLUMNS[table].split()[0]  # father_name / gender
+    columns = f"id, name, {extra}, dob, id_type, created_at, embedding"
+    cursor = conn.cursor()
+    if already_migrated(cursor, table):
+        cursor.close()
+        logging.info("Table '%s' already migrated; skipped", table)
+        return None
+    cursor.execute(table_ddl(table, name=f"{table}_new", partitioned=partitioned))
+    if partitioned:
+        cursor.execute(id_table_ddl(table))
+    cursor.execute(embedding_table_ddl(table))
+    cursor.execute(face_table_ddl(table))
+
+    cursor.execute(f"SELECT MAX(id) FROM {table}_new")
+    resume = cursor.fetchone()[0]
+    last_id = bytes(resume).hex() if resume is not None else ""
+    if last_id:
+        print(f"  {table}: resuming after a previous run")
+    copied = 0
+    while True:
+        cursor.execute(f"SELECT {columns} FROM {table} WHERE id > %s ORDER BY id LIMIT %s", (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        _copy_rows(cursor, table, extra, rows, partitioned)
+        conn.commit()
+        copied += len(rows)
+        last_id = rows[-1][0]
+        logging.info("Migrated %s rows of '%s'", copied, table)
+        print(f"  {table}: {copied} rows copied")
+
+    # Block writes, copy what arrived during the bulk copy, and swap
+    locked = [table, f"{table}_new", f"{table}_embeddings"] + ([f"{table}_ids"] if partitioned else [])
+    cursor.execute("LOCK TABLES " + ", ".join(f"{name} WRITE" for name in locked))
+    try:
+        cursor.execute(f"SELECT {columns} FROM {table} WHERE NOT EXISTS "
+                       f"(SELECT 1 FROM {table}_new WHERE {table}_new.id = UNHEX({table}.id))")
+        delta = cursor.fetchall()
+        if delta:
+            _copy_rows(cursor, table, extra, delta, partitioned)
+            copied += len(delta)
+            logging.info("Copied %s rows of '%s' inserted during the migration", len(delta), table)
+        conn.commit()
+        cursor.execute(f"RENAME TABLE {table} TO {table}_old, {table}_new TO {table}")
+    finally:
+        cursor.execute("UNLOCK TABLES")
+    if drop_old:
+        cursor.execute(f"DROP TABLE {table}_old")
+    conn.commit()
+    cursor.close()
+    logging.info("Table '%s' migrated (%s rows, partitioned=%s)", table, copied, partitioned)
+    return copied
+
+
+def add_id_registry(conn, table):
+    """
+    Create and backfill `<table>_ids` for a table partitioned before the
+    registry existed. Returns the ids found more than once (kept as they are;
+    resolve them by hand). Restart the app afterwards so it starts using it.
+    """
+    cursor = conn.cursor()
+    cursor.execute(id_table_ddl(table))
+    cursor.execute(f"INSERT IGNORE INTO {table}_ids (id) SELECT id FROM {table}")
+    cursor.execute(f"SELECT id FROM {table} GROUP BY id HAVING COUNT(*) > 1")
+    duplicates = [bytes(row[0]).hex() for row in cursor.fetchall()]
+    conn.commit()
+    cursor.close()
+    logging.info("ID registry for '%s' backfilled (%s duplicate ids)", table, len(duplicates))
+    return duplicates
+
+
+def versioning_ddl(table):
+    """In-place (no table copy visible to readers) change of `<table>_embeddings` to the (id, model_version) key."""
+    return (f"ALTER TABLE {table}_embeddings "
+            f"ADD COLUMN model_version VARCHAR(64) NOT NULL DEFAULT '{LEGACY_EMBEDDING_VERSION}' AFTER id, "
+            "DROP PRIMARY KEY, ADD PRIMARY KEY (id, model_version), ALGORITHM=INPLACE, LOCK=NONE")
+
+
+def add_embedding_versions(conn, table):
+    """Version the embeddings of `table`; a no-op if it already is. Returns True if altered."""
+    cursor = conn.cursor()
+    cursor.execute(f"SHOW COLUMNS FROM {table}_embeddings LIKE 'model_version'")
+    altered = cursor.fetchone() is None
+    if altered:
+        cursor.execute(versioning_ddl(table))
+    cursor.execute(face_table_ddl(table))
+    conn.commit()
+    cursor.close()
+    logging.info("Embeddings of '%s' versioned (%s)", table, "altered" if altered else "already versioned")
+    return altered
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate users/aadhar to the BINARY(32)-id schema.")
+    parser.add_argument("--table", choices=list(TABLE_COLUMNS), action="append",
+                        help="Table to migrate (repeatable; default: all)")
+    parser.add_argument("--partition", action="store_true", help="Range-partition the new tables by created_at")
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--drop-old", action="store_true", help="Drop <table>_old after the swap")
+    parser.add_argument("--embedding-versions", action="store_true",
+                        help="Add model_version to <table>_embeddings and create <table>_faces")
+    parser.add_argument("--id-registry", action="store_true",
+                        help="Create and backfill <table>_ids for already partitioned tables")
+    parser.add_argument("--dry-run", action="store_true", help="Print the DDL and exit")
+    args = parser.parse_args()
+
+    tables = args.table or list(TABLE_COLUMNS)
+    db_config = load_db_config()
+    partitioned = args.partition or bool(db_config.get("partition_by_created_at", False))
+
+    if args.dry_run:
+        for table in tables:
+            if args.id_registry:
+                print(id_table_ddl(table))
+                continue
+            if args.embedding_versions:
+                print(versioning_ddl(table))
+            else:
+                print(table_ddl(table, name=f"{table}_new", partitioned=partitioned))
+                if partitioned:
+                    print(id_table_ddl(table))
+                print(embedding_table_ddl(table))
+            print(face_table_ddl(table))
+        raise SystemExit(0)
+
+    conn = mysql.connector.connect(
+        host=db_config.get("host", "localhost"),
+        user=db_config.get("user"),
+        password=db_config.get("password"),
+        database=db_config.get("database"),
+        port=3306,
+    )
+    try:
+        for table in tables:
+            if args.id_registry:
+                print(f"Backfilling '{table}_ids'...")
+                duplicates = add_id_registry(conn, table)
+                if duplicates:
+                    print(f"  {table}: {len(duplicates)} ids already duplicated: {', '.join(duplicates)}")
+                continue
+            if args.embedding_versions:
+                print(f"Versioning '{table}_embeddings'...")
+                add_embedding_versions(conn, table)
+                continue
+            print(f"Migrating '{table}'...")
+            if migrate_table(conn, table, partitioned=partitioned, batch_size=args.batch_size,
+                             drop_old=args.drop_old) is None:
+                print(f"  {table}: already migrated, skipped")
+    finally:
+        conn.close()
+    print("Migration completed.")
@@ -1,32 +1,159 @@
-import os
 import easyocr
 import logging
+import threading
+from collections import OrderedDict
+from logging_config import setup_logging
+from single_flight import SingleFlight
+from utils import read_yaml
 
-logging_str = "[%(asctime)s: %(levelname)s: %(module)s]: %(message)s"
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-logging.basicConfig(filename=os.path.join(log_dir,"ekyc_logs.log"), level=logging.INFO, format=logging_str, filemode="a")
+setup_logging()
 
+config_path = "config.yaml"
+runtime = read_yaml(config_path).get('runtime', {})
+REGIONAL_LANGUAGES = list(runtime.get('OCR_REGIONAL_LANGUAGES') or [])
+OCR_MODEL_BUDGET_MB = float(runtime.get('OCR_MODEL_BUDGET_MB', 600))
+DEFAULT_MODEL_MB = 100.0  # used when a reader's parameter size cannot be read
 
-def extract_text(image_path, confidence_threshold=0.3, languages=['en']):
+# Unicode block of each EasyOCR regional language, to check a reading is really in that script
+SCRIPT_RANGES = {
+    "hi": (0x0900, 0x097F), "mr": (0x0900, 0x097F), "ne": (0x0900, 0x097F),
+    "bn": (0x0980, 0x09FF), "as": (0x0980, 0x09FF),
+    "ta": (0x0B80, 0x0BFF), "te": (0x0C00, 0x0C7F), "kn": (0x0C80, 0x0CFF),
+    "ur": (0x0600, 0x06FF),
+}
+MIN_SCRIPT_SHARE = 0.6
+
+_readers = OrderedDict()  # (languages, detector) -> (reader, MB), least recently used first
+_readers_lock = threading.Lock()
+_reader_loads = SingleFlight()  # one load per key; other keys' lookups don't wait for it
+_script_hits = {}  # language -> cards it was detected on, to try the common scripts first (under _readers_lock)
+
+
+def _model_mb(reader):
+    try:
+        modules = [m for m in (getattr(reader, "detector", None), getattr(reader, "recognizer", None)) if m is not None]
+        return sum(p.numel() * p.element_size() for m in modules for p in m.parameters()) / 2 ** 20
+    except Exception:
+        return DEFAULT_MODEL_MB
+
+
+def get_reader(languages=('en',), detector=True):
+    """
+    One EasyOCR reader per language set per process (loading one takes
+    seconds). Regional recognisers are loaded with detector=False. Once the
+    loaded models exceed OCR_MODEL_BUDGET_MB, least recently used readers
+    are dropped; the English reader is never evicted. A reader is loaded
+    outside the lock, so OCR with the readers already loaded goes on
+    meanwhile; concurrent requests for the same reader share one load.
+    """
+    key = (tuple(languages), detector)
+    with _readers_lock:
+        if key in _readers:
+            _readers.move_to_end(key)
+            return _readers[key][0]
+    return _reader_loads.do(("ocr_reader",) + key, _load_reader, key)
+
+
+def _load_reader(key):
+    with _readers_lock:
+        if key in _readers:  # loaded by a call that finished just before this one started
+            return _readers[key][0]
+    logging.info("Loading EasyOCR reader for %s (detector=%s)", key[0], key[1])
+    reader = easyocr.Reader(list(key[0]), detector=key[1])
+    size_mb = _model_mb(reader)
+    with _readers_lock:
+        _readers[key] = (reader, size_mb)
+        while sum(mb for _, mb in _readers.values()) > OCR_MODEL_BUDGET_MB:
+            victim = next((k for k in _readers if k != key and k[0] != ('en',)), None)
+            if victim is None:
+                break
+            logging.info("Evicting EasyOCR reader %s (%.0f MB) to stay within %s MB",
+                         victim[0], _readers.pop(victim)[1], OCR_MODEL_BUDGET_MB)
+        return reader
+
+
+def loaded_readers():
+    """[(languages, detector, MB)] in least-recently-used order."""
+    with _readers_lock:
+        return [(k[0], k[1], round(mb, 1)) for k, (_, mb) in _readers.items()]
+
+
+# ---------------------------------------
+# Regional scripts
+# ---------------------------------------
+def script_share(text, language):
+    """Fraction of the letters in `text` that belong to `language`'s script."""
+    low, high = SCRIPT_RANGES[language]
+    letters = [c for c in text if not c.isspace() and not c.isdigit() and c not in "/:-.,"]
+    return sum(low <= ord(c) <= high for c in letters) / len(letters) if letters else 0.0
+
+
+def _box(bbox):
+    xs, ys = [int(p[0]) for p in bbox], [int(p[1]) for p in bbox]
+    return [min(xs), max(xs), min(ys), max(ys)]
+
+
+def read_regional(image, bboxes, languages=None, confidence_threshold=0.3):
+    """
+    Recognise the regions the English pass could not read. Languages are
+    tried on the first region (most frequently detected script first) and
+    only until one reads it in its own script; that recogniser then reads
+    all regions in one batched call. Returns [(bbox, language, text, confidence)].
+    """
+    languages = [l for l in (REGIONAL_LANGUAGES if languages is None else languages) if l in SCRIPT_RANGES]
+    if not bboxes or not languages:
+        return []
+    boxes = [_box(b) for b in bboxes]
+    with _readers_lock:
+        order = sorted(languages, key=lambda l: -_script_hits.get(l, 0))
+    for language in order:
+        reader = get_reader((language, 'en'), detector=False)
+        probe = reader.recognize(image, horizontal_list=boxes[:1], free_list=[])
+        if not probe or script_share(probe[0][1], language) < MIN_SCRIPT_SHARE:
+            continue
+        with _readers_lock:
+            _script_hits[language] = _script_hits.get(language, 0) + 1
+        results = probe + (reader.recognize(image, horizontal_list=boxes[1:], free_list=[]) if boxes[1:] else [])
+        logging.info("Regional script detected: %s (%s regions)", language, len(boxes))
+        return [(bbox, language, text, conf) for bbox, (_, text, conf) in zip(bboxes, results)
+                if conf > confidence_threshold and script_share(text, language) >= MIN_SCRIPT_SHARE]
+    logging.info("No configured regional script matched the unread regions.")
+    return []
+
+
+def extract_text(image_path, confidence_threshold=0.3, languages=['en'], regional=None):
+    """
+    OCR the image into "|word|word|..." with the English reader. If a list
+    is passed as `regional`, the regions English could not read are run
+    through the matching regional-script recogniser (see read_regional) and
+    their readings are appended to it; the returned text stays English-only,
+    which is what the parsers expect.
+    """
     logging.info("Text Extraction Started...")
-    # Initialize EasyOCR reader
-    reader = easyocr.Reader(languages)
+    reader = get_reader(languages)
     
     try:
         logging.info("Inside Try-Catch...")
         # Read the image and extract text
         result = reader.readtext(image_path)
         filtered_text = "|"  # Initialize an empty string to store filtered text
+        unread = []
         for text in result:
             bounding_box, recognized_text, confidence = text
             if confidence > confidence_threshold:
                 filtered_text += recognized_text + "|"  # Append filtered text with newline
-        logging.info(f"Extracted Text: {filtered_text}")
+            elif bounding_box is not None:
+                unread.append(bounding_box)
+        logging.debug("Extracted %s characters of text", len(filtered_text))
+        if regional is not None and unread:
+            try:
+                regional.extend(read_regional(image_path, unread, confidence_threshold=confidence_threshold))
+            except Exception as e:
+                logging.error("Regional-script OCR failed: %s", e)
         return filtered_text 
     except Exception as e:
         print("An error occurred during text extraction:", e)
-        logging.info(f"An error occurred during text extraction: {e}")
+        logging.info("An error occurred during text extraction: %s", e)
         return ""
     
 
@@ -0,0 +1,248 @@
+"""
+ONNX Runtime inference backend for the Facenet512 embedding model.
+
+The TensorFlow model DeepFace builds is exported once to ONNX (optionally
+int8 dynamically quantised) and served with ONNX Runtime, which is lighter in
+memory and latency on CPU-only nodes. The TensorFlow path stays the
+reference: `parity` compares both backends' embeddings and `compare` reports
+speed and peak RSS for each in its own process.
+
+Usage:
+    python onnx_backend.py export [--quantize]
+    python onnx_backend.py parity [--quantized]
+    python onnx_backend.py bench --backend onnx
+    python onnx_backend.py compare
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import subprocess
+import numpy as np
+from utils import read_yaml
+
+config_path = "config.yaml"
+config = read_yaml(config_path)
+artifacts = config['artifacts']
+ONNX_MODEL_PATH = artifacts.get('ONNX_MODEL_PATH', os.path.join("data", "models", "facenet512.onnx"))
+ONNX_QUANTIZED_MODEL_PATH = artifacts.get('ONNX_QUANTIZED_MODEL_PATH', os.path.join("data", "models", "facenet512_int8.onnx"))
+
+runtime = config.get('runtime', {})
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", runtime.get('EMBEDDING_BACKEND', "tensorflow"))
+ONNX_QUANTIZED = bool(runtime.get('ONNX_QUANTIZED', False))
+# Falls back to the per-worker thread budget from runtime_config
+ONNX_INTRA_OP_THREADS = int(runtime.get('ONNX_INTRA_OP_THREADS', 0)) or int(runtime.get('THREADS_PER_WORKER', 0))
+ONNX_INTER_OP_THREADS = int(runtime.get('ONNX_INTER_OP_THREADS', 0))
+
+SAMPLE_IMAGES = [
+    os.path.join("data", "01_raw_data", "srk1.jpeg"),
+    os.path.join("data", "01_raw_data", "srk2.webp"),
+    os.path.join("data", "01_raw_data", "extracted_face.jpg"),
+    os.path.join("data", "01_raw_data", "extracted_face_0.jpg"),
+    os.path.join("data", "01_raw_data", "sample_image1.jpg"),
+    os.path.join("data", "01_raw_data", "pan.jpeg"),
+    os.path.join("data", "01_raw_data", "aadhar.png"),
+]
+
+
+# ---------------------------------------
+# Export / quantisation
+# ---------------------------------------
+def export_facenet512_onnx(output_path=ONNX_MODEL_PATH, opset=13):
+    """Export DeepFace's Keras Facenet512 model to ONNX."""
+    import tensorflow as tf
+    import tf2onnx
+    from face_verification import get_embedding_model, MODEL_INPUT_SIZE
+
+    model = get_embedding_model()
+    spec = (tf.TensorSpec((None, MODEL_INPUT_SIZE[0], MODEL_INPUT_SIZE[1], 3), tf.float32, name="input"),)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=output_path)
+    logging.info("Facenet512 exported to ONNX: %s", output_path)
+    return output_path
+
+
+def quantize_onnx(model_path=ONNX_MODEL_PATH, quantized_path=ONNX_QUANTIZED_MODEL_PATH):
+    """Apply int8 dynamic quantisation to the weights of an exported model."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+    logging.info("Quantised ONNX model written: %s", quantized_path)
+    return quantized_path
+
+
+# ---------------------------------------
+# Inference
+# ---------------------------------------
+class OnnxEmbedder:
+    """ONNX Runtime session for Facenet512 with configurable thread pools."""
+
+    def __init__(self, model_path=None, intra_op_threads=ONNX_INTRA_OP_THREADS,
+                 inter_op_threads=ONNX_INTER_OP_THREADS):
+        import onnxruntime as ort
+
+        self.model_path = model_path or (ONNX_QUANTIZED_MODEL_PATH if ONNX_QUANTIZED else ONNX_MODEL_PATH)
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(
+                f"ONNX model not found at {self.model_path}. Run: python onnx_backend.py export"
+            )
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads  # 0 lets ONNX Runtime decide
+        options.inter_op_num_threads = inter_op_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        logging.info("ONNX embedder loaded: %s", self.model_path)
+
+    def predict(self, batch, verbose=0):
+        """Same call shape as the Keras model so callers can swap backends."""
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+_onnx_embedder = None
+
+
+def get_onnx_embedder():
+    """Process-wide ONNX session (sessions are thread-safe for run())."""
+    global _onnx_embedder
+    if _onnx_embedder is None:
+        _onnx_embedder = OnnxEmbedder()
+    return _onnx_embedder
+
+
+# ---------------------------------------
+# Parity / benchmark helpers
+# ---------------------------------------
+def _load_sample_faces():
+    import cv2
+    from face_verification import crop_largest_face
+
+    faces = []
+    for path in SAMPLE_IMAGES:
+        img = cv2.imread(path)
+        if img is not None:
+            faces.append(crop_largest_face(img)[0])
+    return faces
+
+
+def _peak_rss_mb():
+    """Peak RSS of this process (each backend is benchmarked in its own process)."""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB elsewhere
+
+
+def check_parity(quantized=False, min_similarity=None):
+    """
+    Compare ONNX embeddings with the TensorFlow reference on the sample faces.
+    Returns the per-image cosine similarities; exits non-zero below the bound.
+    """
+    from face_verification import prepare_face_batch, get_embedding_model, cosine_distances
+
+    if min_similarity is None:
+        min_similarity = 0.98 if quantized else 0.999
+    batch = prepare_face_batch(_load_sample_faces())
+    reference = np.asarray(get_embedding_model().predict(batch, verbose=0), dtype=np.float32)
+    model_path = ONNX_QUANTIZED_MODEL_PATH if quantized else ONNX_MODEL_PATH
+    candidate = OnnxEmbedder(model_path).predict(batch)
+
+    similarities = [1.0 - float(cosine_distances(r, c)[0]) for r, c in zip(reference, candidate)]
+    print(f"Parity ({os.path.basename(model_path)}): min={min(similarities):.5f} "
+          f"mean={np.mean(similarities):.5f} over {len(similarities)} faces (bound {min_similarity})")
+    if min(similarities) < min_similarity:
+        print("❌ Parity check failed")
+        sys.exit(1)
+    print("✅ Parity check passed")
+    return similarities
+
+
+def run_benchmark(backend, quantized=False, batch_size=8, rounds=20):
+    """Time embedding `batch_size` faces `rounds` times on one backend; print a JSON line."""
+    from face_verification import prepare_face_batch, get_embedding_model
+
+    faces = _load_sample_faces()
+    faces = (faces * (batch_size // len(faces) + 1))[:batch_size]
+    batch = prepare_face_batch(faces)
+
+    start = time.perf_counter()
+    if backend == "onnx":
+        model = OnnxEmbedder(ONNX_QUANTIZED_MODEL_PATH if quantized else ONNX_MODEL_PATH)
+    else:
+        model = get_embedding_model()
+    load_s = time.perf_counter() - start
+
+    model.predict(batch, verbose=0)  # warm-up
+    timings = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        model.predict(batch, verbose=0)
+        timings.append(time.perf_counter() - t0)
+
+    result = {
+        "backend": backend + ("-int8" if backend == "onnx" and quantized else ""),
+        "load_s": round(load_s, 3),
+        "batch_ms_p50": round(1000 * float(np.median(timings)), 2),
+        "batch_ms_p95": round(1000 * float(np.percentile(timings, 95)), 2),
+        "faces_per_s": round(batch_size / float(np.median(timings)), 1),
+        "rss_mb": round(_peak_rss_mb(), 1),
+    }
+    print(json.dumps(result))
+    return result
+
+
+def compare_backends(batch_size=8, rounds=20):
+    """Benchmark each backend in a fresh process so RSS is not shared between them."""
+    variants = [["tensorflow"], ["onnx"]]
+    if os.path.exists(ONNX_QUANTIZED_MODEL_PATH):
+        variants.append(["onnx", "--quantized"])
+    print(f"{'backend':<12}{'load s':>8}{'p50 ms':>10}{'p95 ms':>10}{'faces/s':>10}{'peak MB':>10}")
+    for variant in variants:
+        cmd = [sys.executable, __file__, "bench", "--backend", *variant,
+               "--batch-size", str(batch_size), "--rounds", str(rounds)]
+        out = subprocess.run(cmd, capture_output=True, text=True)
+        lines = [l for l in out.stdout.splitlines() if l.startswith("{")]
+        if out.returncode != 0 or not lines:
+            print(f"{' '.join(variant):<12} failed: {out.stderr.strip().splitlines()[-1:]}")
+            continue
+        r = json.loads(lines[-1])
+        print(f"{r['backend']:<12}{r['load_s']:>8}{r['batch_ms_p50']:>10}{r['batch_ms_p95']:>10}"
+              f"{r['faces_per_s']:>10}{r['rss_mb']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Facenet512 ONNX backend tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="Export Facenet512 to ONNX")
+    p_export.add_argument("--quantize", action="store_true", help="Also write an int8 dynamic-quantised model")
+
+    p_parity = sub.add_parser("parity", help="Compare ONNX embeddings with the TensorFlow reference")
+    p_parity.add_argument("--quantized", action="store_true")
+    p_parity.add_argument("--min-similarity", type=float, default=None)
+
+    p_bench = sub.add_parser("bench", help="Benchmark a single backend")
+    p_bench.add_argument("--backend", choices=["tensorflow", "onnx"], default="onnx")
+    p_bench.add_argument("--quantized", action="store_true")
+    p_bench.add_argument("--batch-size", type=int, default=8)
+    p_bench.add_argument("--rounds", type=int, default=20)
+
+    p_compare = sub.add_parser("compare", help="Benchmark all backends, one process each")
+    p_compare.add_argument("--batch-size", type=int, default=8)
+    p_compare.add_argument("--rounds", type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        print(f"Exported: {export_facenet512_onnx()}")
+        if args.quantize:
+            print(f"Quantised: {quantize_onnx()}")
+    elif args.command == "parity":
+        check_parity(quantized=args.quantized, min_similarity=args.min_similarity)
+    elif args.command == "bench":
+        run_benchmark(args.backend, quantized=args.quantized, batch_size=args.batch_size, rounds=args.rounds)
+    else:
+        compare_backends(batch_size=args.batch_size, rounds=args.rounds)
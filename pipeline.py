@@ -0,0 +1,421 @@
+"""
+Request-scoped verification pipeline.
+
+Everything one verification needs (images, ROI, faces, embeddings, OCR
+output, parsed fields, timings) lives on a VerificationContext. Each stage
+takes the context and returns it, and stages work on in-memory arrays rather
+than fixed intermediate files, so many requests can run concurrently in
+threads or asyncio tasks without sharing mutable state.
+
+    ctx = run_pipeline(VerificationContext("PAN", id_image=img, selfie_image=selfie))
+    if ctx.error: ...
+
+A context may carry a deadline (time.monotonic() based, set by admission
+control). Each stage's cost is tracked as a moving average; when the time
+left is less than a stage is expected to take, optional stages
+(OPTIONAL_STAGES) and the borderline escalation are skipped, and any other
+stage fails the request right away with a "busy, try again" message rather
+than overrunning.
+"""
+
+import time
+import logging
+import functools
+import threading
+import numpy as np
+from datetime import datetime
+from preprocess import extract_id_card
+from ocr_engine import extract_text, REGIONAL_LANGUAGES
+from qr_reader import read_aadhaar_qr, is_masked
+from postprocess import extract_information, extract_information1
+from face_verification import (
+    ESCALATION_MODEL,
+    get_thresholds,
+    tiered_decision,
+    model_distance,
+    crop_face_versioned,
+    box_crop,
+    embed_faces_batch,
+    embed_faces_with_model,
+    enrollment_face,
+    cosine_distances,
+    verify_selfie_frames,
+)
+from embedding_versions import CURRENT_EMBEDDING_VERSION, embedding_version, version_settings
+from sql_connection import fetch_embedding, upgrade_embedding
+from admission import deadline_event
+from utils import hash_id
+
+DOB_FORMATS = ["%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d.%m.%Y", "%d %b %Y", "%d %B %Y"]
+STAGE_COST_ALPHA = 0.2  # EWMA weight of the latest stage timing
+BUSY_MESSAGE = "The service is too busy to finish this verification in time. Please try again in a moment."
+
+
+class VerificationContext:
+    """State for one verification request. Slots only: no per-instance __dict__."""
+
+    __slots__ = (
+        "request_id",
+        "option",
+        "id_image",
+        "selfie_image",
+        "selfie_frames",
+        "id_roi",
+        "id_face",
+        "selfie_face",
+        "selfie_box",
+        "stored_embedding",
+        "stored_version",
+        "selfie_embedding",
+        "embedding_version",
+        "distance",
+        "threshold",
+        "verified",
+        "tier",
+        "liveness",
+        "ocr_text",
+        "regional_text",
+        "qr_fields",
+        "fields",
+        "error",
+        "error_level",
+        "timings",
+        "deadline",
+    )
+
+    def __init__(self, option, id_image=None, selfie_image=None, selfie_frames=None, request_id=None,
+                 deadline=None):
+        self.request_id = request_id
+        self.option = option
+        self.id_image = id_image
+        self.selfie_image = selfie_image
+        self.selfie_frames = selfie_frames
+        self.id_roi = None
+        self.id_face = None
+        self.selfie_face = None
+        self.selfie_box = None
+        self.stored_embedding = None
+        self.stored_version = None
+        self.selfie_embedding = None
+        self.embedding_version = None
+        self.distance = None
+        self.threshold = get_thresholds()["threshold"]
+        self.verified = False
+        self.tier = None
+        self.liveness = None
+        self.ocr_text = None
+        self.regional_text = None
+        self.qr_fields = None
+        self.fields = None
+        self.error = None
+        self.error_level = None
+        self.timings = {}
+        self.deadline = deadline
+
+    @property
+    def table(self):
+        return "users" if self.option == "PAN" else "aadhar"
+
+    def fail(self, message, level="error"):
+        """Record a user-facing failure; later stages are skipped."""
+        self.error = message
+        self.error_level = level
+        return self
+
+    def remaining(self):
+        """Seconds left before the deadline (infinite without one)."""
+        return float("inf") if self.deadline is None else self.deadline - time.monotonic()
+
+    def can_afford(self, name):
+        """Whether the time left covers the measured cost of stage or step `name`."""
+        return self.remaining() >= expected_cost(name)
+
+
+# -------------------------
+# Stage costs and deadlines
+# -------------------------
+_stage_costs = {}
+_stage_costs_lock = threading.Lock()
+
+
+def record_cost(name, seconds):
+    with _stage_costs_lock:
+        previous = _stage_costs.get(name)
+        _stage_costs[name] = seconds if previous is None else previous + STAGE_COST_ALPHA * (seconds - previous)
+
+
+def expected_cost(name):
+    """Moving average of how long `name` takes; 0 until it has been measured once."""
+    with _stage_costs_lock:
+        return _stage_costs.get(name, 0.0)
+
+
+def stage(func):
+    """
+    Time a stage into ctx.timings and skip it once the context has failed.
+    A stage that no longer fits the deadline is skipped if optional, and
+    fails the request otherwise.
+    """
+    @functools.wraps(func)
+    def wrapper(ctx, *args, **kwargs):
+        if ctx.error is not None:
+            return ctx
+        name = func.__name__
+        if not ctx.can_afford(name):
+            action = "skipped" if name in OPTIONAL_STAGES else "failed"
+            deadline_event(action, name)
+            logging.warning("Deadline: %s %s (%.2fs left, expected %.2fs).",
+                            action, name, ctx.remaining(), expected_cost(name))
+            return ctx if action == "skipped" else ctx.fail(BUSY_MESSAGE, "warning")
+        start = time.perf_counter()
+        try:
+            return func(ctx, *args, **kwargs)
+        finally:
+            ctx.timings[name] = time.perf_counter() - start
+            record_cost(name, ctx.timings[name])
+    return wrapper
+
+
+def normalize_dob(dob_raw):
+    """Return DOB as YYYY-MM-DD, trying the date formats OCR commonly produces; None if unparseable."""
+    if isinstance(dob_raw, datetime):
+        return dob_raw.strftime("%Y-%m-%d")
+    if isinstance(dob_raw, str):
+        for fmt in DOB_FORMATS:
+            try:
+                return datetime.strptime(dob_raw.strip(), fmt).strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+    return None
+
+
+# -------------------------
+# Stages
+# -------------------------
+@stage
+def extract_roi(ctx):
+    """Crop the ID card region (a view into id_image, nothing written to disk)."""
+    roi, _ = extract_id_card(ctx.id_image, save=False)
+    if roi is None:
+        logging.error("extract_id_card returned None.")
+        return ctx.fail("Could not detect ID card region. Please upload a clearer image.")
+    ctx.id_roi = roi
+    return ctx
+
+
+@stage
+def read_qr(ctx):
+    """
+    Aadhaar fast path: decode the card's QR code (ROI first, then the full
+    photo). A legacy QR with a full, valid number makes OCR unnecessary; a
+    secure or masked QR carries only its last 4 digits, so OCR still
+    supplies the ID.
+    """
+    if ctx.option == "PAN":
+        return ctx
+    ctx.qr_fields = read_aadhaar_qr(ctx.id_roi, ctx.id_image)
+    return ctx
+
+
+@stage
+def run_ocr(ctx):
+    if ctx.qr_fields is not None and not is_masked(ctx.qr_fields):
+        return ctx
+    # Aadhaar cards repeat name and gender in a regional script; PAN cards are English-only
+    if ctx.option != "PAN" and REGIONAL_LANGUAGES:
+        ctx.regional_text = []
+    try:
+        ctx.ocr_text = extract_text(ctx.id_roi, regional=ctx.regional_text)
+    except Exception as e:
+        logging.error("OCR extraction failed: %s", e)
+    if not ctx.ocr_text:
+        logging.warning("OCR returned no text.")
+        return ctx.fail("OCR did not extract text from the ID card. Please try a clearer picture.", "warning")
+    return ctx
+
+
+@stage
+def parse_fields(ctx):
+    """Parse OCR text (or the QR payload) into fields, normalise DOB and replace the ID with its hash."""
+    try:
+        if ctx.qr_fields is not None and not is_masked(ctx.qr_fields):
+            fields = dict(ctx.qr_fields)
+        elif ctx.option == "PAN":
+            fields = extract_information(ctx.ocr_text)
+        else:
+            fields = extract_information1(ctx.ocr_text)
+    except Exception as e:
+        logging.error("Failed to parse OCR text into fields: %s", e)
+        return ctx.fail("Failed to parse ID details. Please check the uploaded ID image.")
+
+    if not fields or "ID" not in fields:
+        logging.error("text_info invalid or missing ID: fields=%s", sorted(fields or {}))
+        return ctx.fail("Required fields not detected in OCR output (ID missing).")
+    if not fields["ID"]:
+        # The parser found no number passing format/checksum validation, even after re-ranking
+        logging.error("No valid %s number in OCR output.", ctx.option)
+        return ctx.fail("The ID number could not be read reliably. Please try a clearer picture.", "warning")
+    if ctx.qr_fields is not None and is_masked(ctx.qr_fields):
+        # Masked QR: its name/DOB/gender win over OCR; the OCR'd number must match its last 4 digits
+        digits = "".join(c for c in str(fields.get("ID", "")) if c.isdigit())
+        last4 = "".join(c for c in ctx.qr_fields["ID"] if c.isdigit())[-4:]
+        if not digits.endswith(last4):
+            logging.error("OCR'd Aadhaar number does not match the QR code's last 4 digits.")
+            return ctx.fail("The Aadhaar number could not be read reliably. Please try a clearer picture.")
+        fields.update({k: v for k, v in ctx.qr_fields.items() if k != "ID" and v})
+    # Field values are PII: log only which fields were found
+    logging.info("Parsed fields: %s", sorted(k for k, v in fields.items() if v))
+
+    fields["DOB"] = normalize_dob(fields.get("DOB"))
+    fields["ID"] = hash_id(fields.get("ID", ""))
+    ctx.fields = fields
+    return ctx
+
+
+@stage
+def lookup_stored_embedding(ctx):
+    """
+    Returning users are verified against their enrollment embedding instead of
+    the ID face, unless it is of a version that cannot be reproduced (then
+    only ctx.stored_version is set, and the record is upgraded once verified).
+    """
+    ctx.stored_embedding, ctx.stored_version = fetch_embedding(ctx.table, ctx.fields["ID"])
+    if ctx.stored_embedding is not None:
+        logging.info("Stored %s embedding found for hashed ID; skipping ID-face extraction.", ctx.stored_version)
+    elif ctx.stored_version is not None:
+        logging.info("Stored %s embedding cannot be reproduced; verifying against the ID face.", ctx.stored_version)
+    return ctx
+
+
+def _escalate(ctx):
+    """
+    Borderline distance: re-score the selfie face against the ID face with the
+    heavier model. None (decide on the fast model alone) when the deadline
+    cannot cover it, or when the ID face cannot be normalised like the selfie.
+    """
+    if not ctx.can_afford("escalation"):
+        t = get_thresholds(ctx.embedding_version)
+        if ctx.distance is not None and t["accept_below"] < ctx.distance <= t["reject_above"]:
+            deadline_event("skipped", "escalation")
+        return None
+
+    def run():
+        start = time.perf_counter()
+        if ctx.id_face is None:
+            align = version_settings(ctx.embedding_version)[1]
+            ctx.id_face, _, id_version = crop_face_versioned(ctx.id_roi, align=align)
+            if version_settings(id_version)[1] != align:
+                logging.info("ID face could not be aligned like the selfie; not escalating.")
+                return None
+        distance = model_distance(ctx.selfie_face, ctx.id_face, ESCALATION_MODEL)
+        record_cost("escalation", time.perf_counter() - start)
+        return distance
+    return run
+
+
+@stage
+def verify_face(ctx):
+    """
+    Compare selfie (or burst) with the stored embedding or the ID face in one
+    batched forward pass. Clear-cut distances are decided right away; only
+    borderline ones are re-checked with the heavier ESCALATION_MODEL. A stored
+    embedding of an older version is compared with a selfie embedded the same
+    old way. Faces that cannot be normalised alike (eyes not found) are
+    compared as padded crops, and the decision and the enrolled embedding
+    use the version actually compared (ctx.embedding_version).
+    """
+    try:
+        if ctx.selfie_frames is not None:
+            result = verify_selfie_frames(ctx.id_roi, ctx.selfie_frames,
+                                          reference_embedding=ctx.stored_embedding,
+                                          reference_version=ctx.stored_version)
+            ctx.embedding_version = result["version"]
+            ctx.threshold = result["threshold"]
+            ctx.distance = result["distance"]
+            ctx.liveness = result["liveness"]
+            ctx.selfie_image = ctx.selfie_frames[result["best_frame"]]
+            ctx.selfie_face = result["best_face"]
+            ctx.selfie_box = result["best_box"]
+            ctx.selfie_embedding = result["best_embedding"]
+            verified, ctx.tier, _ = tiered_decision(ctx.distance, escalate=_escalate(ctx),
+                                                    version=ctx.embedding_version)
+            ctx.verified = verified and ctx.liveness["live"]
+        else:
+            if ctx.stored_embedding is not None:
+                model_name, align = version_settings(ctx.stored_version)
+                ctx.selfie_face, ctx.selfie_box, ctx.embedding_version = crop_face_versioned(
+                    ctx.selfie_image, align=align, model_name=model_name)
+                if ctx.embedding_version == ctx.stored_version:
+                    embeddings = embed_faces_with_model([ctx.selfie_face], model_name)
+                    reference = np.asarray(ctx.stored_embedding, dtype=np.float32)
+                else:
+                    logging.info("Selfie does not normalise like the stored %s embedding; "
+                                 "comparing with the ID face", ctx.stored_version)
+            if ctx.stored_embedding is None or ctx.embedding_version != ctx.stored_version:
+                ctx.selfie_face, ctx.selfie_box, ctx.embedding_version = crop_face_versioned(ctx.selfie_image)
+                ctx.id_face, id_box, id_version = crop_face_versioned(ctx.id_roi)
+                if id_version != ctx.embedding_version:  # compare like with like: both padded
+                    ctx.embedding_version = embedding_version(align=False)
+                    ctx.selfie_face = box_crop(ctx.selfie_image, ctx.selfie_box)
+                    ctx.id_face = box_crop(ctx.id_roi, id_box)
+                embeddings = embed_faces_batch([ctx.selfie_face, ctx.id_face])
+                reference = embeddings[1]
+            ctx.selfie_embedding = embeddings[0].tolist()
+            ctx.threshold = get_thresholds(ctx.embedding_version)["threshold"]
+            ctx.distance = float(cosine_distances(reference, embeddings[0])[0])
+            ctx.verified, ctx.tier, _ = tiered_decision(ctx.distance, escalate=_escalate(ctx),
+                                                        version=ctx.embedding_version)
+    except Exception as e:
+        logging.error("Face verification raised exception: %s", e)
+        ctx.verified = False
+
+    logging.info("Face verification status: %s (distance=%s, %s decision).",
+                 "successful" if ctx.verified else "failed", ctx.distance, ctx.tier)
+    if not ctx.verified:
+        if ctx.liveness is not None and not ctx.liveness["live"] and ctx.distance is not None \
+                and ctx.distance <= ctx.threshold:
+            return ctx.fail("Liveness check failed: no natural movement across the selfie frames.")
+        return ctx.fail("Face verification failed. Please try again with clearer images.")
+    ctx.fields["Embedding"] = ctx.selfie_embedding
+    ctx.fields["Embedding Version"] = ctx.embedding_version
+    if ctx.selfie_box is not None:
+        ctx.fields["Face"] = enrollment_face(ctx.selfie_image, ctx.selfie_box)
+    return ctx
+
+
+@stage
+def upgrade_stored_embedding(ctx):
+    """
+    A returning user whose stored embedding is of an older version (compared
+    like-for-like, or not reproducible and verified against the ID face):
+    store the current-version embedding of the verified selfie next to it,
+    so records without a stored face still migrate.
+    """
+    if ctx.stored_version is None or ctx.stored_version == CURRENT_EMBEDDING_VERSION:
+        return ctx
+    if ctx.embedding_version != CURRENT_EMBEDDING_VERSION:
+        face, _, version = crop_face_versioned(ctx.selfie_image)
+        if version != CURRENT_EMBEDDING_VERSION:
+            logging.info("Selfie could not be normalised as %s; stored embedding not upgraded.",
+                         CURRENT_EMBEDDING_VERSION)
+            return ctx
+        ctx.selfie_embedding = embed_faces_batch([face])[0].tolist()
+    ctx.fields["Embedding"] = ctx.selfie_embedding
+    ctx.fields["Embedding Version"] = CURRENT_EMBEDDING_VERSION
+    upgrade_embedding(ctx.table, ctx.fields["ID"], ctx.selfie_embedding, face=ctx.fields.get("Face"))
+    return ctx
+
+
+PIPELINE = [extract_roi, read_qr, run_ocr, parse_fields, lookup_stored_embedding, verify_face,
+            upgrade_stored_embedding]
+# Stages a request can do without when short of time: OCR still reads the
+# card without the QR fast path, and read repair waits for the next visit
+OPTIONAL_STAGES = {"read_qr", "upgrade_stored_embedding"}
+
+
+def run_pipeline(ctx, stages=PIPELINE):
+    """Run every stage in order; stops at the first failure recorded on the context."""
+    for stage_func in stages:
+        ctx = stage_func(ctx)
+    logging.info("Pipeline timings (s): %s", {k: round(v, 3) for k, v in ctx.timings.items()})
+    return ctx
@@ -1,6 +1,7 @@
 import pandas as pd
 from datetime import datetime
 import re
+from id_validation import best_pan, best_aadhaar
 def filter_lines(lines):
     start_index = None
     end_index = None
@@ -75,7 +76,6 @@ def extract_information(data_string):
     # Split the data string into a list of words based on "|"
     updated_data_string = data_string.replace(".", "")
     words = [word.strip() for word in updated_data_string.split("|") if len(word.strip()) > 2]
-    print(words)
     extracted_info = {
         "ID": "",
         "Name": "",
@@ -92,7 +92,7 @@ def extract_information(data_string):
         extracted_info["Father's Name"] = words[fathers_name_index]
 
         id_number_index = words.index("Permanent Account Number Card") + 1
-        extracted_info["ID"] = words[id_number_index]
+        extracted_info["ID"] = words[id_number_index] if id_number_index < len(words) else ""
 
         dob_index = None
         for i, word in enumerate(words):
@@ -111,6 +111,9 @@ def extract_information(data_string):
             print("Error: Date of birth not found.")
     except ValueError:
         print("Error: Some required information is missing or incorrectly formatted.")
+    # Validate the PAN; on failure re-rank the other OCR words as candidates
+    anchor = words.index("Permanent Account Number Card") + 1 if "Permanent Account Number Card" in words else None
+    extracted_info["ID"] = best_pan(words, extracted_info["ID"], anchor=anchor, name=extracted_info["Name"])
     return extracted_info
 
 
@@ -169,6 +172,9 @@ def extract_information1(data_string):
             print("Error: Date of birth not found.")
     except ValueError:
         print("Error: Some required information is missing or incorrectly formatted.")
+    # Verhoeff-check the number; on failure re-rank the other OCR words as candidates
+    anchor = next((i for i, word in enumerate(words) if re.match(r'^\d{4}( \d{4} \d{4})?$', word)), None)
+    extracted_info["ID"] = best_aadhaar(words, extracted_info["ID"], anchor=anchor)
     return extracted_info
 
 # ----------------- DEBUGGING--------------------
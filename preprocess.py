@@ -2,13 +2,12 @@ import cv2
 import numpy as np
 import os
 import logging
+import threading
 from utils import read_yaml, file_exists
+from logging_config import setup_logging
 
 # Logging configuration
-logging_str = "[%(asctime)s: %(levelname)s: %(module)s]: %(message)s"
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-logging.basicConfig(filename=os.path.join(log_dir, "ekyc_logs.log"), level=logging.INFO, format=logging_str, filemode="a")
+setup_logging()
 
 # ---------------DEBUGGING--------------
 # Testing the functionality of logging (Easier for Debugging)
@@ -26,6 +25,10 @@ intermediate_dir_path = artifacts['INTERMIDEIATE_DIR']
 conour_file_name = artifacts['CONTOUR_FILE']
 # print(intermediate_dir_path)
 
+runtime = config.get('runtime', {})
+NORMALIZE_ID_CARD = bool(runtime.get('NORMALIZE_ID_CARD', True))
+CARD_SIZE = (856, 540)  # canonical (width, height), ID-1 card aspect ratio 85.6 x 54 mm
+
 def read_image(image_path, is_uploaded=False):
     if is_uploaded:
         try:
@@ -33,22 +36,22 @@ def read_image(image_path, is_uploaded=False):
             image_bytes = image_path.read()
             img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
             if img is None:
-                logging.info("Failed to read image: {}".format(image_path))
+                logging.info("Failed to read image: %s", image_path)
                 raise Exception("Failed to read image: {}".format(image_path))
             return img
         except Exception as e:
-            logging.info(f"Error reading image: {e}")
+            logging.info("Error reading image: %s", e)
             print("Error reading image:", e)
             return None
     else:
         try:
             img = cv2.imread(image_path)
             if img is None:
-                logging.info("Failed to read image: {}".format(image_path))
+                logging.info("Failed to read image: %s", image_path)
                 raise Exception("Failed to read image: {}".format(image_path))
             return img
         except Exception as e:
-            logging.info(f"Error reading image: {e}")
+            logging.info("Error reading image: %s", e)
             print("Error reading image:", e)
             return None
 
@@ -66,7 +69,139 @@ def read_image(image_path, is_uploaded=False):
 #     print("Failed to load image.")
 
 
-def extract_id_card(img):
+_thread_local = threading.local()
+
+
+def get_face_cascade():
+    """
+    Load the Haar cascade once per thread instead of once per call.
+    CascadeClassifier.detectMultiScale is not safe to call concurrently on
+    one instance, so each thread gets its own.
+    """
+    cascade = getattr(_thread_local, "face_cascade", None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(
+            cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+        )
+        _thread_local.face_cascade = cascade
+    return cascade
+
+
+def get_eye_cascade():
+    """Per-thread Haar eye cascade, used for face alignment (see get_face_cascade)."""
+    cascade = getattr(_thread_local, "eye_cascade", None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_eye.xml")
+        _thread_local.eye_cascade = cascade
+    return cascade
+
+
+# ---------------------------------------
+# Card normalisation (perspective + orientation)
+# ---------------------------------------
+def order_corners(pts):
+    """Order 4 points as top-left, top-right, bottom-right, bottom-left."""
+    pts = np.asarray(pts, dtype=np.float32).reshape(4, 2)
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    return np.array([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]],
+                    dtype=np.float32)
+
+
+def find_card_quad(img, min_area_ratio=0.2):
+    """
+    Four corners of the card: the largest contour that approxPolyDP reduces
+    to a convex quadrilateral covering at least `min_area_ratio` of the image.
+    Falls back to the rotated bounding box of the largest contour; None if
+    nothing large enough is found.
+    """
+    # Edges are found on a downscaled copy; corners are scaled back
+    scale = 800.0 / max(img.shape[:2]) if max(img.shape[:2]) > 800 else 1.0
+    small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else img
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8), iterations=1)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+
+    min_area = min_area_ratio * gray.shape[0] * gray.shape[1]
+    contours = sorted(contours, key=cv2.contourArea, reverse=True)[:5]
+    for cnt in contours:
+        if cv2.contourArea(cnt) < min_area:
+            break
+        approx = cv2.approxPolyDP(cnt, 0.02 * cv2.arcLength(cnt, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return order_corners(approx / scale)
+
+    if cv2.contourArea(contours[0]) < min_area:
+        return None
+    return order_corners(cv2.boxPoints(cv2.minAreaRect(contours[0])) / scale)
+
+
+def warp_card(img, quad, size=CARD_SIZE):
+    """Perspective-warp the quadrilateral to a landscape card of `size` (width, height)."""
+    tl, tr, br, bl = quad
+    width = max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl))
+    height = max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr))
+    if height > width:
+        # Portrait quad: start the corners at top-right so the card comes out landscape
+        quad = np.array([tr, br, bl, tl], dtype=np.float32)
+    w, h = size
+    target = np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]], dtype=np.float32)
+    return cv2.warpPerspective(img, cv2.getPerspectiveTransform(quad, target), (w, h))
+
+
+def is_upside_down(card):
+    """
+    Cheap 0/180 degree test on a landscape card. The holder's photo is an
+    upright face: the Haar cascade only fires on upright faces, so compare
+    detections on the card and its 180 degree rotation (at half size). When
+    neither has a face, fall back to text lines: card text is left-aligned,
+    so ink sits nearer the left edge on the upright card.
+    """
+    small = cv2.cvtColor(cv2.resize(card, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA),
+                         cv2.COLOR_BGR2GRAY)
+    cascade = get_face_cascade()
+    upright = len(cascade.detectMultiScale(small, scaleFactor=1.2, minNeighbors=5))
+    flipped = len(cascade.detectMultiScale(cv2.rotate(small, cv2.ROTATE_180), scaleFactor=1.2, minNeighbors=5))
+    if upright != flipped:
+        return flipped > upright
+
+    ink = cv2.adaptiveThreshold(small, 1, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+    rows = np.flatnonzero(ink.sum(axis=1) > 0.02 * ink.shape[1])
+    if len(rows) == 0:
+        return False
+    cols = ink[rows].sum(axis=0)
+    half = ink.shape[1] // 2
+    return cols[half:].sum() > 1.2 * cols[:half].sum()
+
+
+def normalize_card(img, size=CARD_SIZE):
+    """Warp the card in `img` to a deskewed, upright `size` image; None if no card outline is found."""
+    quad = find_card_quad(img)
+    if quad is None:
+        return None
+    card = warp_card(img, quad, size)
+    if is_upside_down(card):
+        card = cv2.rotate(card, cv2.ROTATE_180)
+    return card
+
+
+def extract_id_card(img, save=True, normalize=NORMALIZE_ID_CARD):
+    """
+    Crop the ID card from `img`. Returns (roi, filename).
+    With normalize=True the card's four corners are warped to a deskewed,
+    upright CARD_SIZE image; otherwise (or if no outline is found) the ROI is
+    the bounding box of the largest contour, as a view into `img`.
+    With save=False no file is written, so concurrent requests don't share
+    the contour file. Returns (None, None) when no card is found.
+    """
+    if normalize:
+        card = normalize_card(img)
+        if card is not None:
+            logging.info("ID card normalised to %sx%s", *CARD_SIZE)
+            return card, (_save_contour(card) if save else None)
 
     # Convert image to grayscale
     # ---------------------- Reduces Computational Complexity involved ----------------
@@ -104,30 +239,36 @@ def extract_id_card(img):
             largest_area = area
 
     # If no large contour is found, assume no ID card is present
-    if not largest_contour.any():
-        return None
+    if largest_contour is None or not largest_contour.any():
+        return None, None
 
     # Get bounding rectangle of the largest contour
     x, y, w, h = cv2.boundingRect(largest_contour)
 
-    logging.info(f"contours are found at, {(x, y, w, h)}")
+    logging.info("contours are found at, %s", (x, y, w, h))
     # logging.info("Area largest_area)
 
     # Apply additional filtering (optional):
     # - Apply bilateral filtering for noise reduction
     # filtered_img = cv2.bilateralFiltering(img[y:y+h, x:x+w], 9, 75, 75)
     # - Morphological operations (e.g., erosion, dilation) for shape refinement
+    contour_id = img[y:y+h, x:x+w]
+    if not save:
+        return contour_id, None
+
+    return contour_id, _save_contour(contour_id)
+
+
+def _save_contour(contour_id):
     current_wd = os.getcwd()
     filename = os.path.join(current_wd,intermediate_dir_path, conour_file_name)
-    contour_id = img[y:y+h, x:x+w]
     is_exists = file_exists(filename)
     if is_exists:
         # Remove the existing file
         os.remove(filename)
 
     cv2.imwrite(filename, contour_id)
-
-    return contour_id, filename
+    return filename
 
 
 # ----------- DEBUGGING ----------------
@@ -138,7 +279,7 @@ def extract_id_card(img):
 # if image is not None:
 #     extracted_image, file_path = extract_id_card(image)
 #     if extracted_image is not None:
-#         logging.info(f"Extracted ID card saved to: {file_path}")
+#         logging.info("Extracted ID card saved to: %s", file_path)
 #     else:
 #         logging.error("No ID card detected in the image.")
 # else:
@@ -160,7 +301,7 @@ def save_image(image, filename, path="."):
   # Save the image using cv2.imwrite
   cv2.imwrite(full_path, image)
 
-  logging.info(f"Image saved successfully: {full_path}")
+  logging.info("Image saved successfully: %s", full_path)
   return full_path
 
 # -------------- DEBUGGING ------------------
@@ -0,0 +1,118 @@
+"""
+On-demand profiling of a single verification request.
+
+When a request is flagged (app.py: ?profile=1, an X-Profile header, or the
+sidebar debug checkbox, all only when ALLOW_PROFILING is set), its pipeline
+runs under cProfile and a tracemalloc allocation snapshot is taken. Three
+artifacts are written to artifacts.PROFILE_DIR, named after the request ID:
+
+    <request_id>.prof        pstats dump (snakeviz / python -m pstats)
+    <request_id>.txt         top functions by cumulative and by own time
+    <request_id>_alloc.txt   top allocation sites since the request started
+
+Unflagged requests pay one boolean check. cProfile sees only the thread it
+is enabled in, so the wrapper enables it inside the pipeline worker thread.
+One profiled run at a time: on Python 3.12+ a second cProfile raises while
+another is active, so a flagged request arriving meanwhile runs unprofiled.
+tracemalloc is process-wide: concurrent unprofiled requests show up in the
+allocation snapshot too.
+"""
+
+import io
+import os
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+import functools
+from utils import read_yaml
+
+config_path = "config.yaml"
+artifacts = read_yaml(config_path).get('artifacts', {})
+PROFILE_DIR = os.getenv("PROFILE_DIR", artifacts.get('PROFILE_DIR', os.path.join("data", "profiles")))
+ALLOW_PROFILING = os.getenv("ALLOW_PROFILING", "").lower() in ("1", "true", "yes")
+TRACEMALLOC_FRAMES = 10
+TOP_N = 40
+
+_tracing = 0
+_tracing_lock = threading.Lock()
+_profile_lock = threading.Lock()
+
+
+def _start_tracemalloc():
+    """Reference-counted so overlapping profiled requests share one trace."""
+    global _tracing
+    with _tracing_lock:
+        if _tracing == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        _tracing += 1
+        return tracemalloc.take_snapshot()
+
+
+def _stop_tracemalloc():
+    global _tracing
+    with _tracing_lock:
+        snapshot = tracemalloc.take_snapshot()
+        _tracing -= 1
+        if _tracing == 0:
+            tracemalloc.stop()
+        return snapshot
+
+
+def _write_reports(request_id, profiler, before, after, seconds):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, request_id)
+    profiler.dump_stats(base + ".prof")
+
+    text = io.StringIO()
+    text.write(f"request {request_id}: {seconds:.3f}s wall\n\n")
+    stats = pstats.Stats(profiler, stream=text).strip_dirs()
+    stats.sort_stats("cumulative").print_stats(TOP_N)
+    stats.sort_stats("tottime").print_stats(TOP_N)
+    with open(base + ".txt", "w") as f:
+        f.write(text.getvalue())
+
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+    with open(base + "_alloc.txt", "w") as f:
+        f.write(f"request {request_id}: allocation growth by line (process-wide)\n\n")
+        for entry in diff[:TOP_N]:
+            f.write(f"{entry}\n")
+    return {"prof": base + ".prof", "summary": base + ".txt", "alloc": base + "_alloc.txt"}
+
+
+def profiled(func, request_id, result):
+    """
+    Wrap `func` so one call runs under cProfile + tracemalloc. The artifact
+    paths are stored in the dict `result` once the call returns (or raises);
+    it stays empty if another profiled run was in progress.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _profile_lock.acquire(blocking=False):
+            logging.warning("Request %s not profiled: another profiled request is running", request_id)
+            return func(*args, **kwargs)
+        try:
+            before = _start_tracemalloc()
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            enabled = False
+            try:
+                profiler.enable()
+                enabled = True
+                return func(*args, **kwargs)
+            finally:
+                profiler.disable()
+                seconds = time.perf_counter() - start
+                after = _stop_tracemalloc()
+                if enabled:
+                    try:
+                        result.update(_write_reports(request_id, profiler, before, after, seconds))
+                        logging.info("Request profile written to %s (%.3fs)", result["prof"], seconds)
+                    except OSError as e:
+                        logging.error("Could not write request profile: %s", e)
+        finally:
+            _profile_lock.release()
+    return wrapper
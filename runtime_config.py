@@ -0,0 +1,205 @@
+"""
+Central thread-count and CPU-affinity control for co-located OCR and face models.
+
+EasyOCR (torch), DeepFace (TensorFlow), OpenCV and the BLAS libraries each
+size their thread pools to every core by default. In one process, or with
+several workers on a node, they oversubscribe the CPU. configure_runtime()
+caps all of them per worker and can pin the worker to a CPU set.
+
+Call it before the heavy libraries are imported (first thing in app.py):
+BLAS/OpenMP pools read their environment variables only once, at load time.
+
+Benchmark mode sweeps worker count x threads-per-worker over the sample images:
+    python runtime_config.py bench --workers 1,2,4 --threads 1,2,4
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+from utils import read_yaml
+
+config_path = "config.yaml"
+config = read_yaml(config_path)
+runtime = config.get('runtime', {})
+THREADS_PER_WORKER = int(os.getenv("THREADS_PER_WORKER", runtime.get('THREADS_PER_WORKER', 0)))
+CPU_AFFINITY = runtime.get('CPU_AFFINITY', None)  # None, a list of CPU ids, or "auto"
+# This worker's position among the workers on the node (set per process by the launcher), for "auto"
+WORKER_INDEX = os.getenv("WORKER_INDEX")
+
+THREAD_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "TF_NUM_INTRAOP_THREADS",
+]
+
+BENCH_IMAGES = [
+    os.path.join("data", "01_raw_data", "pan.jpeg"),
+    os.path.join("data", "01_raw_data", "pan_1.jpg"),
+    os.path.join("data", "01_raw_data", "aadhar.png"),
+    os.path.join("data", "01_raw_data", "adhar_2.jpg"),
+    os.path.join("data", "01_raw_data", "id_1.png"),
+    os.path.join("data", "01_raw_data", "sample_image1.jpg"),
+]
+
+
+def available_cpus():
+    """CPUs this process may run on (respects an existing affinity mask)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cpus_for_worker(worker_index, threads_per_worker):
+    """Contiguous CPU block for a worker: worker i gets CPUs [i*t, (i+1)*t)."""
+    cpus = available_cpus()
+    start = (worker_index * threads_per_worker) % len(cpus)
+    return [cpus[(start + i) % len(cpus)] for i in range(threads_per_worker)]
+
+
+def pin_to_cpus(cpus):
+    """Pin the current process to `cpus`. Returns False where the OS does not allow it."""
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, set(cpus))
+        else:
+            import psutil
+            psutil.Process().cpu_affinity(list(cpus))
+        return True
+    except Exception as e:
+        logging.warning("Could not set CPU affinity to %s: %s", cpus, e)
+        return False
+
+
+def configure_runtime(threads_per_worker=THREADS_PER_WORKER, cpu_affinity=CPU_AFFINITY, worker_index=WORKER_INDEX):
+    """
+    Cap torch, TensorFlow, OpenCV and BLAS thread pools at `threads_per_worker`
+    (0 keeps library defaults) and optionally pin the process to CPUs.
+    "auto" pins worker `worker_index` (default: the WORKER_INDEX environment
+    variable) to its own block of `threads_per_worker` CPUs; without both it
+    does not pin, since every worker would get the same block.
+    Libraries that are already initialised are adjusted where they allow it.
+    """
+    if cpu_affinity == "auto":
+        if threads_per_worker and worker_index is not None:
+            cpu_affinity = cpus_for_worker(int(worker_index), threads_per_worker)
+        else:
+            logging.warning("CPU_AFFINITY auto needs THREADS_PER_WORKER and WORKER_INDEX; not pinning")
+            cpu_affinity = None
+    if cpu_affinity:
+        pin_to_cpus(cpu_affinity)
+
+    if not threads_per_worker:
+        return
+
+    n = str(threads_per_worker)
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = n
+    # Inter-op pools only add contention when each worker owns a few cores
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+
+    try:
+        import cv2
+        cv2.setNumThreads(threads_per_worker)
+    except ImportError:
+        pass
+
+    if "torch" in sys.modules or _importable("torch"):
+        import torch
+        torch.set_num_threads(threads_per_worker)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # only settable before the first parallel op
+
+    if "tensorflow" in sys.modules or _importable("tensorflow"):
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(threads_per_worker)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        except RuntimeError:
+            pass  # TF runtime already initialised; env vars above still apply to new workers
+
+    logging.info("Runtime configured: threads_per_worker=%s, cpu_affinity=%s", threads_per_worker, cpu_affinity)
+
+
+def _importable(module_name):
+    import importlib.util
+    return importlib.util.find_spec(module_name) is not None
+
+
+# ---------------------------------------
+# Benchmark mode
+# ---------------------------------------
+def _init_bench_worker(counter, threads_per_worker, pin):
+    with counter.get_lock():
+        worker_index = counter.value
+        counter.value += 1
+    configure_runtime(threads_per_worker, "auto" if pin else None, worker_index)
+
+
+def _process_sample(image_path):
+    """One pipeline pass over a sample image: ROI, OCR, face crop and embedding."""
+    from preprocess import read_image, extract_id_card
+    from ocr_engine import extract_text
+    from face_verification import crop_largest_face, embed_faces_batch
+
+    img = read_image(image_path)
+    roi, _ = extract_id_card(img)
+    extract_text(roi)
+    face, _ = crop_largest_face(roi)
+    embed_faces_batch([face])
+    return image_path
+
+
+def benchmark(worker_counts, thread_counts, rounds=2, pin=False):
+    """Sweep worker count x threads-per-worker; return rows sorted by throughput."""
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+
+    images = [p for p in BENCH_IMAGES if os.path.exists(p)] * rounds
+    cores = len(available_cpus())
+    results = []
+    for workers in worker_counts:
+        for threads in thread_counts:
+            if workers * threads > cores:
+                print(f"skip workers={workers} threads={threads}: {workers * threads} > {cores} cores")
+                continue
+            ctx = mp.get_context("spawn")
+            counter = ctx.Value("i", 0)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_bench_worker,
+                                     initargs=(counter, threads, pin)) as pool:
+                # Warm-up: one image per worker loads the models
+                list(pool.map(_process_sample, images[:workers]))
+                start = time.perf_counter()
+                list(pool.map(_process_sample, images))
+                elapsed = time.perf_counter() - start
+            row = {"workers": workers, "threads": threads, "images_per_s": len(images) / elapsed}
+            print(f"workers={workers:<3} threads={threads:<3} {row['images_per_s']:.2f} images/s")
+            results.append(row)
+    results.sort(key=lambda r: r["images_per_s"], reverse=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runtime thread/affinity tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_bench = sub.add_parser("bench", help="Sweep workers x threads-per-worker on the sample images")
+    p_bench.add_argument("--workers", default="1,2,4")
+    p_bench.add_argument("--threads", default="1,2,4")
+    p_bench.add_argument("--rounds", type=int, default=2)
+    p_bench.add_argument("--pin", action="store_true", help="Pin each worker to its own CPU block")
+    args = parser.parse_args()
+
+    rows = benchmark([int(w) for w in args.workers.split(",")],
+                     [int(t) for t in args.threads.split(",")],
+                     rounds=args.rounds, pin=args.pin)
+    if rows:
+        best = rows[0]
+        print(f"\nBest: workers={best['workers']} threads_per_worker={best['threads']} "
+              f"({best['images_per_s']:.2f} images/s)")
+        print(f"Set runtime.THREADS_PER_WORKER: {best['threads']} in config.yaml")
@@ -1,18 +1,102 @@
 """
 Database setup script for E-KYC project.
 This script creates the required MySQL database and tables for PAN and Aadhar users.
+
+Schema notes:
+- `id` is the raw 32-byte SHA-256 of the ID number (BINARY(32)), half the
+  size of the hex string and compared as bytes.
+- Secondary indexes on `created_at` and (`dob`, `name`) serve fraud queries.
+- Embeddings live in `<table>_embeddings`, so ID lookups and index scans on
+  the main tables don't pull ~10 KB embedding rows through the buffer pool.
+  Rows are keyed by (`id`, `model_version`), so a record can hold embeddings
+  of two model versions during a re-embedding migration; the enrollment face
+  crop they are re-embedded from lives in `<table>_faces`.
+- Optional RANGE partitioning by `created_at` (`partition_by_created_at = true`
+  in config.toml). MySQL requires the partitioning column in every unique
+  key, so partitioned tables use PRIMARY KEY (id, created_at). Unique IDs
+  are then enforced by `<table>_ids`, an unpartitioned registry keyed by
+  `id` that storage.py inserts into in the same transaction as the row.
 """
 
 import mysql.connector
 import toml
 import os
 import logging
+from datetime import datetime
+from logging_config import setup_logging
+from embedding_versions import LEGACY_EMBEDDING_VERSION
 
 # Logging configuration
-logging_str = "[%(asctime)s: %(levelname)s: %(module)s]: %(message)s"
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-logging.basicConfig(filename=os.path.join(log_dir, "database_setup.log"), level=logging.INFO, format=logging_str, filemode="a")
+setup_logging(log_file="database_setup.log")
+
+TABLE_COLUMNS = {
+    "users": "father_name VARCHAR(255),",
+    "aadhar": "gender VARCHAR(50),",
+}
+
+
+def partition_clause(start_year=2023, end_year=None):
+    """Yearly RANGE partitions on created_at plus a catch-all partition."""
+    end_year = end_year or datetime.now().year + 1
+    parts = [
+        f"PARTITION p{year} VALUES LESS THAN (UNIX_TIMESTAMP('{year + 1}-01-01 00:00:00'))"
+        for year in range(start_year, end_year + 1)
+    ]
+    parts.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    return "PARTITION BY RANGE (UNIX_TIMESTAMP(created_at)) (\n    " + ",\n    ".join(parts) + "\n)"
+
+
+def table_ddl(table, name=None, partitioned=False):
+    """CREATE TABLE statement for `users` or `aadhar` (optionally under another name, for migrations)."""
+    primary_key = "PRIMARY KEY (id, created_at)" if partitioned else "PRIMARY KEY (id)"
+    ddl = f"""
+        CREATE TABLE IF NOT EXISTS {name or table} (
+            id BINARY(32) NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            {TABLE_COLUMNS[table]}
+            dob DATE NOT NULL,
+            id_type VARCHAR(50) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            {primary_key},
+            INDEX idx_created_at (created_at),
+            INDEX idx_dob_name (dob, name)
+        )
+        """
+    if partitioned:
+        ddl += partition_clause()
+    return ddl
+
+
+def embedding_table_ddl(table):
+    """Side table holding float32 embedding bytes keyed by the same BINARY(32) id and the model version."""
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table}_embeddings (
+            id BINARY(32) NOT NULL,
+            model_version VARCHAR(64) NOT NULL DEFAULT '{LEGACY_EMBEDDING_VERSION}',
+            embedding MEDIUMBLOB,
+            PRIMARY KEY (id, model_version)
+        )
+        """
+
+
+def id_table_ddl(table):
+    """Registry enforcing unique ids for a partitioned table (its own primary key includes created_at)."""
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table}_ids (
+            id BINARY(32) NOT NULL PRIMARY KEY
+        )
+        """
+
+
+def face_table_ddl(table):
+    """Side table holding the JPEG enrollment face crop each record can be re-embedded from."""
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table}_faces (
+            id BINARY(32) NOT NULL PRIMARY KEY,
+            face MEDIUMBLOB
+        )
+        """
+
 
 def create_database_and_tables():
     """Create database and tables if they don't exist."""
@@ -34,6 +118,7 @@ def create_database_and_tables():
         db_password = db_config.get("password")
         db_host = db_config.get("host", "localhost")
         db_name = db_config.get("database")
+        partitioned = bool(db_config.get("partition_by_created_at", False))
         
         if not db_user or not db_password or not db_name:
             print("ERROR: Database credentials not found in config.toml")
@@ -42,7 +127,7 @@ def create_database_and_tables():
             
     except Exception as e:
         print(f"ERROR: Failed to load config.toml: {e}")
-        logging.error(f"Failed to load config.toml: {e}")
+        logging.error("Failed to load config.toml: %s", e)
         return False
     
     try:
@@ -60,42 +145,20 @@ def create_database_and_tables():
         # Create database if it doesn't exist
         print(f"Creating database '{db_name}' if it doesn't exist...")
         mycursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name}")
-        logging.info(f"Database '{db_name}' created or already exists")
+        logging.info("Database '%s' created or already exists", db_name)
         
         # Use the database
         mycursor.execute(f"USE {db_name}")
         
-        # Create users table (for PAN cards)
-        print("Creating 'users' table for PAN cards...")
-        create_users_table = """
-        CREATE TABLE IF NOT EXISTS users (
-            id VARCHAR(255) PRIMARY KEY,
-            name VARCHAR(255) NOT NULL,
-            father_name VARCHAR(255),
-            dob DATE NOT NULL,
-            id_type VARCHAR(50) NOT NULL,
-            embedding TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-        mycursor.execute(create_users_table)
-        logging.info("Table 'users' created or already exists")
-        
-        # Create aadhar table
-        print("Creating 'aadhar' table for Aadhar cards...")
-        create_aadhar_table = """
-        CREATE TABLE IF NOT EXISTS aadhar (
-            id VARCHAR(255) PRIMARY KEY,
-            name VARCHAR(255) NOT NULL,
-            gender VARCHAR(50),
-            dob DATE NOT NULL,
-            id_type VARCHAR(50) NOT NULL,
-            embedding TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-        mycursor.execute(create_aadhar_table)
-        logging.info("Table 'aadhar' created or already exists")
+        # Create users table (for PAN cards) and aadhar table, each with its embeddings side table
+        for table, label in (("users", "PAN"), ("aadhar", "Aadhar")):
+            print(f"Creating '{table}' table for {label} cards{' (partitioned by created_at)' if partitioned else ''}...")
+            mycursor.execute(table_ddl(table, partitioned=partitioned))
+            if partitioned:
+                mycursor.execute(id_table_ddl(table))
+            mycursor.execute(embedding_table_ddl(table))
+            mycursor.execute(face_table_ddl(table))
+            logging.info("Tables '%s', '%s_embeddings' and '%s_faces' created or already exist", table, table, table)
         
         # Commit changes
         mydb.commit()
@@ -104,17 +167,17 @@ def create_database_and_tables():
         
         print("Database setup completed successfully!")
         print(f"Database: {db_name}")
-        print("Tables created: users, aadhar")
+        print("Tables created: users, aadhar, users_embeddings, aadhar_embeddings, users_faces, aadhar_faces")
         logging.info("Database setup completed successfully")
         return True
         
     except mysql.connector.Error as err:
         print(f"ERROR: Database error: {err}")
-        logging.error(f"Database error: {err}")
+        logging.error("Database error: %s", err)
         return False
     except Exception as e:
         print(f"ERROR: Unexpected error: {e}")
-        logging.error(f"Unexpected error: {e}")
+        logging.error("Unexpected error: %s", e)
         return False
 
 if __name__ == "__main__":
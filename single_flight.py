@@ -0,0 +1,137 @@
+"""
+Single-flight coalescing of identical concurrent requests.
+
+A double-click on Process, or a client retry, submits the same ID/selfie
+pair while the first copy is still running. SingleFlight runs one call per
+key at a time: the first caller (the leader) computes, later callers with
+the same key wait for the leader's Future and get the same result or
+exception, up to a wait timeout.
+
+    flights = SingleFlight(timeout=120)
+    result = flights.do(("insert", table, record_id), insert, record)
+
+do() runs the call on the leader's thread. When that thread can be
+interrupted while the work should go on (a Streamlit rerun stops the
+script, not the pipeline), submit() hands the call to an executor instead
+and the flight lives as long as that future, whoever is waiting on it:
+
+    future, leader = flights.submit(("verify", upload_key), executor, run_pipeline, ctx)
+    result = flights.wait(("verify", upload_key), future)
+
+Keys are (kind, ...) tuples; only the kind is logged. A key is dropped
+once its call finishes, so this deduplicates only in-flight work;
+finished results are cached elsewhere (session state, DB). Only Exception
+subclasses are passed on to followers; a leader interrupted by anything
+else (e.g. a control-flow exception) cancels its flight instead.
+"""
+
+import time
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError, CancelledError
+
+
+class SingleFlight:
+    """Key -> in-flight Future; counts leaders, coalesced followers and follower timeouts."""
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced": 0, "timeouts": 0}
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def get(self, key):
+        """The Future of the call in flight for `key`, or None."""
+        with self._lock:
+            return self._calls.get(key)
+
+    def do(self, key, func, *args, timeout=None, **kwargs):
+        """
+        Run func(*args, **kwargs) unless a call with `key` is in flight, in
+        which case wait for and return its result. A follower that waits
+        longer than `timeout` seconds (default: the instance's) gets
+        concurrent.futures.TimeoutError; the leader keeps running.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self._stats["leaders"] += 1
+
+        if not leader:
+            return self._follow(key, future, self.timeout if timeout is None else timeout)
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            future.cancel()  # followers get CancelledError, not the leader's interruption
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def submit(self, key, executor, func, *args, **kwargs):
+        """
+        Return (future, leader): the Future of the call with `key` already in
+        flight (leader False), or of func(*args, **kwargs) newly submitted to
+        `executor` (leader True). The key is dropped when that future
+        completes, not when a waiting thread stops waiting.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = executor.submit(func, *args, **kwargs)
+            self._stats["leaders"] += 1
+        future.add_done_callback(lambda done: self._drop(key, done))
+        return future, True
+
+    def _drop(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def wait(self, key, future, timeout=None):
+        """
+        Wait for an in-flight `future` from submit() or get() and return its
+        result, as a follower (counted, and bounded by `timeout`, default the
+        instance's).
+        """
+        return self._follow(key, future, self.timeout if timeout is None else timeout)
+
+    def _follow(self, key, future, timeout):
+        start = time.perf_counter()
+        try:
+            error = future.exception(timeout)  # waits; the leader's exception is re-raised below
+        except TimeoutError:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            logging.warning("Coalesced request timed out after %ss waiting for %s", timeout, key[0])
+            raise
+        if error is not None and not isinstance(error, Exception):
+            raise CancelledError(f"In-flight {key[0]} call was interrupted")
+        with self._lock:
+            self._stats["coalesced"] += 1
+            stats = dict(self._stats)
+        logging.info("Coalesced identical in-flight request (%s, waited %.2fs): %s",
+                     key[0], time.perf_counter() - start, stats)
+        return future.result()
+
+    def stats(self):
+        """Counters since start, plus the share of calls served by an in-flight leader."""
+        with self._lock:
+            stats = dict(self._stats)
+        calls = stats["leaders"] + stats["coalesced"] + stats["timeouts"]
+        stats["coalesced_rate"] = stats["coalesced"] / calls if calls else 0.0
+        return stats
@@ -1,197 +1,358 @@
-import mysql.connector
 import pandas as pd
 import logging
 import os
-from dotenv import load_dotenv
+import time
+import atexit
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from embedding_store import get_store
+from logging_config import setup_logging
+from utils import read_yaml
+from embedding_versions import CURRENT_EMBEDDING_VERSION, LEGACY_EMBEDDING_VERSION, prefer
+from storage import (  # noqa: F401  (re-exported for export_records / migrate_database)
+    get_backend,
+    get_connection,
+    id_to_bytes,
+    embedding_to_bytes,
+    parse_embedding,
+    embedding_version_of,
+)
 
 # ---------------------------------------
 # Logging configuration
 # ---------------------------------------
-logging_str = "[%(asctime)s: %(levelname)s: %(module)s]: %(message)s"
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-logging.basicConfig(
-    filename=os.path.join(log_dir, "ekyc_logs.log"),
-    level=logging.INFO,
-    format=logging_str,
-    filemode="a",
-)
+setup_logging()
+
+config_path = "config.yaml"
+runtime = read_yaml(config_path).get('runtime', {})
+WRITE_BEHIND = str(os.getenv("WRITE_BEHIND", runtime.get('WRITE_BEHIND', False))).lower() in ("1", "true", "yes")
+WRITE_BATCH_SIZE = int(runtime.get('WRITE_BATCH_SIZE', 200))
+WRITE_FLUSH_INTERVAL_MS = int(runtime.get('WRITE_FLUSH_INTERVAL_MS', 50))
+
 
 # ---------------------------------------
-# Load environment variables from .env
+# Embedding store mirror
 # ---------------------------------------
-load_dotenv()
+def store_name(table, version):
+    """Memory-mapped store of one table and embedding version (pre-versioning stores are the legacy ones)."""
+    if version == LEGACY_EMBEDDING_VERSION:
+        return table
+    return f"{table}@{version.replace('/', '_')}"
+
 
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_NAME = os.getenv("DB_NAME", "ekyc")
+def append_embedding(table, text_info):
+    """Mirror a freshly inserted embedding into the memory-mapped store for `table`."""
+    append_embeddings(table, [text_info])
+
+
+def append_embeddings(table, records):
+    """Batch version of append_embedding for rows committed together."""
+    by_version = {}
+    for record in records:
+        if record.get("Embedding") is not None:
+            by_version.setdefault(embedding_version_of(record), []).append(record)
+    for version, records in by_version.items():
+        for record in records:
+            _cache_embedding(table, record.get("ID"), record.get("Embedding"), version)
+        try:
+            get_store(store_name(table, version)).append_many(
+                [r.get("ID") for r in records], [r.get("Embedding") for r in records])
+        except Exception as e:
+            logging.error("❌ Error appending embeddings to '%s' store: %s", table, e)
 
-if not DB_USER or not DB_PASSWORD:
-    logging.error("Database user or password not found in .env file.")
-    raise ValueError("Database user or password not found in .env file")
 
 # ---------------------------------------
-# Connection helper
+# Stored embedding lookup (LRU -> embedding store -> DB)
 # ---------------------------------------
-def get_connection():
-    """Establish and return a new MySQL connection."""
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
+
+def _cache_embedding(table, record_id, embedding, version):
+    with _embedding_cache_lock:
+        _embedding_cache[(table, record_id)] = (embedding, version)
+        _embedding_cache.move_to_end((table, record_id))
+        while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+
+
+def fetch_embedding(table, record_id):
+    """
+    Return (embedding, model_version) of the stored enrollment embedding for
+    a hashed ID, or (None, None). Records not re-embedded yet return their
+    older version (dual-read, see embedding_versions.prefer).
+    Checks the in-process LRU first, then the memory-mapped store of the
+    current version, then falls back to the storage backend.
+    """
+    key = (table, record_id)
+    with _embedding_cache_lock:
+        if key in _embedding_cache:
+            _embedding_cache.move_to_end(key)
+            return _embedding_cache[key]
+
+    embedding, version = None, None
+    try:
+        stored = get_store(store_name(table, CURRENT_EMBEDDING_VERSION)).get(record_id)
+        if stored is not None:
+            embedding, version = stored.tolist(), CURRENT_EMBEDDING_VERSION
+    except Exception as e:
+        logging.error("❌ Error reading embedding store for '%s': %s", table, e)
+
+    if embedding is None:
+        embedding, version = fetch_embedding_from_db(table, record_id)
+
+    if embedding is not None:
+        _cache_embedding(table, record_id, embedding, version)
+    return embedding, version
+
+
+def fetch_embedding_from_db(table, record_id):
+    """Read a record's preferred (embedding, model_version) from the storage backend."""
+    try:
+        version, embedding = prefer(get_backend().fetch_embeddings(table, record_id))
+        return embedding, version
+    except Exception as e:
+        logging.error("❌ Error fetching embedding from '%s' backend: %s", table, e)
+        return None, None
+
+
+def upgrade_embedding(table, record_id, embedding, face=None, version=CURRENT_EMBEDDING_VERSION):
+    """
+    Store a `version` embedding (and the face it came from) for an existing
+    record next to its older one, e.g. after a returning user verified
+    against a pre-migration embedding. Returns True on success.
+    """
     try:
-        conn = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-        )
-        logging.info("✅ Database connection established successfully.")
-        return conn
-    except mysql.connector.Error as err:
-        logging.error(f"❌ Database connection failed: {err}")
-        raise
+        backend = get_backend()
+        backend.put_embeddings(table, version, [record_id], [embedding])
+        if face:
+            backend.put_face(table, record_id, face)
+    except Exception as e:
+        logging.error("❌ Error upgrading embedding in '%s' to %s: %s", table, version, e)
+        return False
+    append_embeddings(table, [{"ID": record_id, "Embedding": embedding, "Embedding Version": version}])
+    logging.info("Embedding upgraded to %s in '%s'.", version, table)
+    return True
+
+
+# ---------------------------------------
+# Write-behind buffer
+# ---------------------------------------
+class WriteBehindBuffer:
+    """
+    Collects enrollment rows and writes them with one insert_many
+    (executemany, single transaction) per table once `max_rows` are queued or
+    the oldest row has waited `flush_interval_ms`.
+
+    submit() returns a Future that resolves to True once the row is committed,
+    or to that row's exception, so each request learns its own outcome.
+    Callers that block on the result pass wait=True: the writer then flushes
+    as soon as it is free, and rows arriving during that flush form the next
+    batch (group commit), instead of every caller sleeping out the interval.
+    Flush hooks run after every flush with (table, records, errors), e.g. to
+    fsync an audit log or publish metrics. close() flushes synchronously and
+    is registered at exit.
+    """
+
+    def __init__(self, max_rows=WRITE_BATCH_SIZE, flush_interval_ms=WRITE_FLUSH_INTERVAL_MS):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.flush_hooks = []
+        self._pending = []  # (table, record, future)
+        self._oldest = None
+        self._urgent = False
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def add_flush_hook(self, hook):
+        self.flush_hooks.append(hook)
+
+    def submit(self, table, record, wait=False):
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write-behind buffer is closed")
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((table, record, future))
+            self._urgent = self._urgent or wait
+            # Wake the writer to start the interval timer, or to flush now
+            if wait or len(self._pending) == 1 or len(self._pending) >= self.max_rows:
+                self._cond.notify()
+        return future
+
+    def is_pending(self, table, record_id):
+        with self._cond:
+            return any(t == table and r.get("ID") == record_id for t, r, _ in self._pending)
+
+    def _take(self):
+        with self._cond:
+            batch, self._pending, self._oldest, self._urgent = self._pending, [], None, False
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._urgent or len(self._pending) >= self.max_rows:
+                        break
+                    if self._pending and time.monotonic() - self._oldest >= self.flush_interval:
+                        break
+                    timeout = None
+                    if self._pending:
+                        timeout = self.flush_interval - (time.monotonic() - self._oldest)
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        """Write everything queued so far; safe to call from any thread."""
+        with self._flush_lock:
+            batch = self._take()
+            by_table = {}
+            for table, record, future in batch:
+                by_table.setdefault(table, []).append((record, future))
+            for table, items in by_table.items():
+                records = [record for record, _ in items]
+                try:
+                    errors = get_backend().insert_many(table, records)
+                except Exception as e:
+                    errors = [e] * len(records)
+                for (record, future), error in zip(items, errors):
+                    if error is None:
+                        future.set_result(True)
+                    else:
+                        logging.error("❌ Error inserting record into '%s' table: %s", table, error)
+                        future.set_exception(error)
+                append_embeddings(table, [r for r, e in zip(records, errors) if e is None])
+                logging.info("Write-behind flush: %s/%s rows committed to '%s'",
+                             errors.count(None), len(records), table)
+                for hook in self.flush_hooks:
+                    try:
+                        hook(table, records, errors)
+                    except Exception as e:
+                        logging.error("Write-behind flush hook failed: %s", e)
+
+    def close(self):
+        """Stop the background thread and flush what is left."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+
+_write_buffer = None
+_write_buffer_lock = threading.Lock()
+
+
+def get_write_buffer():
+    """Process-wide write-behind buffer, flushed at interpreter exit."""
+    global _write_buffer
+    with _write_buffer_lock:
+        if _write_buffer is None:
+            _write_buffer = WriteBehindBuffer()
+            atexit.register(_write_buffer.close)
+        return _write_buffer
 
 
 # ---------------------------------------
 # Insert Records
 # ---------------------------------------
-def insert_records(text_info):
-    """Insert PAN user record into users table."""
+def submit_record(table, text_info, wait=False):
+    """Queue a record on the write-behind buffer; returns a Future (True or the row's exception)."""
+    return get_write_buffer().submit(table, text_info, wait=wait)
+
+
+def _insert(table, text_info):
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        sql = """
-            INSERT INTO users (id, name, father_name, dob, id_type, embedding)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        values = (
-            text_info.get("ID"),
-            text_info.get("Name"),
-            text_info.get("Father's Name"),
-            text_info.get("DOB"),
-            text_info.get("ID Type"),
-            str(text_info.get("Embedding")),
-        )
-        cursor.execute(sql, values)
-        conn.commit()
-        logging.info("✅ Record inserted successfully into 'users' table.")
+        if WRITE_BEHIND:
+            # Blocks until the batch containing this row commits (group commit)
+            submit_record(table, text_info, wait=True).result()
+        else:
+            get_backend().insert(table, text_info)
+            append_embedding(table, text_info)
+        logging.info("✅ Record inserted successfully into '%s' table.", table)
+        return True
     except Exception as e:
-        logging.error(f"❌ Error inserting record into 'users' table: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        logging.error("❌ Error inserting record into '%s' table: %s", table, e)
+        return False
+
+
+def insert_records(text_info):
+    """Insert PAN user record into users table. Returns True on success."""
+    return _insert("users", text_info)
 
 
 def insert_records_aadhar(text_info):
-    """Insert Aadhar user record into aadhar table."""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        sql = """
-            INSERT INTO aadhar (id, name, gender, dob, id_type, embedding)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        values = (
-            text_info.get("ID"),
-            text_info.get("Name"),
-            text_info.get("Gender"),
-            text_info.get("DOB"),
-            text_info.get("ID Type"),
-            str(text_info.get("Embedding")),
-        )
-        cursor.execute(sql, values)
-        conn.commit()
-        logging.info("✅ Record inserted successfully into 'aadhar' table.")
-    except Exception as e:
-        logging.error(f"❌ Error inserting record into 'aadhar' table: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+    """Insert Aadhar user record into aadhar table. Returns True on success."""
+    return _insert("aadhar", text_info)
 
 
 # ---------------------------------------
 # Fetch Records
 # ---------------------------------------
-def fetch_records(text_info):
-    """Fetch record from users table by ID."""
+def _fetch(table, text_info):
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        sql = "SELECT * FROM users WHERE id = %s"
-        cursor.execute(sql, (text_info.get("ID"),))
-        result = cursor.fetchall()
-        if result:
-            df = pd.DataFrame(result, columns=[desc[0] for desc in cursor.description])
-            logging.info("✅ Record fetched successfully from 'users' table.")
-            return df
-        else:
-            logging.info("No record found in 'users' table.")
-            return pd.DataFrame()
+        row = get_backend().fetch(table, text_info.get("ID"))
+        if row:
+            logging.info("✅ Record fetched successfully from '%s' table.", table)
+            return pd.DataFrame([row])
+        logging.info("No record found in '%s' table.", table)
+        return pd.DataFrame()
     except Exception as e:
-        logging.error(f"❌ Error fetching record from 'users': {e}")
+        logging.error("❌ Error fetching record from '%s': %s", table, e)
         return pd.DataFrame()
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+
+
+def fetch_records(text_info):
+    """Fetch record from users table by ID."""
+    return _fetch("users", text_info)
 
 
 def fetch_records_aadhar(text_info):
     """Fetch record from aadhar table by ID."""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        sql = "SELECT * FROM aadhar WHERE id = %s"
-        cursor.execute(sql, (text_info.get("ID"),))
-        result = cursor.fetchall()
-        if result:
-            df = pd.DataFrame(result, columns=[desc[0] for desc in cursor.description])
-            logging.info("✅ Record fetched successfully from 'aadhar' table.")
-            return df
-        else:
-            logging.info("No record found in 'aadhar' table.")
-            return pd.DataFrame()
-    except Exception as e:
-        logging.error(f"❌ Error fetching record from 'aadhar': {e}")
-        return pd.DataFrame()
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+    return _fetch("aadhar", text_info)
 
 
 # ---------------------------------------
 # Duplicate Check
 # ---------------------------------------
-def check_duplicacy(text_info):
-    """Check if record already exists in users table."""
+def _check_duplicacy(table, text_info):
     try:
-        df = fetch_records(text_info)
-        if not df.empty:
-            logging.info("⚠️ Duplicate record found in 'users' table.")
+        record_id = text_info.get("ID")
+        if get_backend().exists(table, record_id) or (
+                _write_buffer is not None and _write_buffer.is_pending(table, record_id)):
+            logging.info("⚠️ Duplicate record found in '%s' table.", table)
             return True
-        else:
-            logging.info("✅ No duplicate found in 'users' table.")
-            return False
+        logging.info("✅ No duplicate found in '%s' table.", table)
+        return False
     except Exception as e:
-        logging.error(f"❌ Error checking duplicacy in 'users': {e}")
+        logging.error("❌ Error checking duplicacy in '%s': %s", table, e)
         return False
 
 
+def check_duplicacy(text_info):
+    """Check if record already exists in users table."""
+    return _check_duplicacy("users", text_info)
+
+
 def check_duplicacy_aadhar(text_info):
     """Check if record already exists in aadhar table."""
-    try:
-        df = fetch_records_aadhar(text_info)
-        if not df.empty:
-            logging.info("⚠️ Duplicate record found in 'aadhar' table.")
-            return True
-        else:
-            logging.info("✅ No duplicate found in 'aadhar' table.")
-            return False
-    except Exception as e:
-        logging.error(f"❌ Error checking duplicacy in 'aadhar': {e}")
-        return False
\ No newline at end of file
+    return _check_duplicacy("aadhar", text_info)
+
+
+# ---------------------------------------
+# Embedding scan
+# ---------------------------------------
+def iter_embeddings(table, batch_size=5000, version=CURRENT_EMBEDDING_VERSION):
+    """Yield (hashed ids, float32 matrix) batches of every `version` embedding in `table`."""
+    return get_backend().iter_embeddings(table, batch_size=batch_size, version=version)
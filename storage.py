@@ -0,0 +1,739 @@
+"""
+Storage backends for enrollment records.
+
+Every backend implements the same small interface over the `users` (PAN)
+and `aadhar` tables: insert, fetch, exists (duplicate check), fetch one
+embedding and scan all embeddings. sql_connection's functions delegate to
+the backend picked by `runtime.STORAGE_BACKEND` in config.yaml (or the
+STORAGE_BACKEND env var):
+
+    mysql   - the production server (credentials from .env)
+    sqlite  - a single file in WAL mode, for single-node edge deployments
+    memory  - process-local dicts, for tests, load tests and benchmarks
+
+Records use the app's field names ("ID", "Name", "Father's Name" /
+"Gender", "DOB", "ID Type", "Embedding", "Embedding Version", "Face"); the
+ID is the hex SHA-256 hash. Embeddings are stored per (id, model_version)
+and the enrollment face crop (JPEG bytes) in <table>_faces, so records can
+be re-embedded when the model changes (see embedding_versions.py).
+"""
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+import numpy as np
+from datetime import datetime
+from dotenv import load_dotenv
+from utils import read_yaml
+from embedding_versions import CURRENT_EMBEDDING_VERSION, LEGACY_EMBEDDING_VERSION, prefer
+
+load_dotenv()
+
+config_path = "config.yaml"
+config = read_yaml(config_path)
+artifacts = config['artifacts']
+runtime = config.get('runtime', {})
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", runtime.get('STORAGE_BACKEND', "mysql"))
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", artifacts.get('SQLITE_DB_PATH', os.path.join("data", "ekyc.sqlite3")))
+
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_NAME = os.getenv("DB_NAME", "ekyc")
+
+# Table-specific column and the record field it holds
+EXTRA_COLUMNS = {
+    "users": ("father_name", "Father's Name"),
+    "aadhar": ("gender", "Gender"),
+}
+
+
+# ---------------------------------------
+# Column encoding
+# ---------------------------------------
+def id_to_bytes(record_id):
+    """Hashed IDs are hex in the app and BINARY(32) in the database."""
+    if isinstance(record_id, (bytes, bytearray)):
+        return bytes(record_id)
+    return bytes.fromhex(record_id)
+
+
+def embedding_to_bytes(embedding):
+    """Embeddings are stored as raw float32 bytes in <table>_embeddings."""
+    if embedding is None:
+        return None
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def parse_embedding(value):
+    """
+    Decode an `embedding` column value: raw float32 bytes from
+    <table>_embeddings, or str(list) text from the pre-migration schema.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        if not value.lstrip().startswith((b"[", b"N")):
+            return np.frombuffer(bytes(value), dtype=np.float32).tolist()
+        value = value.decode()
+    if isinstance(value, str):
+        if value.strip() in ("", "None"):
+            return None
+        return json.loads(value)
+    return list(value)
+
+
+def embedding_version_of(record):
+    """Version label of a record's embedding; unlabelled embeddings are taken as made by the current code."""
+    return record.get("Embedding Version") or CURRENT_EMBEDDING_VERSION
+
+
+def _check_table(table):
+    if table not in EXTRA_COLUMNS:
+        raise ValueError(f"Unknown table: {table}")
+
+
+# ---------------------------------------
+# Interface
+# ---------------------------------------
+class StorageBackend:
+    """Interface shared by all backends. Methods raise on failure; callers decide how to report it."""
+
+    name = "base"
+
+    def insert(self, table, record):
+        """Insert one record with its embedding and enrollment face atomically."""
+        raise NotImplementedError
+
+    def insert_many(self, table, records):
+        """
+        Insert a batch; returns one entry per record: None on success or the
+        exception that row raised. The default inserts row by row.
+        """
+        errors = []
+        for record in records:
+            try:
+                self.insert(table, record)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    def fetch(self, table, record_id):
+        """Return the record row as a dict (column names as keys), or None."""
+        raise NotImplementedError
+
+    def exists(self, table, record_id):
+        return self.fetch(table, record_id) is not None
+
+    def fetch_embeddings(self, table, record_id):
+        """Return every stored embedding of a record as {model_version: list of floats}."""
+        raise NotImplementedError
+
+    def fetch_embedding(self, table, record_id):
+        """Return the preferred stored embedding (see embedding_versions.prefer) as a list of floats, or None."""
+        return prefer(self.fetch_embeddings(table, record_id))[1]
+
+    def iter_embeddings(self, table, batch_size=5000, version=CURRENT_EMBEDDING_VERSION):
+        """Yield (ids, float32 matrix) batches over every stored embedding of `version`."""
+        raise NotImplementedError
+
+    def iter_records(self, table, batch_size=5000):
+        """Yield (id, name, dob) for every record; used to build in-memory indexes."""
+        raise NotImplementedError
+
+    def iter_export(self, table, since=None, until=None, version=CURRENT_EMBEDDING_VERSION, chunk_size=5000):
+        """
+        Yield (columns, rows) chunks of full records ordered by created_at, with
+        an `embedding` column holding their `version` embedding (None if they
+        have none); `since` / `until` bound created_at (inclusive / exclusive).
+        """
+        raise NotImplementedError
+
+    # Versioning / re-embedding
+    def put_embeddings(self, table, version, record_ids, embeddings):
+        """Insert or replace the `version` embedding of existing records."""
+        raise NotImplementedError
+
+    def put_face(self, table, record_id, face):
+        """Insert or replace a record's enrollment face crop (JPEG bytes)."""
+        raise NotImplementedError
+
+    def iter_missing_embeddings(self, table, version, batch_size=500):
+        """Yield [(id, face bytes)] batches of records with a stored face but no `version` embedding."""
+        raise NotImplementedError
+
+    def count_missing_embeddings(self, table, version):
+        raise NotImplementedError
+
+    def embedding_version_counts(self, table):
+        """{model_version: number of embeddings}."""
+        raise NotImplementedError
+
+    def prune_embeddings(self, table, version, superseded_by=CURRENT_EMBEDDING_VERSION, batch_size=1000):
+        """
+        Delete `version` embeddings of records that also have a `superseded_by`
+        one; records not migrated yet keep theirs. Returns the number deleted.
+        """
+        raise NotImplementedError
+
+
+# ---------------------------------------
+# MySQL
+# ---------------------------------------
+def get_connection():
+    """Establish and return a new MySQL connection."""
+    import mysql.connector
+
+    if not DB_USER or not DB_PASSWORD:
+        logging.error("Database user or password not found in .env file.")
+        raise ValueError("Database user or password not found in .env file")
+    try:
+        conn = mysql.connector.connect(
+            host=DB_HOST,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            database=DB_NAME,
+        )
+        logging.info("✅ Database connection established successfully.")
+        return conn
+    except mysql.connector.Error as err:
+        logging.error("❌ Database connection failed: %s", err)
+        raise
+
+
+class MySQLStorage(StorageBackend):
+    """The schema created by setup_database.py; one connection per call, as before."""
+
+    name = "mysql"
+    placeholder = "%s"
+
+    def connect(self):
+        return get_connection()
+
+    def _run(self, func):
+        conn = cursor = None
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            return func(conn, cursor)
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+    def _id_param(self, record_id):
+        return id_to_bytes(record_id)
+
+    def _id_table(self, table):
+        """
+        `<table>_ids` if it exists (partitioned tables, see setup_database.py),
+        else None. Looked up once per table and process.
+        """
+        known = self.__dict__.setdefault("_id_tables", {})
+        if table not in known:
+            def work(conn, cursor):
+                cursor.execute("SHOW TABLES LIKE %s", (f"{table}_ids",))
+                return cursor.fetchone() is not None
+            known[table] = f"{table}_ids" if self._run(work) else None
+        return known[table]
+
+    def _insert_sql(self, table):
+        column, _ = EXTRA_COLUMNS[table]
+        p = self.placeholder
+        return (
+            f"INSERT INTO {table} (id, name, {column}, dob, id_type) VALUES ({p}, {p}, {p}, {p}, {p})",
+            f"INSERT INTO {table}_embeddings (id, model_version, embedding) VALUES ({p}, {p}, {p})",
+            f"INSERT INTO {table}_faces (id, face) VALUES ({p}, {p})",
+        )
+
+    def _upsert_sql(self, table, columns):
+        """INSERT of (id, *columns) that replaces the last column (the value) of an existing row."""
+        p = self.placeholder
+        value = columns[-1]
+        return (f"INSERT INTO {table} (id, {', '.join(columns)}) VALUES ({', '.join([p] * (len(columns) + 1))}) "
+                f"ON DUPLICATE KEY UPDATE {value} = VALUES({value})")
+
+    def _insert_params(self, table, record):
+        _, field = EXTRA_COLUMNS[table]
+        record_id = self._id_param(record.get("ID"))
+        face = record.get("Face")
+        return (
+            (record_id, record.get("Name"), record.get(field), record.get("DOB"), record.get("ID Type")),
+            (record_id, embedding_version_of(record), embedding_to_bytes(record.get("Embedding"))),
+            (record_id, face) if face else None,
+        )
+
+    def insert(self, table, record):
+        _check_table(table)
+        row_sql, embedding_sql, face_sql = self._insert_sql(table)
+        row, embedding, face = self._insert_params(table, record)
+        id_table = self._id_table(table)
+
+        def work(conn, cursor):
+            if id_table:
+                # A partitioned table cannot enforce a unique id itself; the registry's primary key does
+                cursor.execute(f"INSERT INTO {id_table} (id) VALUES ({self.placeholder})", (row[0],))
+            cursor.execute(row_sql, row)
+            # Embedding and face go to the side tables in the same transaction
+            cursor.execute(embedding_sql, embedding)
+            if face:
+                cursor.execute(face_sql, face)
+            conn.commit()
+        self._run(work)
+
+    def insert_many(self, table, records):
+        """
+        One executemany per table in a single transaction. If the batch fails
+        (e.g. one duplicate ID), it is rolled back and retried row by row so
+        each record gets its own error.
+        """
+        _check_table(table)
+        row_sql, embedding_sql, face_sql = self._insert_sql(table)
+        id_table = self._id_table(table)
+
+        def work(conn, cursor):
+            params = [self._insert_params(table, record) for record in records]
+            try:
+                if id_table:
+                    cursor.executemany(f"INSERT INTO {id_table} (id) VALUES ({self.placeholder})",
+                                       [(row[0],) for row, _, _ in params])
+                cursor.executemany(row_sql, [row for row, _, _ in params])
+                cursor.executemany(embedding_sql, [embedding for _, embedding, _ in params])
+                faces = [face for _, _, face in params if face]
+                if faces:
+                    cursor.executemany(face_sql, faces)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        try:
+            self._run(work)
+            return [None] * len(records)
+        except Exception as e:
+            logging.warning("Batch insert into '%s' failed (%s); retrying %s rows individually",
+                            table, e, len(records))
+            return super().insert_many(table, records)
+
+    def fetch(self, table, record_id):
+        _check_table(table)
+        column, _ = EXTRA_COLUMNS[table]
+
+        def work(conn, cursor):
+            cursor.execute(
+                f"SELECT id, name, {column}, dob, id_type, created_at FROM {table} WHERE id = {self.placeholder}",
+                (self._id_param(record_id),),
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            result = dict(zip([desc[0] for desc in cursor.description], row))
+            result["id"] = bytes(result["id"]).hex()
+            return result
+        return self._run(work)
+
+    def fetch_embeddings(self, table, record_id):
+        _check_table(table)
+
+        def work(conn, cursor):
+            cursor.execute(f"SELECT model_version, embedding FROM {table}_embeddings WHERE id = {self.placeholder}",
+                           (self._id_param(record_id),))
+            rows = [(version, parse_embedding(value)) for version, value in cursor.fetchall()]
+            return {version: embedding for version, embedding in rows if embedding is not None}
+        return self._run(work)
+
+    def iter_embeddings(self, table, batch_size=5000, version=CURRENT_EMBEDDING_VERSION):
+        _check_table(table)
+        p = self.placeholder
+        sql = (f"SELECT id, embedding FROM {table}_embeddings WHERE model_version = {p} AND id > {p} "
+               f"ORDER BY id LIMIT {int(batch_size)}")
+        last_id = b""
+        while True:
+            # Keyset pagination: each batch is its own short query
+            def work(conn, cursor):
+                cursor.execute(sql, (version, last_id))
+                return cursor.fetchall()
+            rows = self._run(work)
+            if not rows:
+                return
+            last_id = bytes(rows[-1][0])
+            rows = [(bytes(i).hex(), parse_embedding(e)) for i, e in rows]
+            rows = [(i, e) for i, e in rows if e is not None]
+            if rows:
+                yield [i for i, _ in rows], np.asarray([e for _, e in rows], dtype=np.float32)
+
+    def iter_records(self, table, batch_size=5000):
+        _check_table(table)
+        sql = (f"SELECT id, name, dob FROM {table} WHERE id > {self.placeholder} "
+               f"ORDER BY id LIMIT {int(batch_size)}")
+        last_id = b""
+        while True:
+            def work(conn, cursor):
+                cursor.execute(sql, (last_id,))
+                return cursor.fetchall()
+            rows = self._run(work)
+            if not rows:
+                return
+            last_id = bytes(rows[-1][0])
+            for record_id, name, dob in rows:
+                yield bytes(record_id).hex(), name, dob
+
+    def _export_query(self, table, since, until, version):
+        _check_table(table)
+        p = self.placeholder
+        # One embedding version per export; records not re-embedded yet export without one
+        sql = (f"SELECT t.*, e.embedding FROM {table} t LEFT JOIN {table}_embeddings e "
+               f"ON e.id = t.id AND e.model_version = {p}")
+        conditions, params = [], [version]
+        if since is not None:
+            conditions.append(f"t.created_at >= {p}")
+            params.append(since)
+        if until is not None:
+            conditions.append(f"t.created_at < {p}")
+            params.append(until)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return sql + " ORDER BY t.created_at", tuple(params)
+
+    def _stream(self, cursor, sql, params, chunk_size):
+        cursor.execute(sql, params)
+        columns = [desc[0] for desc in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield columns, rows
+
+    def iter_export(self, table, since=None, until=None, version=CURRENT_EMBEDDING_VERSION, chunk_size=5000):
+        sql, params = self._export_query(table, since, until, version)
+        conn = self.connect()
+        # Unbuffered: the server streams rows as they are fetched
+        cursor = conn.cursor(buffered=False)
+        try:
+            yield from self._stream(cursor, sql, params, chunk_size)
+        finally:
+            cursor.close()
+            conn.close()
+
+    def put_embeddings(self, table, version, record_ids, embeddings):
+        _check_table(table)
+        sql = self._upsert_sql(f"{table}_embeddings", ("model_version", "embedding"))
+        params = [(self._id_param(i), version, embedding_to_bytes(e)) for i, e in zip(record_ids, embeddings)]
+
+        def work(conn, cursor):
+            cursor.executemany(sql, params)
+            conn.commit()
+        self._run(work)
+
+    def put_face(self, table, record_id, face):
+        _check_table(table)
+        sql = self._upsert_sql(f"{table}_faces", ("face",))
+
+        def work(conn, cursor):
+            cursor.execute(sql, (self._id_param(record_id), face))
+            conn.commit()
+        self._run(work)
+
+    def _missing_sql(self, table, select):
+        p = self.placeholder
+        return (f"SELECT {select} FROM {table}_faces f LEFT JOIN {table}_embeddings e "
+                f"ON e.id = f.id AND e.model_version = {p} WHERE e.id IS NULL")
+
+    def iter_missing_embeddings(self, table, version, batch_size=500):
+        _check_table(table)
+        sql = (self._missing_sql(table, "f.id, f.face") + f" AND f.id > {self.placeholder} "
+               f"ORDER BY f.id LIMIT {int(batch_size)}")
+        last_id = b""
+        while True:
+            def work(conn, cursor):
+                cursor.execute(sql, (version, last_id))
+                return cursor.fetchall()
+            rows = self._run(work)
+            if not rows:
+                return
+            last_id = bytes(rows[-1][0])
+            yield [(bytes(i).hex(), bytes(face) if face is not None else None) for i, face in rows]
+
+    def count_missing_embeddings(self, table, version):
+        _check_table(table)
+
+        def work(conn, cursor):
+            cursor.execute(self._missing_sql(table, "COUNT(*)"), (version,))
+            return int(cursor.fetchone()[0])
+        return self._run(work)
+
+    def embedding_version_counts(self, table):
+        _check_table(table)
+
+        def work(conn, cursor):
+            cursor.execute(f"SELECT model_version, COUNT(*) FROM {table}_embeddings GROUP BY model_version")
+            return {version: int(n) for version, n in cursor.fetchall()}
+        return self._run(work)
+
+    def prune_embeddings(self, table, version, superseded_by=CURRENT_EMBEDDING_VERSION, batch_size=1000):
+        _check_table(table)
+        p = self.placeholder
+        select = (f"SELECT o.id FROM {table}_embeddings o JOIN {table}_embeddings n "
+                  f"ON n.id = o.id AND n.model_version = {p} WHERE o.model_version = {p} LIMIT {int(batch_size)}")
+        delete = f"DELETE FROM {table}_embeddings WHERE id = {p} AND model_version = {p}"
+        deleted = 0
+        while True:
+            # Short transactions, so a live server's inserts are not held up
+            def work(conn, cursor):
+                cursor.execute(select, (superseded_by, version))
+                ids = [row[0] for row in cursor.fetchall()]
+                if ids:
+                    cursor.executemany(delete, [(i, version) for i in ids])
+                    conn.commit()
+                return len(ids)
+            count = self._run(work)
+            if not count:
+                return deleted
+            deleted += count
+
+
+# ---------------------------------------
+# SQLite (WAL)
+# ---------------------------------------
+class SQLiteStorage(MySQLStorage):
+    """
+    Same tables in one SQLite file. WAL mode lets readers run alongside the
+    single writer; each thread gets its own connection.
+    """
+
+    name = "sqlite"
+    placeholder = "?"
+
+    def __init__(self, path=SQLITE_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._create_tables(self._connection())
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_tables(self, conn):
+        for table, (column, _) in EXTRA_COLUMNS.items():
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    id BLOB PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    {column} TEXT,
+                    dob TEXT,
+                    id_type TEXT NOT NULL,
+                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                ) WITHOUT ROWID
+            """)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_created_at ON {table} (created_at)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_dob_name ON {table} (dob, name)")
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table}_embeddings)")]
+            if columns and "model_version" not in columns:
+                # Files from before embedding versioning: the key changes, so rebuild the table
+                conn.execute(f"ALTER TABLE {table}_embeddings RENAME TO {table}_embeddings_unversioned")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table}_embeddings "
+                         "(id BLOB NOT NULL, model_version TEXT NOT NULL, embedding BLOB, "
+                         "PRIMARY KEY (id, model_version)) WITHOUT ROWID")
+            if columns and "model_version" not in columns:
+                conn.execute(f"INSERT INTO {table}_embeddings (id, model_version, embedding) "
+                             f"SELECT id, ?, embedding FROM {table}_embeddings_unversioned",
+                             (LEGACY_EMBEDDING_VERSION,))
+                conn.execute(f"DROP TABLE {table}_embeddings_unversioned")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table}_faces "
+                         "(id BLOB PRIMARY KEY, face BLOB) WITHOUT ROWID")
+        conn.commit()
+
+    def iter_export(self, table, since=None, until=None, version=CURRENT_EMBEDDING_VERSION, chunk_size=5000):
+        sql, params = self._export_query(table, since, until, version)
+        cursor = self._connection().cursor()
+        try:
+            yield from self._stream(cursor, sql, params, chunk_size)
+        finally:
+            cursor.close()
+
+    def _id_table(self, table):
+        return None  # never partitioned: the primary key is the id
+
+    def _upsert_sql(self, table, columns):
+        return f"INSERT OR REPLACE INTO {table} (id, {', '.join(columns)}) VALUES ({', '.join(['?'] * (len(columns) + 1))})"
+
+    def _run(self, func):
+        conn = self._connection()
+        cursor = conn.cursor()
+        try:
+            return func(conn, cursor)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+# ---------------------------------------
+# In-memory
+# ---------------------------------------
+class MemoryStorage(StorageBackend):
+    """Process-local dicts; nothing is persisted."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {table: {} for table in EXTRA_COLUMNS}
+        self._embeddings = {table: {} for table in EXTRA_COLUMNS}  # id -> {model_version: vector}
+        self._faces = {table: {} for table in EXTRA_COLUMNS}
+
+    def insert(self, table, record):
+        _check_table(table)
+        column, field = EXTRA_COLUMNS[table]
+        record_id = record.get("ID")
+        row = {
+            "id": record_id,
+            "name": record.get("Name"),
+            column: record.get(field),
+            "dob": record.get("DOB"),
+            "id_type": record.get("ID Type"),
+            "created_at": datetime.now(),
+        }
+        embedding = record.get("Embedding")
+        with self._lock:
+            if record_id in self._rows[table]:
+                raise KeyError(f"Duplicate entry for id in '{table}'")
+            self._rows[table][record_id] = row
+            if embedding is not None:
+                self._embeddings[table][record_id] = {
+                    embedding_version_of(record): np.asarray(embedding, dtype=np.float32)}
+            if record.get("Face"):
+                self._faces[table][record_id] = record.get("Face")
+
+    def fetch(self, table, record_id):
+        _check_table(table)
+        with self._lock:
+            row = self._rows[table].get(record_id)
+            return dict(row) if row is not None else None
+
+    def exists(self, table, record_id):
+        _check_table(table)
+        return record_id in self._rows[table]
+
+    def fetch_embeddings(self, table, record_id):
+        _check_table(table)
+        with self._lock:
+            versions = dict(self._embeddings[table].get(record_id, {}))
+        return {version: embedding.tolist() for version, embedding in versions.items()}
+
+    def iter_embeddings(self, table, batch_size=5000, version=CURRENT_EMBEDDING_VERSION):
+        _check_table(table)
+        with self._lock:
+            items = [(i, v[version]) for i, v in self._embeddings[table].items() if version in v]
+        for start in range(0, len(items), batch_size):
+            chunk = items[start:start + batch_size]
+            yield [i for i, _ in chunk], np.stack([e for _, e in chunk])
+
+    def iter_records(self, table, batch_size=5000):
+        _check_table(table)
+        with self._lock:
+            rows = [(r["id"], r["name"], r["dob"]) for r in self._rows[table].values()]
+        yield from rows
+
+    def iter_export(self, table, since=None, until=None, version=CURRENT_EMBEDDING_VERSION, chunk_size=5000):
+        _check_table(table)
+        with self._lock:
+            rows = [dict(row, embedding=self._embeddings[table].get(row["id"], {}).get(version))
+                    for row in self._rows[table].values()
+                    if (since is None or str(row["created_at"]) >= str(since))
+                    and (until is None or str(row["created_at"]) < str(until))]
+        rows.sort(key=lambda row: row["created_at"])
+        if not rows:
+            return
+        columns = list(rows[0])
+        for start in range(0, len(rows), chunk_size):
+            yield columns, [tuple(row[c] for c in columns) for row in rows[start:start + chunk_size]]
+
+    def put_embeddings(self, table, version, record_ids, embeddings):
+        _check_table(table)
+        with self._lock:
+            for record_id, embedding in zip(record_ids, embeddings):
+                self._embeddings[table].setdefault(record_id, {})[version] = np.asarray(embedding, dtype=np.float32)
+
+    def put_face(self, table, record_id, face):
+        _check_table(table)
+        with self._lock:
+            self._faces[table][record_id] = face
+
+    def _missing(self, table, version):
+        with self._lock:
+            return sorted((i, face) for i, face in self._faces[table].items()
+                          if version not in self._embeddings[table].get(i, {}))
+
+    def iter_missing_embeddings(self, table, version, batch_size=500):
+        _check_table(table)
+        missing = self._missing(table, version)
+        for start in range(0, len(missing), batch_size):
+            yield missing[start:start + batch_size]
+
+    def count_missing_embeddings(self, table, version):
+        _check_table(table)
+        return len(self._missing(table, version))
+
+    def embedding_version_counts(self, table):
+        _check_table(table)
+        counts = {}
+        with self._lock:
+            for versions in self._embeddings[table].values():
+                for version in versions:
+                    counts[version] = counts.get(version, 0) + 1
+        return counts
+
+    def prune_embeddings(self, table, version, superseded_by=CURRENT_EMBEDDING_VERSION, batch_size=1000):
+        _check_table(table)
+        deleted = 0
+        with self._lock:
+            for versions in self._embeddings[table].values():
+                if version in versions and superseded_by in versions:
+                    del versions[version]
+                    deleted += 1
+        return deleted
+
+
+# ---------------------------------------
+# Selection
+# ---------------------------------------
+BACKENDS = {
+    "mysql": MySQLStorage,
+    "sqlite": SQLiteStorage,
+    "memory": MemoryStorage,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Process-wide backend chosen by STORAGE_BACKEND."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if STORAGE_BACKEND not in BACKENDS:
+                raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND} (expected one of {sorted(BACKENDS)})")
+            _backend = BACKENDS[STORAGE_BACKEND]()
+            logging.info("Storage backend: %s", _backend.name)
+        return _backend
+
+
+def set_backend(backend):
+    """Replace the process-wide backend (benchmarks and tests pass a MemoryStorage)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    return backend
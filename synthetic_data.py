@@ -0,0 +1,383 @@
+"""
+Synthetic PAN / Aadhaar cards and selfies for scale and load testing.
+
+generate renders cards laid out the way postprocess.extract_information /
+extract_information1 read them (labels, name, DOB, a format-valid PAN or a
+Verhoeff-valid Aadhaar number, face crop), photographs them onto a
+background with random rotation, blur, lighting and sensor noise, and
+writes a matching selfie. Every sample gets a ground-truth line in
+<out>/ground_truth.jsonl; --duplicate-rate re-enrolls earlier identities
+to exercise the duplicate-check path. Samples are deterministic per
+(seed, index), so a run can be resumed or sharded with --start.
+
+replay drives the generated set through the system:
+  - pipeline: run_pipeline per sample (threads), optionally check + insert;
+    reports throughput, stage timings and parser accuracy against the truth
+  - db: ground-truth records with seeded embeddings straight into the
+    duplicate check + insert path (no images needed: generate --no-images);
+    reports insert rate, duplicates caught and database growth
+
+    python synthetic_data.py generate --count 1000 --out data/bench/synthetic
+    python synthetic_data.py replay --truth data/bench/synthetic/ground_truth.jsonl --mode pipeline --insert
+    python synthetic_data.py generate --count 1000000 --no-images --out data/bench/synthetic_1m
+    python synthetic_data.py replay --truth data/bench/synthetic_1m/ground_truth.jsonl --mode db --backend sqlite
+"""
+
+import os
+import glob
+import json
+import time
+import random
+import logging
+import argparse
+import cv2
+import numpy as np
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from id_validation import verhoeff_valid, format_aadhaar
+from identity_index import FIRST_NAMES, LAST_NAMES
+from utils import hash_id
+
+CARD_W, CARD_H = 856, 540
+FONT = cv2.FONT_HERSHEY_DUPLEX
+DEFAULT_FACE_IMAGES = [os.path.join("data", "01_raw_data", name)
+                       for name in ("srk1.jpeg", "srk2.webp", "extracted_face.jpg", "extracted_face_0.jpg")]
+EMBEDDING_DIM = 512
+
+
+# ---------------------------------------
+# Identities
+# ---------------------------------------
+def random_pan(rng, surname):
+    """AAAPS9999A: holder type P (person), 5th letter the surname initial."""
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    head = "".join(rng.choice(letters) for _ in range(3))
+    return f"{head}P{surname[0]}{rng.randrange(10000):04d}{rng.choice(letters)}"
+
+
+def random_aadhaar(rng):
+    """12 digits, first in 2-9, last a Verhoeff check digit; formatted 'XXXX XXXX XXXX'."""
+    body = str(rng.randint(2, 9)) + "".join(str(rng.randrange(10)) for _ in range(10))
+    check = next(d for d in "0123456789" if verhoeff_valid(body + d))
+    return format_aadhaar(body + check)
+
+
+def identity(seed, index, aadhaar_share=0.5):
+    """Deterministic identity for sample `index`."""
+    rng = random.Random(seed * 1_000_003 + index)
+    surname = rng.choice(LAST_NAMES)
+    name = f"{rng.choice(FIRST_NAMES)} {surname}"
+    dob = date(1950, 1, 1) + timedelta(days=rng.randrange(20000))
+    record = {"index": index, "Name": name, "DOB": dob.isoformat(), "face": rng.randrange(1 << 30)}
+    if rng.random() < aadhaar_share:
+        record.update({"option": "AADHAR", "ID": random_aadhaar(rng), "Gender": rng.choice(["Male", "Female"]),
+                       "ID Type": "AADHAR"})
+    else:
+        record.update({"option": "PAN", "ID": random_pan(rng, surname),
+                       "Father's Name": f"{rng.choice(FIRST_NAMES)} {surname}", "ID Type": "PAN"})
+    return record
+
+
+def sample_record(seed, index, aadhaar_share, duplicate_rate):
+    """Ground truth for `index`: a new identity, or a re-enrollment of an earlier one."""
+    rng = random.Random(seed * 7_919 + index)
+    if index > 0 and rng.random() < duplicate_rate:
+        # The earlier sample may itself be a re-enrollment: follow it to the first enrollment
+        record = sample_record(seed, rng.randrange(index), aadhaar_share, duplicate_rate)
+        record.update(index=index, duplicate_of=record.get("duplicate_of", record["index"]))
+        return record
+    return identity(seed, index, aadhaar_share)
+
+
+# ---------------------------------------
+# Rendering
+# ---------------------------------------
+_faces = None
+
+
+def load_faces(paths):
+    """Face crops (largest Haar detection, or the whole image) from the given images."""
+    from preprocess import get_face_cascade
+
+    faces = []
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        boxes = get_face_cascade().detectMultiScale(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), 1.2, 5)
+        if len(boxes):
+            x, y, w, h = max(boxes, key=lambda b: b[2] * b[3])
+            pad = int(0.25 * w)
+            img = img[max(0, y - pad):y + h + pad, max(0, x - pad):x + w + pad]
+        faces.append(img)
+    if not faces:
+        raise FileNotFoundError("No readable face images for the synthetic cards")
+    return faces
+
+
+def _init_worker(face_paths):
+    global _faces
+    _faces = load_faces(face_paths)
+
+
+def _text(card, text, x, y, scale=0.9):
+    cv2.putText(card, text, (x, y), FONT, scale, (20, 20, 20), 2, cv2.LINE_AA)
+
+
+def render_card(record, face):
+    """Flat 856x540 card with the fields in the order the parsers expect."""
+    dob = date.fromisoformat(record["DOB"]).strftime("%d/%m/%Y")
+    if record["option"] == "PAN":
+        card = np.full((CARD_H, CARD_W, 3), (235, 215, 190), np.uint8)
+        _text(card, "INCOME TAX DEPARTMENT", 40, 60, 1.0)
+        _text(card, "GOVT OF INDIA", 560, 60, 0.8)
+        _text(card, "Permanent Account Number Card", 40, 120)
+        _text(card, record["ID"], 40, 170, 1.1)
+        _text(card, "Name", 40, 240, 0.7)
+        _text(card, record["Name"].upper(), 40, 280)
+        _text(card, "Father's Name", 40, 340, 0.7)
+        _text(card, record["Father's Name"].upper(), 40, 380)
+        _text(card, dob, 40, 450)
+        face_box = (600, 180, 200, 240)
+    else:
+        card = np.full((CARD_H, CARD_W, 3), (245, 245, 245), np.uint8)
+        cv2.rectangle(card, (0, 0), (CARD_W, 70), (40, 120, 240), -1)
+        _text(card, "Government of India", 260, 48, 1.0)
+        _text(card, record["Name"], 300, 170)
+        _text(card, "DOB", 300, 230)
+        _text(card, dob, 400, 230)
+        _text(card, record["Gender"], 300, 290)
+        _text(card, record["ID"], 260, 470, 1.3)
+        face_box = (40, 110, 210, 260)
+    x, y, w, h = face_box
+    card[y:y + h, x:x + w] = cv2.resize(face, (w, h), interpolation=cv2.INTER_AREA)
+    cv2.rectangle(card, (2, 2), (CARD_W - 3, CARD_H - 3), (90, 90, 90), 2)
+    return card
+
+
+def photograph(img, rng, rotation, blur, noise, background=(1280, 960)):
+    """Place `img` on a background with rotation, lighting change, blur and noise; returns (photo, params)."""
+    angle = rng.uniform(-rotation, rotation)
+    alpha, beta = rng.uniform(0.7, 1.3), rng.uniform(-40, 40)
+    ksize = rng.choice([k for k in (1, 3, 5, 7) if k <= max(1, blur)])
+    sigma = rng.uniform(0, noise)
+
+    bw, bh = background
+    photo = np.full((bh, bw, 3), rng.randrange(20, 90), np.uint8)
+    h, w = img.shape[:2]
+    x0, y0 = (bw - w) // 2, (bh - h) // 2
+    photo[y0:y0 + h, x0:x0 + w] = img
+    m = cv2.getRotationMatrix2D((bw / 2, bh / 2), angle, 1.0)
+    photo = cv2.warpAffine(photo, m, (bw, bh), borderValue=tuple(int(v) for v in photo[0, 0]))
+    photo = cv2.convertScaleAbs(photo, alpha=alpha, beta=beta)
+    if ksize > 1:
+        photo = cv2.GaussianBlur(photo, (ksize, ksize), 0)
+    if sigma > 0:
+        noise_img = np.random.default_rng(rng.randrange(1 << 30)).normal(0, sigma, photo.shape)
+        photo = np.clip(photo + noise_img, 0, 255).astype(np.uint8)
+    return photo, {"angle": round(angle, 2), "alpha": round(alpha, 3), "beta": round(beta, 1),
+                   "blur": ksize, "noise": round(sigma, 2)}
+
+
+def selfie(face, rng):
+    """A different 'capture' of the same face: flip, scale, lighting, small tilt."""
+    img = cv2.flip(face, 1) if rng.random() < 0.5 else face
+    img = cv2.resize(img, (480, int(480 * img.shape[0] / img.shape[1])))
+    m = cv2.getRotationMatrix2D((img.shape[1] / 2, img.shape[0] / 2), rng.uniform(-8, 8), 1.0)
+    img = cv2.warpAffine(img, m, (img.shape[1], img.shape[0]), borderMode=cv2.BORDER_REPLICATE)
+    return cv2.convertScaleAbs(img, alpha=rng.uniform(0.8, 1.2), beta=rng.uniform(-25, 25))
+
+
+def _generate_chunk(args):
+    start, stop, opts = args
+    lines = []
+    for index in range(start, stop):
+        record = sample_record(opts["seed"], index, opts["aadhaar_share"], opts["duplicate_rate"])
+        if opts["images"]:
+            rng = random.Random(opts["seed"] * 104_729 + index)
+            face = _faces[record["face"] % len(_faces)]
+            photo, params = photograph(render_card(record, face), rng, opts["rotation"], opts["blur"], opts["noise"])
+            stem = os.path.join(opts["out"], "images", f"{index:07d}")
+            cv2.imwrite(stem + "_id.jpg", photo, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            cv2.imwrite(stem + "_selfie.jpg", selfie(face, rng), [cv2.IMWRITE_JPEG_QUALITY, 90])
+            record.update(id_image=stem + "_id.jpg", selfie_image=stem + "_selfie.jpg", augment=params)
+        lines.append(json.dumps(record))
+    return lines
+
+
+def generate(count, out, start=0, seed=0, aadhaar_share=0.5, duplicate_rate=0.02, rotation=8.0, blur=5,
+             noise=6.0, images=True, face_paths=None, workers=None, chunk=500):
+    """Render samples [start, start + count) into `out` and append their ground truth."""
+    face_paths = face_paths or [p for p in DEFAULT_FACE_IMAGES if os.path.exists(p)]
+    os.makedirs(os.path.join(out, "images"), exist_ok=True)
+    opts = {"seed": seed, "aadhaar_share": aadhaar_share, "duplicate_rate": duplicate_rate, "rotation": rotation,
+            "blur": blur, "noise": noise, "images": images, "out": out}
+    chunks = [(i, min(i + chunk, start + count), opts) for i in range(start, start + count, chunk)]
+    truth_path = os.path.join(out, "ground_truth.jsonl")
+    begin = time.perf_counter()
+    init = dict(initializer=_init_worker, initargs=(face_paths,)) if images else {}
+    with open(truth_path, "a") as f, ProcessPoolExecutor(max_workers=workers, **init) as pool:
+        for done, lines in enumerate(pool.map(_generate_chunk, chunks), 1):
+            f.write("\n".join(lines) + "\n")
+            if done % 20 == 0 or done == len(chunks):
+                print(f"{min(done * chunk, count)}/{count} samples, {time.perf_counter() - begin:.1f}s")
+    return truth_path
+
+
+# ---------------------------------------
+# Replay
+# ---------------------------------------
+def load_truth(path, limit=None):
+    records = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+                if limit and len(records) >= limit:
+                    break
+    return records
+
+
+def seeded_embedding(record):
+    """Stand-in face embedding: one unit vector per source face, so re-enrollments match."""
+    vec = np.random.default_rng(record["face"]).normal(size=EMBEDDING_DIM).astype(np.float32)
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+def text_info_for(record):
+    """The record the pipeline would produce for this sample (ID hashed, DOB ISO)."""
+    info = {"ID": hash_id(record["ID"]), "Name": record["Name"], "DOB": record["DOB"], "ID Type": record["ID Type"]}
+    info.update({k: record[k] for k in ("Father's Name", "Gender") if k in record})
+    return info
+
+
+def _enroll(record, text_info):
+    """Duplicate check + insert through sql_connection; returns 'duplicate', 'inserted' or 'failed'."""
+    from sql_connection import check_duplicacy, check_duplicacy_aadhar, insert_records, insert_records_aadhar
+
+    pan = record["option"] == "PAN"
+    if (check_duplicacy if pan else check_duplicacy_aadhar)(text_info):
+        return "duplicate"
+    return "inserted" if (insert_records if pan else insert_records_aadhar)(text_info) else "failed"
+
+
+def _database_size():
+    from storage import get_backend
+
+    backend = get_backend()
+    path = getattr(backend, "path", None)
+    if not path or path == ":memory:":
+        return None
+    return sum(os.path.getsize(p) for p in glob.glob(path + "*"))
+
+
+def replay_db(records, workers=4, report_every=10000):
+    """Enroll ground-truth records without images; reports insert rate, duplicates and DB growth."""
+    counts = {"inserted": 0, "duplicate": 0, "failed": 0}
+    expected_duplicates = sum(1 for r in records if "duplicate_of" in r)
+    start = time.perf_counter()
+
+    def enroll(record):
+        info = text_info_for(record)
+        info["Embedding"] = seeded_embedding(record)
+        return _enroll(record, info)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for done, outcome in enumerate(pool.map(enroll, records), 1):
+            counts[outcome] += 1
+            if done % report_every == 0 or done == len(records):
+                elapsed = time.perf_counter() - start
+                size = _database_size()
+                print(f"{done} records, {done / elapsed:.0f}/s, {counts}"
+                      + (f", db {size / 1e6:.1f} MB" if size is not None else ""))
+    print(f"duplicates caught: {counts['duplicate']} of {expected_duplicates} re-enrollments")
+    return counts
+
+
+def replay_pipeline(records, workers=4, insert=False):
+    """Run every sample through run_pipeline; reports throughput, stage timings and field accuracy."""
+    from pipeline import VerificationContext, run_pipeline
+
+    records = [r for r in records if "id_image" in r]
+    errors, correct, timings, outcomes = {}, {"ID": 0, "Name": 0, "DOB": 0}, {}, {}
+
+    def run(record):
+        ctx = VerificationContext(record["option"], id_image=cv2.imread(record["id_image"]),
+                                  selfie_image=cv2.imread(record["selfie_image"]))
+        ctx = run_pipeline(ctx)
+        outcome = _enroll(record, ctx.fields) if insert and ctx.error is None else None
+        return record, ctx, outcome
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for record, ctx, outcome in pool.map(run, records):
+            for name, seconds in ctx.timings.items():
+                timings.setdefault(name, []).append(seconds)
+            if outcome:
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if ctx.fields:
+                truth = text_info_for(record)
+                correct["ID"] += ctx.fields.get("ID") == truth["ID"]
+                correct["Name"] += str(ctx.fields.get("Name", "")).upper() == truth["Name"].upper()
+                correct["DOB"] += ctx.fields.get("DOB") == truth["DOB"]
+            if ctx.error:
+                errors[ctx.error] = errors.get(ctx.error, 0) + 1
+    elapsed = time.perf_counter() - start
+
+    n = max(1, len(records))
+    print(f"{len(records)} samples in {elapsed:.1f}s: {len(records) / elapsed:.2f} verifications/s")
+    print("field accuracy: " + ", ".join(f"{k} {v / n:.1%}" for k, v in correct.items()))
+    print("mean stage time (s): " + ", ".join(f"{k} {np.mean(v):.3f}" for k, v in timings.items()))
+    for message, count in sorted(errors.items(), key=lambda item: -item[1]):
+        print(f"  {count:>6}  {message}")
+    if insert:
+        print(f"enrollment: {outcomes}")
+    return correct, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic ID cards and replay driver.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_gen = sub.add_parser("generate", help="Render synthetic cards, selfies and ground truth")
+    p_gen.add_argument("--count", type=int, default=1000)
+    p_gen.add_argument("--start", type=int, default=0, help="First sample index (resume or shard)")
+    p_gen.add_argument("--out", default=os.path.join("data", "bench", "synthetic"))
+    p_gen.add_argument("--seed", type=int, default=0)
+    p_gen.add_argument("--aadhaar-share", type=float, default=0.5)
+    p_gen.add_argument("--duplicate-rate", type=float, default=0.02)
+    p_gen.add_argument("--rotation", type=float, default=8.0, help="Max card rotation in degrees")
+    p_gen.add_argument("--blur", type=int, default=5, help="Max Gaussian blur kernel")
+    p_gen.add_argument("--noise", type=float, default=6.0, help="Max sensor-noise sigma")
+    p_gen.add_argument("--faces", help="Directory of face images (default: the sample selfies)")
+    p_gen.add_argument("--no-images", action="store_true", help="Ground truth only (for --mode db replays)")
+    p_gen.add_argument("--workers", type=int)
+    p_replay = sub.add_parser("replay", help="Drive generated samples through the pipeline or the DB path")
+    p_replay.add_argument("--truth", required=True)
+    p_replay.add_argument("--mode", choices=["pipeline", "db"], default="pipeline")
+    p_replay.add_argument("--limit", type=int)
+    p_replay.add_argument("--workers", type=int, default=4)
+    p_replay.add_argument("--insert", action="store_true", help="pipeline mode: also check + insert")
+    p_replay.add_argument("--backend", choices=["mysql", "sqlite", "memory"],
+                          help="Override STORAGE_BACKEND (sqlite writes to data/bench/replay.sqlite3)")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        faces = sorted(glob.glob(os.path.join(args.faces, "*"))) if args.faces else None
+        path = generate(args.count, args.out, start=args.start, seed=args.seed, aadhaar_share=args.aadhaar_share,
+                        duplicate_rate=args.duplicate_rate, rotation=args.rotation, blur=args.blur,
+                        noise=args.noise, images=not args.no_images, face_paths=faces, workers=args.workers)
+        print(f"Ground truth: {path}")
+    else:
+        if args.backend:
+            from storage import BACKENDS, set_backend
+
+            if args.backend == "sqlite":
+                set_backend(BACKENDS["sqlite"](os.path.join("data", "bench", "replay.sqlite3")))
+            else:
+                set_backend(BACKENDS[args.backend]())
+        logging.getLogger().setLevel(logging.WARNING)
+        truth = load_truth(args.truth, args.limit)
+        if args.mode == "db":
+            replay_db(truth, workers=args.workers)
+        else:
+            replay_pipeline(truth, workers=args.workers, insert=args.insert)